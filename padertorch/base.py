@@ -56,6 +56,11 @@ class Module(nn.Module, Configurable, abc.ABC):
         Returns:
         
         
+        When a tensor checkpoint (`ckpt_*.tensors`, see
+        `Trainer(tensor_checkpoint=True)`) exists next to the checkpoint,
+        only the tensors under `in_checkpoint_path` are memory mapped,
+        instead of unpickling the whole checkpoint (e.g. the optimizer
+        state).
         """
         config_path = Path(config_path).expanduser().resolve()
         checkpoint_path = Path(checkpoint_path).expanduser().resolve()
@@ -70,6 +75,24 @@ class Module(nn.Module, Configurable, abc.ABC):
         )
 
         # Load weights
+        from padertorch.train.checkpoint import (
+            tensor_checkpoint_path, load_tensor_checkpoint
+        )
+        tensor_path = tensor_checkpoint_path(checkpoint_path)
+        # The tensor checkpoint contains only the model.
+        if (
+            not consider_mpi
+            and f'{in_checkpoint_path}.'.startswith('model.')
+            and tensor_path.exists()
+        ):
+            checkpoint = load_tensor_checkpoint(
+                tensor_path, in_checkpoint_path, map_location=map_location
+            )
+            if len(checkpoint) == 0:
+                raise ValueError(in_checkpoint_path, tensor_path)
+            module.load_state_dict(checkpoint)
+            return module
+
         if consider_mpi:
             from paderbox.utils import mpi
             checkpoint_path_content = mpi.call_on_master_and_broadcast(
@@ -199,6 +222,11 @@ class Model(Module, Configurable, abc.ABC):
                 texts: see tensorboardX documentation
                     logged as snapshot
 
+            The values of histograms, images, audios and figures may be
+            lazy, i.e. a `padertorch.summary.LazyArtifact` or a callable
+            without arguments. They are only evaluated, when the summary is
+            written (lazy histograms are logged as snapshot).
+
 
         Hints:
          - The contextmanager `torch.no_grad()` disables backpropagation for
@@ -220,7 +248,9 @@ class Model(Module, Configurable, abc.ABC):
 
         This method is primarily used by SummaryHook before dumping a summary.
         Summary contains accumulated values from multiple reviews (lists in
-        "scalars" and "histograms", snapshots in "audios" and "images").
+        "scalars", `padertorch.summary.HistogramSketch` in "histograms",
+        snapshots in "audios" and "images"). Scalar tensors are accumulated
+        as a running mean, i.e. their list contains only the mean.
         This, e.g., allows to accurately compute and add metrics based on
         other scalars such as F-scores or Error Rates.
 
@@ -11,9 +11,14 @@ class CPUTimeLimitExceededHookTrigger(Trigger):
     $ ccssignal XCPU <reqid>
     Use `ccsalloc ... --notifyjob=XCPU,60m ...` to let ccs send the signal.
 
-    Shutdown after next epoch (i.e. finish current epoch, good iterator state)
+    Shutdown after next epoch (i.e. finish current epoch)
     $ ccssignal USR1 <reqid>  # Shutdown after next epoch
 
+    In both cases the CheckpointHook writes a checkpoint, when the training
+    ends. The checkpoint contains the position in the current epoch, hence
+    `trainer.train(..., resume=True)` continues in the middle of the epoch
+    (see `Trainer.train`).
+
     """
     def __init__(self):
         self._SIGXCPU_received = False
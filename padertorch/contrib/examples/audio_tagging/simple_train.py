@@ -12,17 +12,21 @@ import torch
 from padercontrib.database.audio_set import AudioSet
 from paderbox.utils.timer import timeStamped
 from padertorch import Model, Trainer, optimizer
+from padertorch.data.cache import FeatureCache
 from padertorch.contrib.je.data.transforms import (
     AudioReader, STFT, MelTransform, Normalizer, LabelEncoder, Collate
 )
 from padertorch.contrib.je.modules.conv import CNN2d
 from torch import nn
 from padertorch.contrib.je.modules.norm import Norm
+from padertorch.contrib.je.modules.sequence_batch import SequenceBatch
 
 storage_dir = str(
     Path(os.environ['STORAGE_ROOT']) / 'audio_tagging' / timeStamped('')[1:]
 )
 os.makedirs(storage_dir, exist_ok=True)
+# The features are cached across the trainings.
+feature_cache_dir = Path(os.environ['STORAGE_ROOT']) / 'audio_tagging' / 'feature_cache'
 
 
 class MultiHotLabelEncoder(LabelEncoder):
@@ -69,10 +73,10 @@ class WALNet(Model):
         )
 
     def forward(self, inputs):
-        x, seq_len = inputs['features'], inputs['seq_len']
-        x = self.in_norm(x, seq_len=seq_len)
-        y, seq_len = self.cnn(x, seq_len=seq_len)
-        return nn.Sigmoid()(y.squeeze(2)), seq_len
+        x = SequenceBatch(inputs['features'], inputs['seq_len'])
+        x = self.in_norm(x)
+        y, seq_len = self.cnn(x)
+        return nn.Sigmoid()(y.data.squeeze(2)), seq_len
 
     def review(self, inputs, outputs):
         # compute loss
@@ -80,10 +84,8 @@ class WALNet(Model):
         targets = inputs['events']
         frame_probs, seq_len = outputs
 
-        seq_len = torch.Tensor(seq_len)[:, None, None].to(frame_probs.device)
-        idx = torch.arange(frame_probs.shape[-1]).to(x.device)
-        mask = (idx < seq_len.long()).float()
-        sequence_probs = (frame_probs * mask).sum(dim=-1) / seq_len.squeeze(-1)
+        mask = SequenceBatch(frame_probs, seq_len).mask()
+        sequence_probs = (frame_probs * mask).sum(dim=-1) / seq_len[:, None]
         bce = nn.BCELoss(reduction='none')(sequence_probs, targets).sum(-1)
 
         # create review including metrics and visualizations
@@ -154,15 +156,16 @@ def prepare_dataset(dataset, training=False):
     audio_reader = AudioReader(
         source_sample_rate=44100, target_sample_rate=44100
     )
-    dataset = dataset.map(audio_reader)
     stft = STFT(
         shift=882, window_length=1764, size=2048, fading=None, pad=False
     )
-    dataset = dataset.map(stft)
     mel_transform = MelTransform(
         sample_rate=44100, fft_length=2048, n_mels=128, fmin=50
     )
-    dataset = dataset.map(mel_transform)
+    dataset = dataset.map(FeatureCache(
+        [audio_reader, stft, mel_transform], feature_cache_dir,
+        keys='mel_transform',
+    ))
     # normalizer = Normalizer(
     #     key='mel_transform', center_axis=(1,), scale_axis=(1, 2),
     #     storage_dir=storage_dir
@@ -12,6 +12,7 @@ from padercontrib.database.librispeech import LibriSpeech
 from paderbox.utils.timer import timeStamped
 from padertorch import Trainer
 from padertorch.contrib.examples.speaker_classification.model import SpeakerClf
+from padertorch.data.cache import FeatureCache
 from padertorch.contrib.je.data.transforms import LabelEncoder, AudioReader, \
     STFT, MelTransform, Normalizer, Collate
 from padertorch.contrib.je.data.utils import split_dataset
@@ -24,6 +25,8 @@ storage_dir = str(
     Path(os.environ['STORAGE_ROOT']) / 'speaker_clf' / timeStamped('')[1:]
 )
 os.makedirs(storage_dir, exist_ok=True)
+# The features are cached across the trainings.
+feature_cache_dir = Path(os.environ['STORAGE_ROOT']) / 'speaker_clf' / 'feature_cache'
 
 
 def get_datasets():
@@ -53,22 +56,22 @@ def prepare_dataset(dataset, training=False):
     audio_reader = AudioReader(
         source_sample_rate=16000, target_sample_rate=16000
     )
-    dataset = dataset.map(audio_reader)
     stft = STFT(
         shift=160, window_length=400, size=512, fading=None, pad=False
     )
-    dataset = dataset.map(stft)
     mel_transform = MelTransform(
         sample_rate=16000, fft_length=512, n_mels=64, fmin=50
     )
-    dataset = dataset.map(mel_transform)
+    dataset = dataset.map(FeatureCache(
+        [audio_reader, stft, mel_transform], feature_cache_dir,
+        keys='mel_transform',
+    ))
     normalizer = Normalizer(
         key='mel_transform', center_axis=(1,), scale_axis=(1, 2),
         storage_dir=storage_dir
     )
     normalizer.initialize_moments(
-        dataset.shuffle()[:10000].prefetch(num_workers=8, buffer_size=16),
-        verbose=True
+        dataset.shuffle()[:10000], num_workers=8, verbose=True
     )
     dataset = dataset.map(normalizer)
 
@@ -1,4 +1,9 @@
+import hashlib
 import json
+import os
+import shutil
+import tempfile
+import weakref
 from pathlib import Path
 
 import numpy as np
@@ -7,15 +12,175 @@ import soundfile
 import torch
 from paderbox.transform.module_fbank import MelTransform as BaseMelTransform
 from paderbox.transform.module_stft import STFT as BaseSTFT
-from paderbox.utils.nested import nested_op
+from paderbox.utils.nested import deflatten, flatten, nested_op
+from padertorch.data.statistics import (
+    LabelReducer, MomentsReducer, reduce_dataset
+)
+from padertorch.data.utils import pad_stack
 from padertorch.utils import to_list
-from tqdm import tqdm
+
+
+def _remove_cache_dir(cache_dir, pid):
+    # Only the process that created the directory removes it, e.g. not a
+    # forked worker.
+    if os.getpid() == pid:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+class SharedAudioCache:
+    """
+    A least recently used cache of decoded (and resampled) audio, that is
+    shared between processes.
+
+    Each entry is a `.npy` file in `cache_dir`, which is by default a new
+    directory on the shared memory filesystem (`/dev/shm`), and it is read
+    with a memory map, i.e. the data is in memory once for all processes
+    that use this cache (e.g. a pickled or forked copy in a worker). The
+    modification time of a file is its last access. When the cached files
+    exceed `max_bytes`, the least recently used files are deleted. A file
+    that is deleted while another process reads it stays valid for that
+    process.
+
+    >>> with tempfile.TemporaryDirectory() as cache_dir:
+    ...     cache = SharedAudioCache(max_bytes=1000, cache_dir=cache_dir)
+    ...     cache.put(('a.wav', 0), np.ones((1, 4)))
+    ...     cache.get(('a.wav', 0)), cache.get(('b.wav', 0))
+    (memmap([[1., 1., 1., 1.]]), None)
+
+    Args:
+        max_bytes: The budget of the cached audio.
+        cache_dir: The directory of the entries. Defaults to a new directory
+            in `/dev/shm` (or the temporary directory, when `/dev/shm` does
+            not exist), that is removed by `close` or at exit of the process
+            that created it. Set an explicit directory, to share the cache
+            between runs. An explicit directory is never removed.
+    """
+    def __init__(self, max_bytes, cache_dir=None):
+        if cache_dir is None:
+            root = Path('/dev/shm')
+            if not root.is_dir():
+                root = Path(tempfile.gettempdir())
+            cache_dir = tempfile.mkdtemp(
+                prefix='padertorch_audio_cache_', dir=root)
+            self._finalizer = weakref.finalize(
+                self, _remove_cache_dir, cache_dir, os.getpid())
+        else:
+            self._finalizer = None
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._written_bytes = 0
+
+    def __getstate__(self):
+        # A copy (e.g. in a worker) uses the directory, but does not own it.
+        state = self.__dict__.copy()
+        state['_finalizer'] = None
+        return state
+
+    def close(self):
+        """Removes the default directory, an explicit one is kept."""
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}(max_bytes={self.max_bytes}, '
+            f'cache_dir={str(self.cache_dir)!r})'
+        )
+
+    def _path(self, key):
+        return self.cache_dir / (
+            hashlib.sha1(repr(key).encode()).hexdigest() + '.npy'
+        )
+
+    def get(self, key):
+        """Returns a read only memory map of the entry or None."""
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            # Not cached, incomplete or evicted by another process
+            return None
+        return array
+
+    def put(self, key, array):
+        array = np.asarray(array)
+        if array.nbytes > self.max_bytes:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        # Write and rename, that other processes never read an incomplete
+        # file.
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.cache_dir, suffix='.tmp', prefix=path.stem)
+        try:
+            fid = os.fdopen(fd, 'wb')
+        except BaseException:
+            os.close(fd)
+            os.unlink(tmp_path)
+            raise
+        try:
+            with fid:
+                np.save(fid, array)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        # Scan the directory only, when a relevant amount was written.
+        self._written_bytes += array.nbytes
+        if self._written_bytes > self.max_bytes // 20:
+            self._written_bytes = 0
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used entries, to satisfy the budget."""
+        entries = []
+        for path in self.cache_dir.glob('*.npy'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum([size for _, size, _ in entries])
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
 
 
 class AudioReader:
-    def __init__(self, source_sample_rate=16000, target_sample_rate=16000):
+    """
+    Reads (and resamples) the audio of an example.
+
+    Args:
+        source_sample_rate: The sample rate of the audio files.
+        target_sample_rate: The sample rate of the returned audio.
+        cache_bytes: If not None, the decoded and resampled audio is cached
+            in a `SharedAudioCache` with this budget, that is shared between
+            the processes (e.g. the prefetch workers).
+        cache_dir: See `SharedAudioCache`.
+        cache_full_files: If True, a read of a range decodes the full file
+            and caches it, and later reads of any range of the file are
+            sliced from the cache. Note, that a range of a resampled full
+            file may slightly differ at the boundaries from a resampled
+            range. If False, each range is cached separately.
+    """
+    def __init__(
+            self, source_sample_rate=16000, target_sample_rate=16000,
+            cache_bytes=None, cache_dir=None, cache_full_files=True,
+    ):
         self.source_sample_rate = source_sample_rate
         self.target_sample_rate = target_sample_rate
+        self.cache = None if cache_bytes is None \
+            else SharedAudioCache(cache_bytes, cache_dir)
+        self.cache_full_files = cache_full_files
 
     def read_file(self, filepath, start_sample=0, stop_sample=None):
         if isinstance(filepath, (list, tuple)):
@@ -32,6 +197,36 @@ class AudioReader:
                 )
             ], axis=-1)
 
+        if self.cache is not None:
+            return self._read_cached(filepath, start_sample, stop_sample)
+        return self._decode(filepath, start_sample, stop_sample)
+
+    def _read_cached(self, filepath, start_sample, stop_sample):
+        filepath = str(filepath)
+        mtime = os.stat(filepath).st_mtime_ns
+
+        def key(start, stop):
+            return filepath, mtime, start, stop, self.target_sample_rate
+
+        full = self.cache.get(key(0, None))
+        if full is None and (start_sample or stop_sample is not None):
+            x = self.cache.get(key(start_sample, stop_sample))
+            if x is not None:
+                return np.array(x)
+            if not self.cache_full_files:
+                x = self._decode(filepath, start_sample, stop_sample)
+                self.cache.put(key(start_sample, stop_sample), x)
+                return x
+        if full is None:
+            full = self._decode(filepath)
+            self.cache.put(key(0, None), full)
+        # The start and stop are in samples of the source sample rate.
+        ratio = self.target_sample_rate / self.source_sample_rate
+        start = int(round(start_sample * ratio))
+        stop = None if stop_sample is None else int(round(stop_sample * ratio))
+        return np.array(full[..., start:stop])
+
+    def _decode(self, filepath, start_sample=0, stop_sample=None):
         filepath = str(filepath)
         x, sr = soundfile.read(
             filepath, start=start_sample, stop=stop_sample, always_2d=True
@@ -101,68 +296,61 @@ class Normalizer:
         example[self.key] = self.normalize(example[self.key])
         return example
 
-    def initialize_moments(self, dataset=None, verbose=False):
+    @property
+    def filepath(self):
+        return None if self.storage_dir is None \
+            else self.storage_dir / f"{self.key}_moments_{self.name}.json" \
+            if self.name else self.storage_dir / f"{self.key}_moments.json"
+
+    def restore_statistics(self, verbose=False):
+        """Loads the moments from the storage_dir, if they exist."""
+        filepath = self.filepath
+        if filepath is None or not filepath.exists():
+            return False
+        with filepath.open() as fid:
+            mean, scale = json.load(fid)
+        if verbose:
+            print(f'Restored moments from {filepath}')
+        self.moments = np.array(mean), np.array(scale)
+        return True
+
+    def get_reducer(self):
+        return MomentsReducer(self.key, self.center_axis, self.scale_axis)
+
+    def set_statistics(self, moments, verbose=False):
+        """Sets the moments and saves them in the storage_dir."""
+        mean, scale = moments
+        filepath = self.filepath
+        if filepath is not None:
+            with filepath.open('w') as fid:
+                json.dump(
+                    (mean.tolist(), scale.tolist()), fid,
+                    sort_keys=True, indent=4
+                )
+            if verbose:
+                print(f'Saved moments to {filepath}')
+        self.moments = np.array(mean), np.array(scale)
+
+    def initialize_moments(
+            self, dataset=None, verbose=False, num_workers=0,
+            checkpoint_file=None,
+    ):
         """
         Loads or computes the global mean (center) and scale over a dataset.
 
         Args:
             dataset: lazy dataset providing example dicts
             verbose:
+            num_workers: see `initialize_statistics`
+            checkpoint_file: see `initialize_statistics`
 
         Returns:
 
         """
-        filepath = None if self.storage_dir is None \
-            else self.storage_dir / f"{self.key}_moments_{self.name}.json" \
-            if self.name else self.storage_dir / f"{self.key}_moments.json"
-        if filepath is not None and Path(filepath).exists():
-            with filepath.open() as fid:
-                mean, scale = json.load(fid)
-            if verbose:
-                print(f'Restored moments from {filepath}')
-        else:
-            assert dataset is not None
-            mean = 0.
-            mean_count = 0
-            energy = 0.
-            energy_count = 0
-            for example in tqdm(dataset, disable=not verbose):
-                x = example[self.key]
-                if self.center_axis is not None:
-                    if not mean_count:
-                        mean = np.sum(x, axis=self.center_axis, keepdims=True)
-                    else:
-                        mean += np.sum(x, axis=self.center_axis, keepdims=True)
-                    mean_count += np.prod(
-                        np.array(x.shape)[np.array(self.center_axis)]
-                    )
-                if self.scale_axis is not None:
-                    if not energy_count:
-                        energy = np.sum(x**2, axis=self.scale_axis, keepdims=True)
-                    else:
-                        energy += np.sum(x**2, axis=self.scale_axis, keepdims=True)
-                    energy_count += np.prod(
-                        np.array(x.shape)[np.array(self.scale_axis)]
-                    )
-            if self.center_axis is not None:
-                mean /= mean_count
-            if self.scale_axis is not None:
-                energy /= energy_count
-                scale = np.sqrt(np.mean(
-                    energy - mean ** 2, axis=self.scale_axis, keepdims=True
-                ))
-            else:
-                scale = np.array(1.)
-
-            if filepath is not None:
-                with filepath.open('w') as fid:
-                    json.dump(
-                        (mean.tolist(), scale.tolist()), fid,
-                        sort_keys=True, indent=4
-                    )
-                if verbose:
-                    print(f'Saved moments to {filepath}')
-        self.moments = np.array(mean), np.array(scale)
+        initialize_statistics(
+            dataset, [self], num_workers=num_workers,
+            checkpoint_file=checkpoint_file, verbose=verbose,
+        )
 
 
 class LabelEncoder:
@@ -181,25 +369,37 @@ class LabelEncoder:
         example[self.label_key] = np.array(encode(example[self.label_key]))
         return example
 
-    def initialize_labels(self, dataset=None, verbose=False):
-        filepath = None if self.storage_dir is None \
+    @property
+    def filepath(self):
+        return None if self.storage_dir is None \
             else (self.storage_dir / f"{self.label_key}.json").expanduser().absolute()
-        if filepath and Path(filepath).exists():
-            with filepath.open() as fid:
-                labels = json.load(fid)
+
+    def restore_statistics(self, verbose=False):
+        """Loads the labels from the storage_dir, if they exist."""
+        filepath = self.filepath
+        if filepath is None or not filepath.exists():
+            return False
+        with filepath.open() as fid:
+            labels = json.load(fid)
+        if verbose:
+            print(f'Restored labels from {filepath}')
+        self._set_labels(labels)
+        return True
+
+    def get_reducer(self):
+        return LabelReducer(self.label_key)
+
+    def set_statistics(self, labels, verbose=False):
+        """Sets the labels and saves them in the storage_dir."""
+        filepath = self.filepath
+        if filepath:
+            with filepath.open('w') as fid:
+                json.dump(labels, fid, indent=4)
             if verbose:
-                print(f'Restored labels from {filepath}')
-        else:
-            labels = set()
-            for example in dataset:
-                labels.update(to_list(example[self.label_key]))
-            labels = sorted(labels)
-            if filepath:
-                with filepath.open('w') as fid:
-                    json.dump(labels, fid, indent=4)
-                if verbose:
-                    print(f'Saved labels to {filepath}')
+                print(f'Saved labels to {filepath}')
+        self._set_labels(labels)
 
+    def _set_labels(self, labels):
         self.label_mapping = {
             label: i for i, label in enumerate(labels)
         }
@@ -207,6 +407,74 @@ class LabelEncoder:
             i: label for label, i in self.label_mapping.items()
         }
 
+    def initialize_labels(
+            self, dataset=None, verbose=False, num_workers=0,
+            checkpoint_file=None,
+    ):
+        initialize_statistics(
+            dataset, [self], num_workers=num_workers,
+            checkpoint_file=checkpoint_file, verbose=verbose,
+        )
+
+
+def initialize_statistics(
+        dataset, transforms, reducers=None, num_workers=0, chunk_size=1000,
+        checkpoint_file=None, verbose=False,
+):
+    """
+    Initializes the statistics of multiple transforms (e.g. `Normalizer`
+    and `LabelEncoder`) and computes additional statistics in a single pass
+    over the dataset (see `padertorch.data.reduce_dataset`). The
+    transforms, whose statistics are restored from their storage_dir, are
+    skipped.
+
+    >>> dataset = [
+    ...     {'x': np.full((1, 2, 3), i, dtype=np.float32), 'label': str(i)}
+    ...     for i in range(4)
+    ... ]
+    >>> normalizer = Normalizer('x', center_axis=(1,), scale_axis=(1, 2))
+    >>> label_encoder = LabelEncoder('label')
+    >>> initialize_statistics(
+    ...     dataset, [normalizer, label_encoder],
+    ...     reducers={'labels': LabelReducer('label')},
+    ... )
+    {'labels': ['0', '1', '2', '3']}
+    >>> normalizer.moments[0]
+    array([[[1.5, 1.5, 1.5]]])
+    >>> label_encoder.label_mapping
+    {'0': 0, '1': 1, '2': 2, '3': 3}
+
+    Args:
+        dataset: The dataset, see `padertorch.data.reduce_dataset`.
+        transforms: Objects with the methods `restore_statistics`,
+            `get_reducer` and `set_statistics`.
+        reducers: A dict of additional `padertorch.data.Reducer`s.
+        num_workers: The number of worker processes.
+        chunk_size: The number of examples, that a worker reduces at once.
+        checkpoint_file: The file to store the partial results, that an
+            interrupted pass can be continued.
+        verbose:
+
+    Returns:
+        The results of the additional reducers.
+    """
+    reducers = {} if reducers is None else dict(reducers)
+    pending = {}
+    for i, transform in enumerate(transforms):
+        if not transform.restore_statistics(verbose=verbose):
+            pending[f'_transform_{i}'] = transform
+            reducers[f'_transform_{i}'] = transform.get_reducer()
+    if not reducers:
+        return {}
+    assert dataset is not None
+    results = reduce_dataset(
+        dataset, reducers, num_workers=num_workers, chunk_size=chunk_size,
+        checkpoint_file=checkpoint_file, verbose=verbose,
+    )
+    for name, transform in pending.items():
+        transform.set_statistics(results.pop(name), verbose=verbose)
+    return results
+
 
 class Collate:
     """
@@ -232,40 +500,81 @@ class Collate:
             [[1., 1.],
              [1., 1.],
              [1., 1.]]], dtype=torch.float64), 'b': ['0', '1']}
+
+    >>> batch = Collate(return_lengths=True)(batch)
+    >>> batch['a_seq_len']
+    array([5, 3])
+    >>> batch['a_mask']
+    array([[ True,  True,  True,  True,  True],
+           [ True,  True,  True, False, False]])
+
+    Args:
+        stack_arrays: If True, the numpy arrays are padded and stacked (see
+            `padertorch.data.utils.pad_stack`).
+        cut_end: If True, the arrays are cut to the shortest array instead
+            of padded to the longest.
+        to_tensor: If True, the stacked arrays are converted to tensors.
+        memory: None, 'pinned' or 'shared', see `pad_stack`.
+        return_lengths: If True, the examples have to be dicts and for each
+            stacked array `<key>` the lengths along the padded axis are
+            added as `<key>_seq_len` (numpy array) and the mask of the
+            valid values with the shape (batch size, padded length) as
+            `<key>_mask` (converted to a tensor, when `to_tensor` is True).
+            Requires `stack_arrays`.
     """
-    def __init__(self, stack_arrays=True, cut_end=False, to_tensor=False):
+    def __init__(
+            self, stack_arrays=True, cut_end=False, to_tensor=False,
+            memory=None, return_lengths=False,
+    ):
+        assert stack_arrays or not return_lengths, (
+            stack_arrays, return_lengths)
         self.stack_arrays = stack_arrays
         self.cut_end = cut_end
         self.to_tensor = to_tensor
+        self.memory = memory
+        self.return_lengths = return_lengths
 
     def __call__(self, example):
+        if self.return_lengths:
+            return self.collate_with_lengths(example)
         example = nested_op(self.collate, *example, sequence_type=())
         return example
 
     def collate(self, *batch):
         batch = list(batch)
         if self.stack_arrays and isinstance(batch[0], np.ndarray):
-            shapes = [array.shape for array in batch]
-            if self.cut_end:
-                target_shape = np.min(shapes, axis=0)
-            else:
-                target_shape = np.max(shapes, axis=0)
-            for i, array in enumerate(batch):
-                diff = target_shape - array.shape
-                assert np.argwhere(diff != 0).size <= 1, (
-                    diff, 'arrays are only allowed to differ in one dim',
-                )
-                if np.any(diff > 0):
-                    pad = [(0, n) for n in diff]
-                    batch[i] = np.pad(array, pad_width=pad, mode='constant')
-                elif np.any(diff < 0):
-                    sliceing = [slice(None) if n >= 0 else slice(n) for n in diff]
-                    batch[i] = array[tuple(sliceing)]
-            batch = np.array(batch).astype(batch[0].dtype)
+            batch = pad_stack(
+                batch, cut_end=self.cut_end, memory=self.memory)
             if self.to_tensor:
                 batch = torch.from_numpy(batch)
         return batch
 
+    def collate_with_lengths(self, batch):
+        batch = [flatten(example, sep=None) for example in batch]
+        collated = {}
+        for key in batch[0]:
+            values = [example[key] for example in batch]
+            if not isinstance(values[0], np.ndarray):
+                collated[key] = values
+                continue
+            array, seq_len, mask = pad_stack(
+                values, cut_end=self.cut_end, memory=self.memory,
+                return_lengths=True, return_mask=True,
+            )
+            collated[key] = array
+            if seq_len is not None:
+                *prefix, name = key
+                collated[(*prefix, f'{name}_seq_len')] = seq_len
+                collated[(*prefix, f'{name}_mask')] = mask
+        if self.to_tensor:
+            collated = {
+                key: torch.from_numpy(value)
+                if isinstance(value, np.ndarray)
+                and not key[-1].endswith('_seq_len') else value
+                for key, value in collated.items()
+            }
+        return deflatten(collated, sep=None)
+
 
 def fragment_parallel_signals(
         signals, axis, step, max_length, min_length=1, *,
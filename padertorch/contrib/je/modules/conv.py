@@ -7,6 +7,9 @@ from padertorch.base import Module
 from padertorch.ops.mappings import ACTIVATION_FN_MAP
 from padertorch.utils import to_list
 from padertorch.contrib.je.modules.norm import Norm
+from padertorch.contrib.je.modules.sequence_batch import (
+    SequenceBatch, as_sequence_batch, lengths_to_numpy
+)
 from torch import nn
 from copy import copy
 from einops import rearrange
@@ -17,6 +20,14 @@ def to_pair(x):
     return tuple(to_list(x, 2))
 
 
+def _div_lengths(lengths, divisor, ceil):
+    if divisor == 1:
+        return lengths
+    if ceil:
+        lengths = lengths + divisor - 1
+    return torch.div(lengths, divisor, rounding_mode='floor')
+
+
 class Pad(Module):
     """
     Adds padding of a certain size either to front, end or both.
@@ -181,34 +192,57 @@ class _Conv(Module):
                 torch.nn.init.zeros_(self.gate_conv.bias)
 
     def forward(self, x, seq_len=None, out_shape=None, out_lengths=None):
+        """
+
+        Args:
+            x: A tensor or a SequenceBatch.
+            seq_len: The lengths of the sequences, if x is a tensor.
+            out_shape:
+            out_lengths:
+
+        Returns:
+            The output and its lengths. If x is a SequenceBatch, the output
+            is a SequenceBatch and the lengths are a tensor, else the output
+            is a tensor and the lengths are a numpy array.
+        """
+        batch = as_sequence_batch(x, seq_len)
+        x_ = batch.data
         if self.training and self.dropout > 0.:
-            x = F.dropout(x, self.dropout)
+            x_ = F.dropout(x_, self.dropout)
 
         if self.pre_activation:
             if self.norm is not None:
-                x = self.norm(x, seq_len=seq_len)
-            x = self.activation_fn(x)
+                x_ = self.norm(batch.replace(data=x_)).data
+            x_ = self.activation_fn(x_)
 
         if not self.is_transpose():
-            x = self.pad_or_trim(x)
+            x_ = self.pad_or_trim(x_)
 
-        y = self.conv(x)
+        y = self.conv(x_)
         if out_lengths is not None:
-            seq_len = out_lengths
-        elif seq_len is not None:
-            seq_len = self.get_out_lengths(seq_len)
+            lengths = out_lengths
+        elif batch.lengths is not None:
+            lengths = self.get_out_lengths(batch.lengths)
+        else:
+            lengths = None
+
+        # Keeps the mask cache, if the lengths are unchanged.
+        y_batch = batch.replace(data=y, lengths=lengths)
 
         if not self.pre_activation:
             if self.norm is not None:
-                y = self.norm(y, seq_len=seq_len)
+                y = self.norm(y_batch).data
             y = self.activation_fn(y)
         if self.gated:
-            g = self.gate_conv(x)
+            g = self.gate_conv(x_)
             y = y * torch.sigmoid(g)
 
         if self.is_transpose():
             y = self.trim_padded_or_pad_trimmed(y, out_shape)
-        return y, seq_len
+        y_batch = y_batch.replace(data=y)
+        if isinstance(x, SequenceBatch):
+            return y_batch, y_batch.lengths
+        return y_batch.data, lengths_to_numpy(y_batch.lengths)
 
     def pad_or_trim(self, x):
         pad_dims = [side is not None for side in to_list(self.pad_side)]
@@ -269,9 +303,26 @@ class _Conv(Module):
         """
         L_{out} = (L_{in} - 1) \times \text{stride} - 2 \times \text{padding}
                     + \text{kernel\_size} + \text{output\_padding}
+
+        Tensor lengths are computed on their device. The input tensor is
+        returned, if the lengths do not change.
+
         Returns:
 
         """
+        if torch.is_tensor(in_lengths):
+            assert in_lengths.dim() == 1, in_lengths.dim()
+            if self.is_transpose():
+                raise NotImplementedError
+            out_lengths = in_lengths
+            if to_list(self.pad_side)[-1] is None:
+                out_lengths = out_lengths - (
+                    to_list(self.dilation)[-1]
+                    * (to_list(self.kernel_size)[-1] - 1)
+                )
+            return _div_lengths(
+                out_lengths, to_list(self.stride)[-1], ceil=True
+            )
         out_lengths = np.array(in_lengths)
         assert out_lengths.ndim == 1, out_lengths.ndim
         if self.is_transpose():
@@ -313,29 +364,38 @@ class Pool1d(Module):
         self.pad_side = pad_side
 
     def forward(self, x, seq_len=None):
+        """
+        Returns the pooled x, its lengths and the pool indices. If x is a
+        SequenceBatch, the output is a SequenceBatch and the lengths are a
+        tensor.
+        """
         if self.pool_size < 2:
             return x, seq_len, None
+        batch = as_sequence_batch(x, seq_len)
+        x_ = batch.data
         if self.pad_side is not None:
-            pad_size = self.pool_size - 1 - ((x.shape[-1] - 1) % self.pool_size)
-            x = Pad(side=self.pad_side)(x, size=pad_size)
-        x = Trim(side='both')(x, size=x.shape[2] % self.pool_size)
+            pad_size = self.pool_size - 1 - ((x_.shape[-1] - 1) % self.pool_size)
+            x_ = Pad(side=self.pad_side)(x_, size=pad_size)
+        x_ = Trim(side='both')(x_, size=x_.shape[2] % self.pool_size)
         if self.pool_type == 'max':
-            x, pool_indices = nn.MaxPool1d(
+            x_, pool_indices = nn.MaxPool1d(
                 kernel_size=self.pool_size, return_indices=True
-            )(x)
+            )(x_)
         elif self.pool_type == 'avg':
-            x = nn.AvgPool1d(kernel_size=self.pool_size)(x)
+            x_ = nn.AvgPool1d(kernel_size=self.pool_size)(x_)
             pool_indices = None
         else:
             raise ValueError(f'{self.pool_type} pooling unknown.')
 
-        if seq_len is not None:
-            seq_len = seq_len / self.pool_size
-            if self.pad_side is None:
-                seq_len = np.floor(seq_len).astype(np.int)
-            else:
-                seq_len = np.ceil(seq_len).astype(np.int)
-        return x, seq_len, pool_indices
+        lengths = batch.lengths
+        if lengths is not None:
+            lengths = _div_lengths(
+                lengths, self.pool_size, ceil=self.pad_side is not None
+            )
+        batch = batch.replace(data=x_, lengths=lengths)
+        if isinstance(x, SequenceBatch):
+            return batch, batch.lengths, pool_indices
+        return batch.data, lengths_to_numpy(batch.lengths), pool_indices
 
 
 class Unpool1d(Module):
@@ -349,16 +409,21 @@ class Unpool1d(Module):
     def forward(self, x, seq_len=None, indices=None):
         if self.pool_size < 2:
             return x, seq_len
+        batch = as_sequence_batch(x, seq_len)
+        x_ = batch.data
         if indices is None:
-            x = F.interpolate(x, scale_factor=self.pool_size)
+            x_ = F.interpolate(x_, scale_factor=self.pool_size)
         else:
-            x = nn.MaxUnpool1d(kernel_size=self.pool_size)(
-                x, indices=indices
+            x_ = nn.MaxUnpool1d(kernel_size=self.pool_size)(
+                x_, indices=indices
             )
-        if seq_len is not None:
-            seq_len = seq_len * self.pool_size
-            seq_len = np.maximum(seq_len, x.shape[-1])
-        return x, seq_len
+        lengths = batch.lengths
+        if lengths is not None:
+            lengths = torch.clamp(lengths * self.pool_size, max=x_.shape[-1])
+        batch = batch.replace(data=x_, lengths=lengths)
+        if isinstance(x, SequenceBatch):
+            return batch, batch.lengths
+        return batch.data, lengths_to_numpy(batch.lengths)
 
 
 class Pool2d(Module):
@@ -372,33 +437,42 @@ class Pool2d(Module):
         self.pad_side = to_pair(pad_side)
 
     def forward(self, x, seq_len=None):
+        """
+        Returns the pooled x, its lengths and the pool indices. If x is a
+        SequenceBatch, the output is a SequenceBatch and the lengths are a
+        tensor.
+        """
         if all(np.array(self.pool_size) < 2):
             return x, seq_len, None
+        batch = as_sequence_batch(x, seq_len)
+        x_ = batch.data
         pad_size = (
-            self.pool_size[0] - 1 - ((x.shape[-2] - 1) % self.pool_size[0]),
-            self.pool_size[1] - 1 - ((x.shape[-1] - 1) % self.pool_size[1])
+            self.pool_size[0] - 1 - ((x_.shape[-2] - 1) % self.pool_size[0]),
+            self.pool_size[1] - 1 - ((x_.shape[-1] - 1) % self.pool_size[1])
         )
         pad_size = np.where([pad is None for pad in self.pad_side], 0, pad_size)
         if any(pad_size > 0):
-            x = Pad(side=self.pad_side)(x, size=pad_size)
-        x = Trim(side='both')(x, size=np.array(x.shape[2:]) % self.pool_size)
+            x_ = Pad(side=self.pad_side)(x_, size=pad_size)
+        x_ = Trim(side='both')(x_, size=np.array(x_.shape[2:]) % self.pool_size)
         if self.pool_type == 'max':
-            x, pool_indices = nn.MaxPool2d(
+            x_, pool_indices = nn.MaxPool2d(
                 kernel_size=self.pool_size, return_indices=True
-            )(x)
+            )(x_)
         elif self.pool_type == 'avg':
-            x = nn.AvgPool2d(kernel_size=self.pool_size)(x)
+            x_ = nn.AvgPool2d(kernel_size=self.pool_size)(x_)
             pool_indices = None
         else:
             raise ValueError(f'{self.pool_type} pooling unknown.')
 
-        if seq_len is not None:
-            seq_len = seq_len / self.pool_size[-1]
-            if self.pad_side[-1] is None:
-                seq_len = np.floor(seq_len).astype(np.int)
-            else:
-                seq_len = np.ceil(seq_len).astype(np.int)
-        return x, seq_len, pool_indices
+        lengths = batch.lengths
+        if lengths is not None:
+            lengths = _div_lengths(
+                lengths, self.pool_size[-1], ceil=self.pad_side[-1] is not None
+            )
+        batch = batch.replace(data=x_, lengths=lengths)
+        if isinstance(x, SequenceBatch):
+            return batch, batch.lengths, pool_indices
+        return batch.data, lengths_to_numpy(batch.lengths), pool_indices
 
 
 class Unpool2d(Module):
@@ -412,16 +486,23 @@ class Unpool2d(Module):
     def forward(self, x, seq_len=None, indices=None):
         if all(np.array(self.pool_size) < 2):
             return x, seq_len
+        batch = as_sequence_batch(x, seq_len)
+        x_ = batch.data
         if indices is None:
-            x = F.interpolate(x, scale_factor=self.pool_size)
+            x_ = F.interpolate(x_, scale_factor=self.pool_size)
         else:
-            x = nn.MaxUnpool2d(kernel_size=self.pool_size)(
-                x, indices=indices
+            x_ = nn.MaxUnpool2d(kernel_size=self.pool_size)(
+                x_, indices=indices
             )
-        if seq_len is not None:
-            seq_len = seq_len * self.pool_size[-1]
-            seq_len = np.maximum(seq_len, x.shape[-1])
-        return x, seq_len
+        lengths = batch.lengths
+        if lengths is not None:
+            lengths = torch.clamp(
+                lengths * self.pool_size[-1], max=x_.shape[-1]
+            )
+        batch = batch.replace(data=x_, lengths=lengths)
+        if isinstance(x, SequenceBatch):
+            return batch, batch.lengths
+        return batch.data, lengths_to_numpy(batch.lengths)
 
 
 class _CNN(Module):
@@ -594,10 +675,32 @@ class _CNN(Module):
         self.layer_in_channels = layer_in_channels
 
     def forward(self, x, seq_len=None, out_shapes=None, out_lengths=None, pool_indices=None):
+        """
+        If x is a tensor, it is wrapped in a SequenceBatch once, i.e. the
+        lengths are computed on the device of x in all layers and each
+        mask is built once per shape. The output is converted back at the
+        end.
+
+        Args:
+            x: A tensor or a SequenceBatch.
+            seq_len: The lengths of the sequences, if x is a tensor.
+            out_shapes:
+            out_lengths:
+            pool_indices:
+
+        Returns:
+            The output and its lengths (and the pool data, if
+            return_pool_data is True). If x is a SequenceBatch, the output
+            is a SequenceBatch and the lengths are tensors, else the output
+            is a tensor and the lengths are numpy arrays.
+        """
         if not self.is_transpose():
             assert out_shapes is None, out_shapes
             assert out_lengths is None, out_lengths
             assert pool_indices is None, pool_indices.shape
+        is_batch = isinstance(x, SequenceBatch)
+        x = as_sequence_batch(x, seq_len)
+        seq_len = x.lengths
         shapes = to_list(copy(out_shapes), self.num_layers)[::-1]
         lengths = to_list(copy(out_lengths), self.num_layers)[::-1]
         pool_indices = to_list(copy(pool_indices), self.num_layers)[::-1]
@@ -613,39 +716,42 @@ class _CNN(Module):
             )
             if self.residual_connections[i] is not None:
                 for dst_idx in self.residual_connections[i]:
-                    residual_skip_signals[dst_idx].append((i, x))
+                    residual_skip_signals[dst_idx].append((i, x.data))
             if self.dense_connections[i] is not None:
                 for dst_idx in sorted(self.dense_connections[i]):
                     if self.is_transpose():
-                        x, x_skip = torch.split(
-                            x,
+                        x_, x_skip = torch.split(
+                            x.data,
                             [
                                 self.layer_in_channels[i],
                                 self.out_channels[dst_idx - 1]
                             ],
                             dim=1
                         )
+                        x = x.replace(data=x_)
                         dense_skip_signals[dst_idx].append((i, x_skip))
                     else:
-                        dense_skip_signals[dst_idx].append((i, x))
+                        dense_skip_signals[dst_idx].append((i, x.data))
             in_shape = x.shape
             in_lengths = seq_len
             x, seq_len = conv(
-                x, seq_len=seq_len, out_shape=shapes[i], out_lengths=lengths[i]
+                x, out_shape=shapes[i], out_lengths=lengths[i]
             )
             shapes[i] = in_shape
             lengths[i] = in_lengths
+            y = x.data
             for src_idx, x_ in dense_skip_signals[i + 1]:
-                x_ = F.interpolate(x_, size=x.shape[2:])
+                x_ = F.interpolate(x_, size=y.shape[2:])
                 if self.is_transpose():
-                    x = x + x_
+                    y = y + x_
                 else:
-                    x = torch.cat((x, x_), dim=1)
+                    y = torch.cat((y, x_), dim=1)
             for src_idx, x_ in residual_skip_signals[i + 1]:
-                x_ = F.interpolate(x_, size=x.shape[2:])
+                x_ = F.interpolate(x_, size=y.shape[2:])
                 if f'{src_idx}->{i+1}' in self.residual_convs:
                     x_, _ = self.residual_convs[f'{src_idx}->{i + 1}'](x_)
-                x = x + x_
+                y = y + x_
+            x = x.replace(data=y)
             x, seq_len, pool_indices[i] = self.maybe_pool(
                 x,
                 pool_type=self.pool_types[i],
@@ -653,6 +759,13 @@ class _CNN(Module):
                 pad_side=self.pad_sides[i],
                 seq_len=seq_len
             )
+        if not is_batch:
+            x = x.data
+            seq_len = lengths_to_numpy(seq_len)
+            lengths = [
+                lengths_to_numpy(l) if torch.is_tensor(l) else l
+                for l in lengths
+            ]
         if self.return_pool_data:
             return x, seq_len, shapes, lengths, pool_indices
         return x, seq_len
@@ -774,6 +887,11 @@ class _CNN(Module):
             if self.pool_types[i] is not None:
                 if self.is_transpose():
                     raise NotImplementedError
+                elif torch.is_tensor(out_lengths):
+                    out_lengths = _div_lengths(
+                        out_lengths, to_list(self.pool_sizes[i])[-1],
+                        ceil=to_list(self.pad_sides[i])[-1] is not None,
+                    )
                 else:
                     out_lengths = out_lengths / to_list(self.pool_sizes[i])[-1]
                     if to_list(self.pad_sides[i])[-1] is None:
@@ -5,6 +5,7 @@ from paderbox.evaluation.event_detection import positive_class_precisions, \
 from padertorch.base import Module, Model
 from padertorch.contrib.je.modules.attention import Transformer
 from padertorch.contrib.je.modules.conv import CNN1d, CNN2d
+from padertorch.contrib.je.modules.sequence_batch import SequenceBatch
 from padertorch.modules.fully_connected import fully_connected_stack
 from padertorch.utils import to_list
 from torch import nn
@@ -48,26 +49,26 @@ class HybridNet(Module):
         self.input_size = input_size
 
     def cnn_2d(self, x, seq_len=None):
+        """
+        x may be a tensor or a SequenceBatch, see `_CNN.forward`.
+        """
         if self._cnn_2d is not None:
-            x = self._cnn_2d(x)
-            if seq_len is not None:
-                in_shape = [
-                    (1024 if self.input_size is None else self.input_size, n)
-                    for n in seq_len
-                ]
-                out_shape = self._cnn_2d.get_out_shape(in_shape)
-                seq_len = [s[-1] for s in out_shape]
+            x, seq_len = self._cnn_2d(x, seq_len)
 
         if x.dim() != 3:
             assert x.dim() == 4
-            x = rearrange(x, 'b c f t -> b (c f) t')
+            if isinstance(x, SequenceBatch):
+                x = x.replace(data=rearrange(x.data, 'b c f t -> b (c f) t'))
+            else:
+                x = rearrange(x, 'b c f t -> b (c f) t')
         return x, seq_len
 
     def cnn_1d(self, x, seq_len=None):
+        """
+        x may be a tensor or a SequenceBatch, see `_CNN.forward`.
+        """
         if self._cnn_1d is not None:
-            x = self._cnn_1d(x)
-            if seq_len is not None:
-                seq_len = self._cnn_1d.get_out_shape(seq_len)
+            x, seq_len = self._cnn_1d(x, seq_len)
         return x, seq_len
 
     def enc(self, x, seq_len=None):
@@ -79,6 +80,9 @@ class HybridNet(Module):
             else:
                 x = rearrange(x, 'b f t -> t b f')
             if seq_len is not None:
+                if torch.is_tensor(seq_len):
+                    # pack_padded_sequence needs the lengths on the cpu
+                    seq_len = seq_len.cpu()
                 x = pack_padded_sequence(
                     x, seq_len, batch_first=self._enc.batch_first
                 )
@@ -101,9 +105,13 @@ class HybridNet(Module):
         return x
 
     def forward(self, x, seq_len=None):
-        x, seq_len = self.cnn_2d(x, seq_len)
-        x, seq_len = self.cnn_1d(x, seq_len)
-        x = self.enc(x, seq_len)
+        # The lengths are moved to the device once and the CNNs compute
+        # the lengths and masks of all layers on the device.
+        x = SequenceBatch(x, seq_len)
+        x, _ = self.cnn_2d(x)
+        x, _ = self.cnn_1d(x)
+        seq_len = x.lengths
+        x = self.enc(x.data, seq_len)
         x = self.out(x, seq_len)
         return x
 
@@ -387,15 +395,13 @@ class TakeLast(nn.Module):
     def __call__(self, x, seq_len=None):
         n = self.n if self.training else 1
         if seq_len is None:
-            x = x[:, -n:]
-        elif n == 1:
-            x = x[torch.arange(x.shape[0]), seq_len - 1].unsqueeze(1)
+            return x[:, -n:]
+        seq_len = torch.as_tensor(seq_len, device=x.device).long()
+        batch_idx = torch.arange(x.shape[0], device=x.device)
+        if n == 1:
+            x = x[batch_idx, seq_len - 1].unsqueeze(1)
         else:
-            b, t, f = x.shape
-            seq_len = np.array(seq_len)[..., None]
-            n = max(int(min(self.n, min(self.r * seq_len))), 1)
-            seq_len = torch.Tensor(seq_len)
-            idx = torch.cumsum(torch.ones((b, t)), dim=1) - 1
-            idx = (idx < seq_len) * (idx >= (seq_len - n))
-            x = x.masked_select(idx.unsqueeze(-1).to(x.device)).view((b, n, f))
+            n = max(int(min(self.n, self.r * seq_len.min().item())), 1)
+            idx = seq_len[:, None] - n + torch.arange(n, device=x.device)
+            x = x[batch_idx[:, None], idx]
         return x
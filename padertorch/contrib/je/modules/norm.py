@@ -1,6 +1,9 @@
 import numpy as np
 import torch
 from padertorch.base import Module
+from padertorch.contrib.je.modules.sequence_batch import (
+    SequenceBatch, as_sequence_batch
+)
 from torch import nn
 
 
@@ -10,38 +13,11 @@ class Norm(Module):
     >>> x, seq_len = 2*torch.ones((3,10,4)), [1, 2, 3]
     >>> mask = norm.compute_mask(x, seq_len=seq_len)
     >>> mask
-    tensor([[[1., 0., 0., 0.],
-             [1., 0., 0., 0.],
-             [1., 0., 0., 0.],
-             [1., 0., 0., 0.],
-             [1., 0., 0., 0.],
-             [1., 0., 0., 0.],
-             [1., 0., 0., 0.],
-             [1., 0., 0., 0.],
-             [1., 0., 0., 0.],
-             [1., 0., 0., 0.]],
+    tensor([[[1., 0., 0., 0.]],
     <BLANKLINE>
-            [[1., 1., 0., 0.],
-             [1., 1., 0., 0.],
-             [1., 1., 0., 0.],
-             [1., 1., 0., 0.],
-             [1., 1., 0., 0.],
-             [1., 1., 0., 0.],
-             [1., 1., 0., 0.],
-             [1., 1., 0., 0.],
-             [1., 1., 0., 0.],
-             [1., 1., 0., 0.]],
+            [[1., 1., 0., 0.]],
     <BLANKLINE>
-            [[1., 1., 1., 0.],
-             [1., 1., 1., 0.],
-             [1., 1., 1., 0.],
-             [1., 1., 1., 0.],
-             [1., 1., 1., 0.],
-             [1., 1., 1., 0.],
-             [1., 1., 1., 0.],
-             [1., 1., 1., 0.],
-             [1., 1., 1., 0.],
-             [1., 1., 1., 0.]]])
+            [[1., 1., 1., 0.]]])
     >>> norm.compute_stats(x, mask)
     (tensor([[[2.],
              [2.],
@@ -199,14 +175,26 @@ class Norm(Module):
             nn.init.zeros_(self.learnable_shift.shift)
 
     def forward(self, x, seq_len=None):
-        mask = self.compute_mask(x, seq_len)
+        """
+
+        Args:
+            x: A tensor or a SequenceBatch.
+            seq_len: The lengths of the sequences, if x is a tensor.
+
+        Returns:
+            The normalized tensor or a SequenceBatch, if x is a
+            SequenceBatch.
+        """
+        batch = as_sequence_batch(x, seq_len)
+        mask = batch.mask(self.batch_axis, self.sequence_axis)
+        y = batch.data
         if (self.training and not self.freezed) or not self.track_running_stats:
-            mean, power, n_values = self.compute_stats(x, mask)
-            x = x - mean
+            mean, power, n_values = self.compute_stats(y, mask)
+            y = y - mean
             if self.scale:
                 n = torch.max(n_values, 2. * torch.ones_like(n_values))
                 var = n / (n - 1.) * (power - mean ** 2)
-                x = x / (torch.sqrt(var) + self.eps)
+                y = y / (torch.sqrt(var) + self.eps)
             if self.track_running_stats:
                 self.num_tracked_values += n_values.data
                 if self.momentum is None:
@@ -219,37 +207,56 @@ class Norm(Module):
                     self.running_power *= momentum
                     self.running_power += (1 - momentum) * power.data
         else:
-            x = x - self.running_mean.data
+            y = y - self.running_mean.data
             if self.scale:
                 n = torch.max(self.num_tracked_values, 2. * torch.ones_like(self.num_tracked_values))
                 running_var = (
                     n / (n - 1.) * (self.running_power - self.running_mean**2)
                 )
-                x = x / (torch.sqrt(running_var).data + self.eps)
+                y = y / (torch.sqrt(running_var).data + self.eps)
 
         if self.learnable_scale is not None:
-            x = self.learnable_scale(x)
+            y = self.learnable_scale(y)
         if self.learnable_shift is not None:
-            x = self.learnable_shift(x)
-        return x * mask
+            y = self.learnable_shift(y)
+        if mask is not None:
+            y = y * mask
+        if isinstance(x, SequenceBatch):
+            return batch.replace(data=y)
+        return y
 
     def compute_mask(self, x, seq_len=None):
-        if seq_len is not None:
-            assert self.sequence_axis is not None, self.sequence_axis
-            seq_len = torch.Tensor(seq_len).long()
-            for dim in range(self.batch_axis + 1, x.dim()):
-                seq_len = seq_len.unsqueeze(-1)
-            idx = torch.arange(x.shape[self.sequence_axis])
-            for dim in range(self.sequence_axis + 1, x.dim()):
-                idx = idx.unsqueeze(-1)
-            mask = (idx < seq_len).float().to(x.device).expand(x.shape)
-        else:
-            mask = torch.ones_like(x)
+        """
+        Returns the mask of x with size 1 on all axes except the batch and
+        the sequence axis, i.e. it broadcasts to the shape of x.
+        """
+        batch = as_sequence_batch(x, seq_len)
+        mask = batch.mask(self.batch_axis, self.sequence_axis)
+        if mask is None:
+            mask = torch.ones(
+                batch.dim() * (1,), dtype=batch.data.dtype,
+                device=batch.data.device,
+            )
         return mask
 
-    def compute_stats(self, x, mask):
-        n_values = mask.sum(dim=self.statistics_axis, keepdim=True)
-        x = x * mask
+    def compute_stats(self, x, mask=None):
+        reduced_shape = [
+            1 if ax in self.statistics_axis else size
+            for ax, size in enumerate(x.shape)
+        ]
+        if mask is None:
+            n_values = x.new_full(reduced_shape, float(np.prod(
+                [x.shape[ax] for ax in self.statistics_axis]
+            )))
+        else:
+            x = x * mask
+            n_values = mask.sum(dim=self.statistics_axis, keepdim=True)
+            # The statistics axes, along which the mask is broadcasted
+            n_values = n_values * float(np.prod([
+                x.shape[ax] for ax in self.statistics_axis
+                if mask.shape[ax] == 1
+            ]))
+            n_values = n_values.expand(reduced_shape)
         mean = x.sum(dim=self.statistics_axis, keepdim=True) / torch.max(n_values, torch.ones_like(n_values))
         if not self.scale:
             return mean, None, n_values
@@ -330,7 +337,7 @@ class ConditionedNorm(Module):
             self.learnable_shift = None
 
     def forward(self, x, conditions, seq_len=None):
-        idx = np.arange(x.shape[0]).astype(np.int)
+        idx = np.arange(x.shape[0])
         sort_idx = np.argsort(conditions).flatten()
         reverse_idx = np.zeros_like(idx)
         reverse_idx[sort_idx] = idx
@@ -0,0 +1,120 @@
+import numpy as np
+import torch
+
+
+class SequenceBatch:
+    """
+    A padded batch together with the lengths of its sequences.
+
+    The lengths are a long tensor on the device of the data, i.e. the
+    lengths of the following layers are computed on the device. The masks
+    are built lazily with a broadcastable shape (the batch and the sequence
+    axis have their full size, all other axes have size 1) and are cached,
+    so a mask is only rebuilt, when the lengths or the shape of the
+    sequence axis change.
+
+    >>> x = SequenceBatch(torch.ones(3, 2, 4), [1, 2, 3])
+    >>> x.lengths
+    tensor([1, 2, 3])
+    >>> x.mask()
+    tensor([[[1., 0., 0., 0.]],
+    <BLANKLINE>
+            [[1., 1., 0., 0.]],
+    <BLANKLINE>
+            [[1., 1., 1., 0.]]])
+    >>> y = x.replace(data=2 * x.data)
+    >>> y.mask() is x.mask()
+    True
+    >>> SequenceBatch(torch.ones(3, 2, 4)).mask() is None
+    True
+
+    Args:
+        data: The padded tensor with the batch axis first.
+        lengths: The lengths of the sequences (list, numpy array or tensor)
+            or None, if no sequence is padded.
+    """
+    def __init__(self, data, lengths=None):
+        self.data = data
+        if lengths is not None:
+            if not torch.is_tensor(lengths):
+                lengths = torch.from_numpy(np.asarray(lengths, np.int64))
+            lengths = lengths.to(device=data.device, dtype=torch.long)
+            assert lengths.dim() == 1, lengths.shape
+        self.lengths = lengths
+        self._masks = {}
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}(shape={tuple(self.data.shape)}, '
+            f'lengths={self.lengths})'
+        )
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def dim(self):
+        return self.data.dim()
+
+    def replace(self, data=None, lengths=None):
+        """
+        Returns a new SequenceBatch with the given data and/or lengths. The
+        mask cache is shared, when the lengths are unchanged (i.e. the same
+        tensor object).
+        """
+        data = self.data if data is None else data
+        if lengths is None or lengths is self.lengths:
+            batch = self.__class__(data)
+            batch.lengths = self.lengths
+            batch._masks = self._masks
+            return batch
+        return self.__class__(data, lengths)
+
+    def mask(self, batch_axis=0, sequence_axis=-1, dtype=None):
+        """
+        Returns the broadcastable mask of the valid values, or None, if the
+        batch has no lengths.
+
+        Args:
+            batch_axis:
+            sequence_axis:
+            dtype: The dtype of the mask, defaults to the dtype of the data.
+        """
+        if self.lengths is None:
+            return None
+        ndim = self.data.dim()
+        batch_axis = batch_axis % ndim
+        sequence_axis = sequence_axis % ndim
+        size = self.data.shape[sequence_axis]
+        dtype = self.data.dtype if dtype is None else dtype
+        key = (ndim, batch_axis, sequence_axis, size, dtype)
+        if key not in self._masks:
+            idx = torch.arange(size, device=self.lengths.device)
+            mask = idx < self.lengths[:, None]
+            if batch_axis > sequence_axis:
+                mask = mask.t()
+            shape = [1] * ndim
+            shape[batch_axis] = len(self.lengths)
+            shape[sequence_axis] = size
+            self._masks[key] = mask.to(dtype).reshape(shape)
+        return self._masks[key]
+
+
+def as_sequence_batch(x, seq_len=None):
+    """
+    Wraps a tensor and its lengths in a SequenceBatch. A SequenceBatch is
+    returned as it is.
+    """
+    if isinstance(x, SequenceBatch):
+        assert seq_len is None or seq_len is x.lengths, (
+            'The lengths of a SequenceBatch can not be overwritten.'
+        )
+        return x
+    return SequenceBatch(x, seq_len)
+
+
+def lengths_to_numpy(lengths):
+    """The numpy lengths of the legacy (tensor, seq_len) interface."""
+    if lengths is None:
+        return None
+    return lengths.cpu().numpy()
@@ -0,0 +1,122 @@
+import pickle
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pytest
+import soundfile
+
+from padertorch.contrib.je.data.transforms import AudioReader, SharedAudioCache
+
+
+def write_wav(directory, name, num_samples=16000, sample_rate=16000):
+    path = Path(directory) / name
+    audio = np.random.RandomState(0).uniform(-.5, .5, num_samples)
+    soundfile.write(str(path), audio, sample_rate, subtype='FLOAT')
+    return path
+
+
+def test_cached_reads_equal_uncached():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = write_wav(tmpdir, 'a.wav')
+        reader = AudioReader()
+        cached_reader = AudioReader(
+            cache_bytes=10**6, cache_dir=Path(tmpdir) / 'cache')
+        for start, stop in [(0, None), (100, 1100), (8000, None)]:
+            np.testing.assert_allclose(
+                cached_reader.read_file(path, start, stop),
+                reader.read_file(path, start, stop),
+            )
+
+
+def test_range_reads_decode_once():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = write_wav(tmpdir, 'a.wav')
+        reader = AudioReader(
+            cache_bytes=10**6, cache_dir=Path(tmpdir) / 'cache')
+        with mock.patch.object(
+                AudioReader, '_decode', wraps=reader._decode
+        ) as decode:
+            for start in range(0, 16000, 4000):
+                x = reader.read_file(path, start, start + 4000)
+                assert x.shape == (1, 4000)
+                assert x.flags.writeable
+        assert decode.call_count == 1
+
+        # A new reader (e.g. in another process) uses the same cache.
+        reader = AudioReader(
+            cache_bytes=10**6, cache_dir=Path(tmpdir) / 'cache')
+        with mock.patch.object(AudioReader, '_decode') as decode:
+            reader.read_file(path, 0, 10)
+        assert decode.call_count == 0
+
+
+def test_cache_per_range():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = write_wav(tmpdir, 'a.wav')
+        reader = AudioReader(
+            cache_bytes=10**6, cache_dir=Path(tmpdir) / 'cache',
+            cache_full_files=False,
+        )
+        with mock.patch.object(
+                AudioReader, '_decode', wraps=reader._decode
+        ) as decode:
+            for _ in range(2):
+                reader.read_file(path, 0, 100)
+                reader.read_file(path, 100, 200)
+        assert decode.call_count == 2
+
+
+def test_resampled_and_evicted():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = [write_wav(tmpdir, f'{i}.wav') for i in range(4)]
+        cache_dir = Path(tmpdir) / 'cache'
+        # Each resampled file has 8000 float32 samples, i.e. 32 kB.
+        reader = AudioReader(
+            source_sample_rate=16000, target_sample_rate=8000,
+            cache_bytes=70_000, cache_dir=cache_dir,
+        )
+        for path in paths:
+            assert reader.read_file(path).shape == (1, 8000)
+        cached = sorted(cache_dir.glob('*.npy'))
+        assert len(cached) == 2, cached
+        assert reader.read_file(paths[0], 1600, 3200).shape == (1, 800)
+
+
+def test_default_cache_dir_per_run():
+    cache = SharedAudioCache(max_bytes=1000)
+    other = SharedAudioCache(max_bytes=1000)
+    assert cache.cache_dir != other.cache_dir
+    cache.put('a', np.ones(4))
+
+    # A copy (e.g. in a worker) shares the entries, but keeps the directory.
+    copy = pickle.loads(pickle.dumps(cache))
+    np.testing.assert_equal(copy.get('a'), np.ones(4))
+    copy.close()
+    assert cache.cache_dir.is_dir()
+
+    cache.close()
+    other.close()
+    assert not cache.cache_dir.exists()
+    assert not other.cache_dir.exists()
+
+    # An explicit directory is shared between runs and never removed.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = SharedAudioCache(max_bytes=1000, cache_dir=tmpdir)
+        cache.put('a', np.ones(4))
+        cache.close()
+        np.testing.assert_equal(
+            SharedAudioCache(max_bytes=1000, cache_dir=tmpdir).get('a'),
+            np.ones(4),
+        )
+
+
+def test_failed_put_leaves_no_files():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = SharedAudioCache(max_bytes=1000, cache_dir=tmpdir)
+        for target in ['os.fdopen', 'numpy.save']:
+            with mock.patch(target, side_effect=OSError), \
+                    pytest.raises(OSError):
+                cache.put('a', np.ones(4))
+            assert list(Path(tmpdir).iterdir()) == [], target
@@ -0,0 +1,80 @@
+import numpy as np
+import torch
+from padertorch.contrib.je.modules.conv import CNN1d, CNN2d
+from padertorch.contrib.je.modules.norm import Norm
+from padertorch.contrib.je.modules.sequence_batch import SequenceBatch
+
+
+def test_mask():
+    x = SequenceBatch(torch.ones(3, 4, 5, 6), np.array([6, 2, 4]))
+    mask = x.mask(batch_axis=0, sequence_axis=-1)
+    assert mask.shape == (3, 1, 1, 6), mask.shape
+    expected = (torch.arange(6) < torch.tensor([6, 2, 4])[:, None]).float()
+    np.testing.assert_equal(mask.squeeze().numpy(), expected.numpy())
+    assert x.mask(0, 3) is mask
+    # time major
+    mask = SequenceBatch(torch.ones(6, 3, 2), x.lengths).mask(
+        batch_axis=1, sequence_axis=0)
+    assert mask.shape == (6, 3, 1), mask.shape
+    np.testing.assert_equal(mask.squeeze().numpy(), expected.t().numpy())
+
+    # The cache is shared with the same lengths, a new shape builds a new
+    # mask.
+    y = x.replace(data=torch.ones(3, 4, 5, 3))
+    assert y.lengths is x.lengths
+    assert y.mask().shape == (3, 1, 1, 3)
+    assert len(x._masks) == 2
+
+
+def test_norm_stats():
+    # The statistics with a broadcastable mask match the full mask.
+    norm = Norm(
+        data_format='bcft', shape=(None, 4, None, None),
+        statistics_axis='bft', independent_axis=None,
+    )
+    x, seq_len = torch.randn(3, 4, 5, 7), [7, 3, 1]
+    full_mask = norm.compute_mask(x, seq_len).expand(x.shape)
+    for stat, expected in zip(
+            norm.compute_stats(x, norm.compute_mask(x, seq_len)),
+            norm.compute_stats(x, full_mask),
+    ):
+        assert stat.shape == (1, 4, 1, 1), stat.shape
+        np.testing.assert_allclose(stat.numpy(), expected.numpy(), rtol=1e-6)
+
+    y = norm(SequenceBatch(x, seq_len))
+    assert isinstance(y, SequenceBatch)
+    np.testing.assert_allclose(
+        y.data.numpy(), norm(x, seq_len).numpy(), atol=1e-6
+    )
+
+
+def test_cnn_sequence_batch():
+    for cnn, x in [
+        (
+            CNN1d(
+                in_channels=3, out_channels=[4, 4, 8], kernel_size=3,
+                stride=[1, 2, 1], pool_size=[2, 1, 1], norm='batch',
+            ),
+            torch.randn(3, 3, 37),
+        ),
+        (
+            CNN2d(
+                in_channels=1, out_channels=[4, 4, 8], kernel_size=3,
+                pad_side=[None, 'both', 'both'], pool_size=[1, 2, 2],
+                norm='batch',
+            ),
+            torch.randn(3, 1, 16, 37),
+        ),
+    ]:
+        seq_len = [37, 20, 9]
+        y, out_lengths = cnn(x, seq_len=seq_len)
+        assert isinstance(out_lengths, np.ndarray), type(out_lengths)
+        np.testing.assert_equal(out_lengths, cnn.get_out_lengths(seq_len))
+
+        y_batch, out_lengths_ = cnn(SequenceBatch(x, seq_len))
+        assert isinstance(y_batch, SequenceBatch)
+        assert out_lengths_ is y_batch.lengths
+        np.testing.assert_equal(out_lengths_.numpy(), out_lengths)
+        np.testing.assert_allclose(
+            y_batch.data.detach().numpy(), y.detach().numpy(), atol=1e-6
+        )
@@ -2,7 +2,7 @@ import numpy as np
 import torch
 
 from padertorch.configurable import Configurable
-from padertorch.data.utils import pad_tensor, collate_fn
+from padertorch.data.utils import pad_stack, collate_fn
 
 
 class Padder(Configurable):
@@ -11,7 +11,8 @@ class Padder(Configurable):
             to_torch: bool = True,
             sort_by_key: str = None,
             padding: bool = True,
-            padding_keys: list = None
+            padding_keys: list = None,
+            return_lengths: bool = False,
     ):
         """
 
@@ -23,44 +24,45 @@ class Padder(Configurable):
             if True all numpy arrays with one variable dim size are padded
         :param padding_keys: list of keys, if no keys are specified all
             keys from the batch are used
+        :param return_lengths: if true, for each padded array `<key>` the
+            lengths along the padded axis are added as `<key>_seq_len`
+            (numpy array) and the mask of the valid values with the shape
+            (batch size, padded length) as `<key>_mask`
         """
         assert not to_torch ^ (padding and to_torch)
         self.to_torch = to_torch
         self.padding = padding
         self.padding_keys = padding_keys
         self.sort_by_key = sort_by_key
+        self.return_lengths = return_lengths
 
     def pad_batch(self, batch):
+        return self._pad_batch(batch)[0]
+
+    def _pad_batch(self, batch):
+        # Returns the padded batch and the lengths and the mask or None.
         if isinstance(batch[0], np.ndarray):
             if batch[0].ndim > 0:
-                dims = np.array(
-                    [[idx for idx in array.shape] for array in batch]).T
-                axis = [idx for idx, dim in enumerate(dims)
-                        if not all(dim == dim[0])]
-
-                assert len(axis) in [0, 1], (
-                    f'only one axis is allowed to differ, '
-                    f'axis={axis} and dims={dims}'
-                )
-                if len(axis) == 1:
-                    axis = axis[0]
-                    pad = max(dims[axis])
-                    array = np.stack([pad_tensor(vec, pad, axis)
-                                      for vec in batch], axis=0)
+                # Only one axis is allowed to differ. The padded batch keeps
+                # the dtype of the arrays.
+                if self.return_lengths:
+                    array, seq_len, mask = pad_stack(
+                        batch, return_lengths=True, return_mask=True)
                 else:
-                    array = np.stack(batch, axis=0)
+                    array, seq_len, mask = pad_stack(batch), None, None
                 complex_dtypes = [np.complex64, np.complex128]
                 if self.to_torch and not array.dtype.kind in {'U', 'S'} \
                         and not array.dtype in complex_dtypes:
-                    return torch.from_numpy(array)
-                else:
-                    return array
+                    array = torch.from_numpy(array)
+                    if mask is not None:
+                        mask = torch.from_numpy(mask)
+                return array, seq_len, mask
             else:
-                return np.array(batch)
+                return np.array(batch), None, None
         elif isinstance(batch[0], int):
-            return np.array(batch)
+            return np.array(batch), None, None
         else:
-            return batch
+            return batch, None, None
 
     def sort(self, batch):
         return sorted(batch, key=lambda x: x[self.sort_by_key], reverse=True)
@@ -84,17 +86,21 @@ class Padder(Configurable):
                     'Empty padding key list was provided default is None'
                 padding_keys = self.padding_keys
 
-            def nested_padding(value, key):
-                if isinstance(value, dict):
-                    return {k: nested_padding(v, k) for k, v in value.items()}
-                else:
-                    if key in padding_keys:
-                        return self.pad_batch(value)
+            def nested_padding(batch):
+                padded = {}
+                for key, value in batch.items():
+                    if isinstance(value, dict):
+                        padded[key] = nested_padding(value)
+                    elif key in padding_keys:
+                        padded[key], seq_len, mask = self._pad_batch(value)
+                        if seq_len is not None:
+                            padded[f'{key}_seq_len'] = seq_len
+                            padded[f'{key}_mask'] = mask
                     else:
-                        return value
+                        padded[key] = value
+                return padded
 
-            return {key: nested_padding(value, key) for key, value in
-                    nested_batch.items()}
+            return nested_padding(nested_batch)
         else:
             assert self.padding_keys is None or len(self.padding_keys) == 0, (
                 'Padding keys have to be None or empty if padding is set to '
@@ -128,3 +128,23 @@ class TestPadderTorch(TestPadderBase):
     sort_by_key = None
     padding = True
     padding_keys = None
+
+
+class TestPadderLengths(unittest.TestCase):
+    def test_lengths(self):
+        inputs = [
+            {'Y_abs': np.ones((num_frames, 3), np.float32),
+             'num_frames': num_frames}
+            for num_frames in [4, 2, 3]
+        ]
+        padded = Padder(to_torch=True, return_lengths=True)(inputs)
+        np.testing.assert_equal(padded['Y_abs_seq_len'], [4, 2, 3])
+        self.assertIsInstance(padded['Y_abs_mask'], torch.Tensor)
+        np.testing.assert_equal(
+            padded['Y_abs_mask'].numpy(),
+            np.arange(4) < np.array([4, 2, 3])[:, None],
+        )
+        self.assertNotIn('num_frames_seq_len', padded)
+
+        padded = Padder(to_torch=True)(inputs)
+        self.assertEqual(set(padded.keys()), {'Y_abs', 'num_frames'})
@@ -1,4 +1,14 @@
 from . import batch
+from . import bucketing
+from . import cache
+from . import loader
+from . import prefetch
+from . import statistics
 from . import utils
 
 from .batch import *
+from .bucketing import *
+from .cache import *
+from .loader import *
+from .prefetch import *
+from .statistics import *
@@ -5,15 +5,175 @@ import torch
 __all__ = [
     'example_to_device',
     'example_to_numpy',
+    'batch_size_of_example',
+    'split_example',
     'Sorter',
 ]
 
 
-def example_to_device(example, device=None):
+def _flatten(example, leaves):
+    """
+    Appends the leaves of a nested structure to `leaves` and returns the
+    structure (a hashable signature, that contains the dtypes of the arrays
+    and tensors, but not the shapes or values).
+    """
+    if isinstance(example, dict):
+        return ('dict', example.__class__, tuple(example.keys()), tuple([
+            _flatten(value, leaves) for value in example.values()
+        ]))
+    elif isinstance(example, (tuple, list)):
+        return ('sequence', example.__class__, tuple([
+            _flatten(element, leaves) for element in example
+        ]))
+    elif torch.is_tensor(example):
+        leaves.append(example)
+        return ('tensor', example.dtype)
+    elif isinstance(example, np.ndarray):
+        leaves.append(example)
+        return ('ndarray', example.dtype)
+    elif hasattr(example, '__dataclass_fields__'):
+        fields = tuple(example.__dataclass_fields__)
+        return ('dataclass', example.__class__, fields, tuple([
+            _flatten(getattr(example, f), leaves) for f in fields
+        ]))
+    else:
+        leaves.append(example)
+        return None
+
+
+def _torch_dtype(numpy_dtype):
+    try:
+        return torch.from_numpy(np.empty(0, dtype=numpy_dtype)).dtype
+    except (TypeError, ValueError):
+        # e.g. strings, objects and non native byte order, torch.from_numpy raises an exception
+        return None
+
+
+class _TransferPlan:
+    """
+    The compiled transfer of one structure (see `_flatten`): The builder of
+    the nested structure and the leaves, that can be copied together,
+    grouped by dtype.
+    """
+    def __init__(self, structure):
+        self.ndarrays = []  # (index, is_complex)
+        self.groups = {}  # torch dtype -> leaf indices
+        self.num_leaves = 0
+        self.build = self._compile(structure)
+
+    def _compile(self, structure):
+        if structure is None or structure[0] in ['tensor', 'ndarray']:
+            index = self.num_leaves
+            self.num_leaves += 1
+            if structure is not None:
+                kind, dtype = structure
+                if kind == 'ndarray':
+                    self.ndarrays.append((index, dtype.kind == 'c'))
+                    dtype = _torch_dtype(dtype)
+                if dtype is not None:
+                    self.groups.setdefault(dtype, []).append(index)
+            return lambda leaves: leaves[index]
+        elif structure[0] == 'dict':
+            _, cls, keys, children = structure
+            builders = [self._compile(child) for child in children]
+            return lambda leaves: cls({
+                key: build(leaves) for key, build in zip(keys, builders)
+            })
+        elif structure[0] == 'sequence':
+            _, cls, children = structure
+            builders = [self._compile(child) for child in children]
+            return lambda leaves: cls([build(leaves) for build in builders])
+        elif structure[0] == 'dataclass':
+            _, cls, fields, children = structure
+            builders = [self._compile(child) for child in children]
+            return lambda leaves: cls(**{
+                f: build(leaves) for f, build in zip(fields, builders)
+            })
+        else:
+            raise ValueError(structure)
+
+    def __call__(self, leaves, device, convert_complex):
+        for index, is_complex in self.ndarrays:
+            if convert_complex or not is_complex:
+                leaves[index] = torch.from_numpy(leaves[index])
+
+        if device is not None:
+            device = torch.device(device)
+            if device.type == 'cpu':
+                for indices in self.groups.values():
+                    for index in indices:
+                        if torch.is_tensor(leaves[index]):
+                            leaves[index] = leaves[index].to(device=device)
+            else:
+                for indices in self.groups.values():
+                    self._coalesced_copy(leaves, indices, device)
+        return self.build(leaves)
+
+    @staticmethod
+    def _coalesced_copy(leaves, indices, device):
+        """
+        Copies the cpu tensors `leaves[indices]` (same dtype) with a single
+        host to device copy from a (pinned) staging buffer. The tensors on
+        the device are views of one buffer.
+        """
+        staged = []
+        for index in indices:
+            tensor = leaves[index]
+            if not torch.is_tensor(tensor) or tensor.device == device:
+                # complex numpy arrays with convert_complex=False
+                continue
+            if tensor.device.type != 'cpu' or tensor.requires_grad:
+                # Keep the autograd graph, tensors on other devices
+                leaves[index] = tensor.to(device=device, non_blocking=True)
+                continue
+            staged.append(index)
+        if len(staged) == 0:
+            return
+
+        numels = [leaves[index].numel() for index in staged]
+        staging = torch.empty(
+            sum(numels), dtype=leaves[staged[0]].dtype,
+            pin_memory=device.type == 'cuda',
+        )
+        offset = 0
+        for index, numel in zip(staged, numels):
+            staging[offset:offset + numel].view(leaves[index].shape).copy_(
+                leaves[index])
+            offset += numel
+        # The staging buffer is allocated per call, so the non blocking copy
+        # cannot be overwritten by the next example.
+        buffer = staging.to(device=device, non_blocking=True)
+        offset = 0
+        for index, numel in zip(staged, numels):
+            leaves[index] = buffer[offset:offset + numel].view(
+                leaves[index].shape)
+            offset += numel
+
+
+_TRANSFER_PLANS = {}
+_MAX_TRANSFER_PLANS = 256
+
+
+def example_to_device(example, device=None, convert_complex=True):
     """
     Moves a nested structure to the device.
-    Numpy arrays are converted to torch.Tensor, except complex numpy arrays
-    that aren't supported in the moment in torch.
+    Numpy arrays are converted to torch.Tensor (complex numpy arrays to
+    complex tensors, when `convert_complex` is True).
+
+    The structure of the example (the containers and the dtypes of the
+    leaves) is compiled once into a transfer plan and cached, hence the
+    following examples with the same structure only flatten the example,
+    copy the leaves and rebuild the containers.
+    For a cuda device, the cpu tensors (and numpy arrays) with the same dtype
+    are copied into one pinned staging buffer and transferred with a single
+    non blocking copy. The tensors on the device are views of this buffer.
+
+    >>> example_to_device({'a': np.array([1, 2]), 'b': [np.ones(1)], 'c': 'c'})
+    {'a': tensor([1, 2]), 'b': [tensor([1.], dtype=torch.float64)], 'c': 'c'}
+    >>> example_to_device({'Y': np.array([1j], dtype=np.complex64)})
+    {'Y': tensor([0.+1.j])}
+    >>> example_to_device({'Y': np.array([1j])}, convert_complex=False)
+    {'Y': array([0.+1.j])}
 
     The original doctext from torch for `.to`:
     Tensor.to(device=None, dtype=None, non_blocking=False, copy=False) → Tensor
@@ -27,43 +187,22 @@ def example_to_device(example, device=None):
     Args:
         example:
         device: None, 'cpu', 0, 1, ...
+        convert_complex: If False, complex numpy arrays are not converted
+            (the behaviour of older versions).
 
     Returns:
         example on device
 
     """
-
-    if isinstance(example, dict):
-        return example.__class__({
-            key: example_to_device(value, device=device)
-            for key, value in example.items()
-        })
-    elif isinstance(example, (tuple, list)):
-        return example.__class__([
-            example_to_device(element, device=device)
-            for element in example
-        ])
-    elif torch.is_tensor(example):
-        return example.to(device=device)
-    elif isinstance(example, np.ndarray):
-        if example.dtype in [np.complex64, np.complex128]:
-            # complex is not supported
-            return example
-        else:
-            # TODO: Do we need to ensure tensor.is_contiguous()?
-            # TODO: If not, the representer of the tensor does not work.
-            return example_to_device(
-                torch.from_numpy(example), device=device
-            )
-    elif hasattr(example, '__dataclass_fields__'):
-        return example.__class__(
-            **{
-                f: example_to_device(getattr(example, f), device=device)
-                for f in example.__dataclass_fields__
-            }
-        )
-    else:
-        return example
+    leaves = []
+    structure = _flatten(example, leaves)
+    try:
+        plan = _TRANSFER_PLANS[structure]
+    except KeyError:
+        if len(_TRANSFER_PLANS) >= _MAX_TRANSFER_PLANS:
+            _TRANSFER_PLANS.clear()
+        plan = _TRANSFER_PLANS[structure] = _TransferPlan(structure)
+    return plan(leaves, device, convert_complex)
 
 
 def example_to_numpy(example, detach=False):
@@ -104,6 +243,94 @@ def example_to_numpy(example, detach=False):
         return example
 
 
+def _batch_leaves(example):
+    if isinstance(example, dict):
+        for value in example.values():
+            yield from _batch_leaves(value)
+    elif isinstance(example, (tuple, list)):
+        yield example
+    elif torch.is_tensor(example) or isinstance(example, np.ndarray):
+        if example.ndim > 0:
+            yield example
+    elif hasattr(example, '__dataclass_fields__'):
+        for f in example.__dataclass_fields__:
+            yield from _batch_leaves(getattr(example, f))
+
+
+def batch_size_of_example(example):
+    """
+    Guesses the batch size of a nested structure. The batch size is the
+    length of the first list, tuple, array or tensor in the structure.
+
+    >>> batch_size_of_example({'a': 'abc', 'b': np.zeros((3, 2))})
+    3
+    >>> batch_size_of_example({'a': 'abc'}) is None
+    True
+    """
+    for leaf in _batch_leaves(example):
+        return len(leaf)
+    return None
+
+
+def split_example(example, num_splits=2):
+    """
+    Splits a batched example into `num_splits` micro batches along the batch
+    axis (the first axis of arrays and tensors or the elements of a
+    list/tuple, e.g. a list of tensors with different lengths).
+    Only leaves, where the length is equal to the batch size (see
+    `batch_size_of_example`) are split. All other leaves (e.g. strings,
+    scalars) are shared between the micro batches.
+
+    >>> example = {
+    ...     'Y': np.arange(6).reshape(3, 2), 'num_frames': [4, 3, 2],
+    ...     'sample_rate': 16000,
+    ... }
+    >>> for e in split_example(example): print(e)
+    {'Y': array([[0, 1],
+           [2, 3]]), 'num_frames': [4, 3], 'sample_rate': 16000}
+    {'Y': array([[4, 5]]), 'num_frames': [2], 'sample_rate': 16000}
+    """
+    batch_size = batch_size_of_example(example)
+    if batch_size is None or batch_size < num_splits:
+        raise ValueError(
+            f'Can not split an example with batch size {batch_size} '
+            f'into {num_splits} parts.'
+        )
+    # Same sizes as np.array_split, i.e. the first parts are larger
+    sizes = [
+        batch_size // num_splits + (i < batch_size % num_splits)
+        for i in range(num_splits)
+    ]
+    boundaries = np.cumsum([0] + sizes)
+
+    def split(example, start, stop):
+        if isinstance(example, dict):
+            return example.__class__({
+                key: split(value, start, stop)
+                for key, value in example.items()
+            })
+        elif isinstance(example, (tuple, list)):
+            if len(example) == batch_size:
+                return example[start:stop]
+            return example
+        elif torch.is_tensor(example) or isinstance(example, np.ndarray):
+            if example.ndim > 0 and len(example) == batch_size:
+                return example[start:stop]
+            return example
+        elif hasattr(example, '__dataclass_fields__'):
+            return example.__class__(**{
+                f: split(getattr(example, f), start, stop)
+                for f in example.__dataclass_fields__
+            })
+        else:
+            return example
+
+    return [
+        split(example, start, stop)
+        for start, stop in zip(boundaries[:-1], boundaries[1:])
+    ]
+
+
 class Sorter:
     # pb.database.keys.NUM_SAMPLES is 'num_samples'
     def __init__(self, key=lambda example: example['num_samples']):
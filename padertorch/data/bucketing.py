@@ -0,0 +1,224 @@
+import numpy as np
+
+__all__ = [
+    'get_lengths',
+    'padding_efficiency',
+    'BucketBatchSampler',
+]
+
+
+def get_lengths(dataset, key='num_samples'):
+    """
+    Reads the length of each example in a pre-pass over `dataset`.
+
+    The pre-pass should run on the examples before the audio is loaded
+    (e.g. the database examples, that already contain `num_samples`), i.e.
+    it only reads the meta data.
+
+    >>> get_lengths([{'num_samples': 3}, {'num_samples': 5}])
+    array([3, 5])
+    >>> get_lengths(
+    ...     [{'num_samples': {'observation': 3, 'speech_source': [3, 2]}}])
+    array([3])
+    >>> get_lengths([{'num_frames': 4}], key=lambda ex: ex['num_frames'] + 1)
+    array([5])
+
+    Args:
+        dataset: The examples.
+        key: The key of the length in the examples or a callable that
+            returns the length of an example. When the value is a nested
+            structure (e.g. one length per audio key), the maximum is used.
+
+    Returns:
+        A numpy array with the length of each example.
+    """
+    def maximum(value):
+        if isinstance(value, dict):
+            return max([maximum(v) for v in value.values()])
+        elif isinstance(value, (tuple, list)):
+            return max([maximum(v) for v in value])
+        else:
+            return int(value)
+
+    if callable(key):
+        get = key
+    else:
+        def get(example):
+            return example[key]
+
+    return np.array(
+        [maximum(get(example)) for example in dataset], dtype=np.int64)
+
+
+def padding_efficiency(batches, lengths):
+    """
+    The ratio of the sum of the lengths and the number of elements of the
+    padded batches, i.e. 1 means no padding.
+
+    >>> padding_efficiency([[0, 1], [2]], [4, 2, 2])
+    0.8
+
+    Args:
+        batches: A list of batches, each batch is a list of indices.
+        lengths: The lengths of the examples.
+    """
+    lengths = np.asarray(lengths)
+    total = sum([lengths[batch].sum() for batch in batches])
+    padded = sum([len(batch) * lengths[batch].max() for batch in batches])
+    return float(total / padded) if padded > 0 else 1.
+
+
+class BucketBatchSampler:
+    """
+    Groups the indices of the examples into batches of similar length under
+    a budget, to reduce the padding.
+
+    In each iteration the indices are shuffled, split into buckets of
+    `bucket_size` examples and each bucket is sorted by the length (longest
+    first). The sorted buckets are greedily split into batches, such that
+    each batch satisfies the budget, and the batches of all buckets are
+    shuffled. The random state depends only on `seed` and the epoch (i.e.
+    the number of previous iterations or `set_epoch`), hence the batches
+    are reproducible.
+
+    An example that alone exceeds the budget yields a batch with a single
+    example.
+
+    >>> lengths = [10, 3, 7, 2, 9, 4]
+    >>> sampler = BucketBatchSampler(lengths, max_total_length=12, seed=0)
+    >>> batches = list(sampler)
+    >>> sorted(sorted(b) for b in batches)
+    [[0], [1, 3], [2, 5], [4]]
+    >>> sampler.padding_efficiency
+    0.8974358974358975
+    >>> batches == list(sampler.set_epoch(0))
+    True
+
+    Use it with a dataset that supports indexing (e.g. a lazy_dataset):
+        >>> dataset = [{'num_samples': n} for n in lengths]
+        >>> sampler = BucketBatchSampler(
+        ...     get_lengths(dataset), max_padded_length=20, shuffle=False)
+        >>> for batch in sampler:
+        ...     print([dataset[i]['num_samples'] for i in batch])
+        [10, 9]
+        [7, 4]
+        [3, 2]
+
+    Args:
+        lengths: The length of each example, e.g. the output of
+            `get_lengths`. Use the number of elements that is padded (e.g.
+            `num_samples` or `num_frames`).
+        max_total_length: The maximum sum of the lengths in a batch.
+        max_padded_length: The maximum number of elements of the padded
+            batch, i.e. the batch size times the maximum length.
+        max_batch_size: The maximum number of examples in a batch.
+        bucket_size: The number of examples that are sorted together. None
+            sorts all examples, i.e. the minimal padding, but the batch
+            compositions depend less on the random state.
+        shuffle: If False, the examples are only sorted and the batches
+            keep the order from the longest to the shortest.
+        drop_last: If True, drop the last batch of each bucket, when it
+            does not reach `max_batch_size` (only with `max_batch_size`).
+        seed: The seed of the random state.
+    """
+    def __init__(
+            self,
+            lengths,
+            max_total_length=None,
+            max_padded_length=None,
+            max_batch_size=None,
+            bucket_size=None,
+            shuffle=True,
+            drop_last=False,
+            seed=0,
+    ):
+        assert (
+            max_total_length is not None
+            or max_padded_length is not None
+            or max_batch_size is not None
+        ), 'At least one budget is required.'
+        assert not drop_last or max_batch_size is not None, drop_last
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        assert self.lengths.ndim == 1, self.lengths.shape
+        self.max_total_length = max_total_length
+        self.max_padded_length = max_padded_length
+        self.max_batch_size = max_batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.padding_efficiency = None
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}('
+            f'len(lengths)={len(self.lengths)}, '
+            f'max_total_length={self.max_total_length}, '
+            f'max_padded_length={self.max_padded_length}, '
+            f'max_batch_size={self.max_batch_size}, '
+            f'bucket_size={self.bucket_size}, '
+            f'shuffle={self.shuffle}, seed={self.seed})'
+        )
+
+    def set_epoch(self, epoch):
+        """Sets the epoch of the next iteration, e.g. to resume."""
+        self.epoch = epoch
+        return self
+
+    def _fits(self, size, total, longest):
+        if self.max_batch_size is not None and size > self.max_batch_size:
+            return False
+        if self.max_total_length is not None \
+                and total > self.max_total_length:
+            return False
+        if self.max_padded_length is not None \
+                and size * longest > self.max_padded_length:
+            return False
+        return True
+
+    def _split(self, indices):
+        """Greedily splits indices, sorted by decreasing length."""
+        batches = []
+        batch = []
+        total = 0
+        for index in indices:
+            length = self.lengths[index]
+            # The first element of a batch is the longest.
+            longest = self.lengths[batch[0]] if batch else length
+            if batch and not self._fits(
+                    len(batch) + 1, total + length, longest):
+                batches.append(batch)
+                batch = []
+                total = 0
+            batch.append(int(index))
+            total += length
+        if batch and not (
+                self.drop_last and len(batch) < self.max_batch_size):
+            batches.append(batch)
+        return batches
+
+    def batches(self, epoch):
+        """Returns the batches (lists of indices) of an epoch."""
+        rng = np.random.RandomState([self.seed, epoch])
+        indices = np.arange(len(self.lengths))
+        if self.shuffle:
+            indices = rng.permutation(indices)
+        bucket_size = self.bucket_size or max(len(indices), 1)
+
+        batches = []
+        for start in range(0, len(indices), bucket_size):
+            bucket = indices[start:start + bucket_size]
+            # Stable sort, i.e. equal lengths keep the shuffled order.
+            bucket = bucket[np.argsort(-self.lengths[bucket], kind='stable')]
+            batches.extend(self._split(bucket))
+
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        batches = self.batches(self.epoch)
+        self.epoch += 1
+        self.padding_efficiency = padding_efficiency(batches, self.lengths)
+        return iter(batches)
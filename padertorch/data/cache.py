@@ -0,0 +1,681 @@
+import dataclasses
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from padertorch.data.batch import example_to_device
+
+__all__ = [
+    'CachedIterable',
+    'FeatureCache',
+]
+
+
+def _map_arrays(fn, example):
+    """
+    Applies `fn` to each tensor and numpy array of a nested structure and
+    rebuilds the containers (dict, tuple, list and dataclass).
+    """
+    if isinstance(example, dict):
+        return example.__class__({
+            key: _map_arrays(fn, value) for key, value in example.items()
+        })
+    elif isinstance(example, (tuple, list)):
+        return example.__class__([
+            _map_arrays(fn, element) for element in example
+        ])
+    elif isinstance(example, (torch.Tensor, np.ndarray, _Spilled)):
+        return fn(example)
+    elif hasattr(example, '__dataclass_fields__'):
+        return example.__class__(**{
+            f: _map_arrays(fn, getattr(example, f))
+            for f in example.__dataclass_fields__
+        })
+    else:
+        return example
+
+
+@dataclasses.dataclass(frozen=True)
+class _Spilled:
+    """Placeholder for an array in the spill file."""
+    offset: int
+    dtype: np.dtype
+    shape: tuple
+    is_tensor: bool
+
+
+class _CacheFull(Exception):
+    pass
+
+
+class CachedIterable:
+    """
+    Caches the examples of a deterministic iterable (e.g. the validation
+    dataset) in the first complete iteration. Later iterations replay the
+    cached examples, i.e. the reading, the preprocessing and the collating
+    are skipped.
+
+    The examples are converted with `example_to_device(example, 'cpu')` and
+    the arrays are stored as compact copies, i.e. they do not keep larger
+    buffers alive. When the in memory cache exceeds `max_memory_bytes`,
+    the remaining arrays are written to `spill_file` and replayed from a
+    memory map. When the budget is exceeded and no spill file is given (or
+    the spill file exceeds `max_spill_bytes`), the cache is dropped and the
+    examples are loaded from the iterable in each iteration.
+
+    Note: The replayed tensors are shared between the iterations. The
+        containers (dict, list, ...) are new objects, but an inplace
+        operation on a tensor would change the cache.
+
+    >>> def load(i):
+    ...     print('load', i)
+    ...     return {'x': np.array([i, i]), 'example_id': str(i)}
+    >>> class Dataset:
+    ...     def __iter__(self):
+    ...         return map(load, range(2))
+    >>> it = CachedIterable(Dataset())
+    >>> for example in it: print(example)
+    load 0
+    {'x': tensor([0, 0]), 'example_id': '0'}
+    load 1
+    {'x': tensor([1, 1]), 'example_id': '1'}
+    >>> for example in it: print(example)
+    {'x': tensor([0, 0]), 'example_id': '0'}
+    {'x': tensor([1, 1]), 'example_id': '1'}
+    >>> it.is_cached, it.memory_bytes
+    (True, 32)
+
+    Args:
+        iterable: A deterministic iterable, that can be consumed multiple
+            times.
+        max_memory_bytes: The budget of the in memory cache. None means no
+            limit.
+        spill_file: The path of the spill file for the arrays that exceed
+            `max_memory_bytes`. An existing file is overwritten.
+        max_spill_bytes: The budget of the spill file. None means no limit.
+    """
+    def __init__(
+            self,
+            iterable,
+            max_memory_bytes=None,
+            spill_file=None,
+            max_spill_bytes=None,
+    ):
+        self.iterable = iterable
+        self.max_memory_bytes = max_memory_bytes
+        self.spill_file = None if spill_file is None else Path(spill_file)
+        self.max_spill_bytes = max_spill_bytes
+        self.disabled = False
+        self._reset()
+
+    def _reset(self):
+        self._examples = None
+        self._filling = False
+        self._spill_fd = None
+        self._spill_map = None
+        self.memory_bytes = 0
+        self.spill_bytes = 0
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}({self.iterable!r}, '
+            f'is_cached={self.is_cached})'
+        )
+
+    def __len__(self):
+        if self.is_cached:
+            return len(self._examples)
+        return len(self.iterable)
+
+    def __getstate__(self):
+        # Do not send the cache to another process (e.g. background
+        # validation), it is filled again in the other process.
+        state = self.__dict__.copy()
+        state.update(
+            _examples=None, _filling=False, _spill_fd=None, _spill_map=None,
+            memory_bytes=0, spill_bytes=0,
+        )
+        return state
+
+    @property
+    def is_cached(self):
+        return self._examples is not None and not self._filling
+
+    def clear(self):
+        """Drops the cache and deletes the spill file."""
+        if self._spill_fd is not None:
+            self._spill_fd.close()
+        spilled = self._spill_fd is not None or self._spill_map is not None
+        self._reset()
+        if spilled and self.spill_file.exists():
+            self.spill_file.unlink()
+
+    def _store_array(self, array):
+        is_tensor = torch.is_tensor(array)
+        if is_tensor:
+            if array.dtype == torch.bfloat16:
+                # numpy has no bfloat16, keep it in memory
+                self.memory_bytes += array.numel() * array.element_size()
+                return array.detach().clone()
+            array = array.detach().numpy()
+        nbytes = array.nbytes
+
+        if (
+            nbytes == 0
+            or self.max_memory_bytes is None
+            or self.memory_bytes + nbytes <= self.max_memory_bytes
+        ):
+            self.memory_bytes += nbytes
+            array = np.array(array, copy=True, order='C')
+            return torch.from_numpy(array) if is_tensor else array
+
+        if self.spill_file is None or (
+            self.max_spill_bytes is not None
+            and self.spill_bytes + nbytes > self.max_spill_bytes
+        ):
+            raise _CacheFull()
+        if self._spill_fd is None:
+            self.spill_file.parent.mkdir(parents=True, exist_ok=True)
+            self._spill_fd = open(self.spill_file, 'wb')
+        self._spill_fd.write(np.ascontiguousarray(array).tobytes())
+        spilled = _Spilled(self.spill_bytes, array.dtype, array.shape, is_tensor)
+        self.spill_bytes += nbytes
+        return spilled
+
+    def _load_array(self, array):
+        if not isinstance(array, _Spilled):
+            return array
+        # The memory map is private (copy on write), hence the arrays are
+        # writeable (torch warns about read only arrays) and the spill file
+        # is never changed.
+        loaded = np.frombuffer(
+            self._spill_map, dtype=array.dtype,
+            count=int(np.prod(array.shape)), offset=array.offset,
+        ).reshape(array.shape)
+        return torch.from_numpy(loaded) if array.is_tensor else loaded
+
+    def _fill(self):
+        self.clear()
+        self._examples = []
+        self._filling = True
+        iterator = iter(self.iterable)
+        complete = False
+        try:
+            for example in iterator:
+                example = example_to_device(example, 'cpu')
+                try:
+                    self._examples.append(
+                        _map_arrays(self._store_array, example))
+                except _CacheFull:
+                    print(
+                        f'{self.__class__.__name__}: The examples exceed the '
+                        f'cache budget. Continue without cache.'
+                    )
+                    self.clear()
+                    self.disabled = True
+                    yield example
+                    yield from self._convert(iterator)
+                    return
+                yield example
+            complete = True
+        finally:
+            if not complete and not self.disabled:
+                # e.g. the consumer stopped the iteration
+                self.clear()
+
+        if self._spill_fd is not None:
+            self._spill_fd.close()
+            self._spill_fd = None
+            self._spill_map = np.memmap(self.spill_file, mode='c')
+        self._filling = False
+
+    @staticmethod
+    def _convert(iterator):
+        for example in iterator:
+            yield example_to_device(example, 'cpu')
+
+    def _replay(self):
+        for example in self._examples:
+            yield _map_arrays(self._load_array, example)
+
+    def __iter__(self):
+        if self.disabled or self._filling:
+            # e.g. nested iteration while the cache is filled
+            return self._convert(self.iterable)
+        if self.is_cached:
+            return self._replay()
+        return self._fill()
+
+
+def _describe(obj):
+    """
+    Returns a json serializable description of the parameters of a
+    transform, that is used as part of the cache key.
+    """
+    if isinstance(obj, (str, int, float, bool, type(None))):
+        return obj
+    elif isinstance(obj, dict):
+        return {str(k): _describe(v) for k, v in sorted(obj.items())}
+    elif isinstance(obj, (tuple, list)):
+        return [_describe(v) for v in obj]
+    elif isinstance(obj, np.ndarray):
+        return hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif inspect.isroutine(obj) or isinstance(obj, type):
+        # e.g. a window function
+        return f'{obj.__module__}.{obj.__qualname__}'
+    elif hasattr(obj, '__dict__'):
+        return {
+            'class': f'{obj.__class__.__module__}.{obj.__class__.__qualname__}',
+            # Private attributes are the state (e.g. a counter), not the
+            # parameters.
+            'params': _describe({
+                k: v for k, v in vars(obj).items() if not k.startswith('_')
+            }),
+        }
+    return repr(obj)
+
+
+def _mtimes(path):
+    if isinstance(path, dict):
+        return {k: _mtimes(v) for k, v in sorted(path.items())}
+    elif isinstance(path, (tuple, list)):
+        return [_mtimes(p) for p in path]
+    return os.stat(path).st_mtime_ns
+
+
+class FeatureCache:
+    """
+    Caches the features (e.g. the output of `STFT` and `MelTransform`)
+    of a transform on the disk. When an example is in the cache, the
+    transform is skipped, i.e. the audio is not read and the features are
+    loaded from a memory map.
+
+    The entries are identified by the example id, the audio path and its
+    modification time and a hash of the parameters of the transform, i.e.
+    a changed audio file or transform invalidates the entry.
+
+    The arrays are appended to shard files and an sqlite index stores the
+    position of each array. Each process writes to its own shard and the
+    index is shared with sqlite transactions, hence the prefetch workers
+    (threads or processes) can share a cache directory. Call `close` at the
+    end, that the shard of the process can be evicted. When the cached
+    arrays exceed `max_bytes`, the least recently used entries are evicted
+    and shards without entries are deleted.
+
+    The output contains only the cached `keys` of the transform and the
+    keys of the input example, i.e. the other outputs of the transform
+    (e.g. the audio or the stft, when only the mel spectrogram is cached)
+    are dropped, that a hit and a miss return the same keys.
+
+    >>> import tempfile
+    >>> def transform(example):
+    ...     print('transform', example['example_id'])
+    ...     example['feature'] = np.ones((2, 3)) * example['x']
+    ...     return example
+    >>> with tempfile.TemporaryDirectory() as cache_dir:
+    ...     cache = FeatureCache(
+    ...         transform, cache_dir, keys='feature', source_key=None)
+    ...     for _ in range(2):
+    ...         example = cache({'example_id': 'a', 'x': 1})
+    ...     cache.close()
+    transform a
+    >>> example['feature']
+    array([[1., 1., 1.],
+           [1., 1., 1.]], dtype=float32)
+
+    Args:
+        transform: A callable (or a list of callables, that are applied in
+            order), that takes an example and returns the example with the
+            features.
+        cache_dir: The directory of the cache.
+        keys: The key or the keys of the features, that are cached.
+        dtype: The dtype of the cached real valued floating point features,
+            e.g. np.float16 to halve the size. Complex features are stored
+            as complex64.
+        max_bytes: The size cap of the cached arrays. None means no limit.
+            The evicted entries of a shard are deleted, when the shard is
+            closed (i.e. it is full or its writer called `close`) and has
+            no entries left. Hence the disk usage can exceed `max_bytes`
+            by up to the number of writing processes times `shard_bytes`.
+        shard_bytes: The size after which a process starts a new shard.
+        source_key: The key of the audio path(s) in the example, whose
+            modification times are part of the cache key. None to ignore
+            the source files.
+        access_interval: The accesses of the hits (i.e. the LRU order) are
+            collected in memory and written to the index at most once in
+            `access_interval` seconds, that the hits do not compete for the
+            write lock of the index.
+    """
+    def __init__(
+            self,
+            transform,
+            cache_dir,
+            keys=('stft', 'mel_transform'),
+            dtype=np.float32,
+            max_bytes=None,
+            shard_bytes=2**30,
+            source_key='audio_path',
+            access_interval=10.,
+    ):
+        self.transform = transform
+        self.cache_dir = Path(cache_dir)
+        self.keys = (keys,) if isinstance(keys, str) else tuple(keys)
+        self.dtype = np.dtype(dtype)
+        assert self.dtype.kind == 'f', self.dtype
+        self.max_bytes = max_bytes
+        self.shard_bytes = shard_bytes
+        self.source_key = source_key
+        self.access_interval = access_interval
+        self.transform_hash = hashlib.sha1(json.dumps(
+            [_describe(transform), self.keys, self.dtype.str]
+        ).encode()).hexdigest()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = None
+        self._db = None
+        self._shard = None
+        self._shard_fd = None
+        self._shard_bytes = 0
+        self._maps = {}
+        self._accesses = {}
+        self._accesses_flushed = time.monotonic()
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}({self.transform!r}, '
+            f'cache_dir={str(self.cache_dir)!r}, keys={self.keys})'
+        )
+
+    def __getstate__(self):
+        # The connection, the shard and the memory maps are opened again in
+        # the other process.
+        state = self.__dict__.copy()
+        state.update(
+            _pid=None, _db=None, _shard=None, _shard_fd=None,
+            _shard_bytes=0, _maps={}, _accesses={},
+        )
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._pid == os.getpid():
+            return self._db
+        # A new process (e.g. a forked prefetch worker) must not use the
+        # connection or the shard of the parent.
+        self._reset()
+        self._pid = os.getpid()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(
+            str(self.cache_dir / 'index.sqlite'), timeout=60,
+            isolation_level=None, check_same_thread=False,
+        )
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, shard TEXT, offset INTEGER, '
+            'nbytes INTEGER, meta TEXT, last_access REAL)'
+        )
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS entries_last_access '
+            'ON entries (last_access)'
+        )
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS entries_shard ON entries (shard)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS shards ('
+            'name TEXT PRIMARY KEY, closed INTEGER)'
+        )
+        # The running total of the cached bytes, i.e. a store does not sum
+        # over the index.
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS stats ('
+            'name TEXT PRIMARY KEY, value INTEGER)'
+        )
+        self._db.execute(
+            "INSERT OR IGNORE INTO stats SELECT 'total_bytes', "
+            "COALESCE(SUM(nbytes), 0) FROM entries"
+        )
+        return self._db
+
+    def close(self):
+        """Closes the shard of this process and the index connection."""
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._pid == os.getpid():
+            self._flush_accesses()
+            if self._shard_fd is not None:
+                self._shard_fd.close()
+                self._db.execute(
+                    'UPDATE shards SET closed = 1 WHERE name = ?',
+                    (self._shard,)
+                )
+            self._db.close()
+        self._reset()
+
+    def entry_key(self, example):
+        """The cache key of an example."""
+        description = [example['example_id'], self.transform_hash]
+        if self.source_key is not None:
+            path = example[self.source_key]
+            description += [_describe(path), _mtimes(path)]
+        return hashlib.sha1(json.dumps(description).encode()).hexdigest()
+
+    def _apply_transform(self, example):
+        if isinstance(self.transform, (tuple, list)):
+            for transform in self.transform:
+                example = transform(example)
+            return example
+        return self.transform(example)
+
+    def _load(self, key):
+        db = self._connect()
+        row = db.execute(
+            'SELECT shard, offset, meta FROM entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        shard, offset, meta = row
+        meta = json.loads(meta)
+        end = offset + sum([nbytes for *_, nbytes in meta.values()])
+        buffer = self._maps.get(shard)
+        if buffer is None or len(buffer) < end:
+            # Not opened or written by another process after the memory
+            # map was created.
+            try:
+                buffer = np.memmap(
+                    self.cache_dir / shard, dtype=np.uint8, mode='r')
+            except (FileNotFoundError, ValueError):
+                # Evicted by another process
+                return None
+            if len(buffer) < end:
+                return None
+            self._maps[shard] = buffer
+        features = {}
+        for name, (dtype, shape, start, nbytes) in meta.items():
+            # Copy the array, i.e. the example does not keep the memory map
+            # alive and can be changed inplace (e.g. Normalizer).
+            features[name] = np.frombuffer(
+                buffer, dtype=dtype, count=int(np.prod(shape)),
+                offset=offset + start,
+            ).reshape(shape).copy()
+        self._accesses[key] = time.time()
+        if time.monotonic() - self._accesses_flushed > self.access_interval:
+            self._flush_accesses()
+        return features
+
+    def _flush_accesses(self):
+        """Writes the collected accesses in one transaction."""
+        self._accesses_flushed = time.monotonic()
+        if not self._accesses:
+            return
+        accesses, self._accesses = self._accesses, {}
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # Evicted entries are not updated.
+            db.executemany(
+                'UPDATE entries SET last_access = MAX(last_access, ?) '
+                'WHERE key = ?',
+                [(t, key) for key, t in accesses.items()]
+            )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def _open_shard(self):
+        db = self._connect()
+        if self._shard_fd is not None:
+            self._shard_fd.close()
+            db.execute(
+                'UPDATE shards SET closed = 1 WHERE name = ?', (self._shard,))
+        self._shard = f'shard-{os.getpid()}-{uuid.uuid4().hex[:8]}.bin'
+        db.execute('INSERT INTO shards VALUES (?, 0)', (self._shard,))
+        self._shard_fd = open(self.cache_dir / self._shard, 'ab')
+        self._shard_bytes = 0
+
+    def _store(self, key, outputs):
+        """
+        Stores the `keys` of the transform outputs and returns them with
+        the dtype of a cache hit.
+        """
+        db = self._connect()
+        if self._shard_fd is None or self._shard_bytes >= self.shard_bytes:
+            self._open_shard()
+        features = {}
+        meta = {}
+        chunks = []
+        nbytes = 0
+        for name in self.keys:
+            array = np.asarray(outputs[name])
+            if array.dtype.kind == 'c':
+                array = array.astype(np.complex64)
+            elif array.dtype.kind == 'f':
+                array = array.astype(self.dtype)
+            array = np.ascontiguousarray(array)
+            features[name] = array
+            meta[name] = (array.dtype.str, array.shape, nbytes, array.nbytes)
+            chunks.append(array.tobytes())
+            nbytes += array.nbytes
+        offset = self._shard_bytes
+        self._shard_fd.write(b''.join(chunks))
+        # The data has to be visible to the other processes, before the
+        # index points to it.
+        self._shard_fd.flush()
+        self._shard_bytes += nbytes
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                'SELECT nbytes FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                (key, self._shard, offset, nbytes, json.dumps(meta),
+                 time.time())
+            )
+            db.execute(
+                "UPDATE stats SET value = value + ? "
+                "WHERE name = 'total_bytes'",
+                (nbytes - (0 if row is None else row[0]),)
+            )
+            total, = db.execute(
+                "SELECT value FROM stats WHERE name = 'total_bytes'"
+            ).fetchone()
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        if self.max_bytes is not None and total > self.max_bytes:
+            self._evict()
+        return features
+
+    # The number of entries, that are deleted with one query
+    _evict_batch_size = 64
+
+    def _evict(self):
+        # The eviction uses the recent hits of this process.
+        self._flush_accesses()
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            total, = db.execute(
+                "SELECT value FROM stats WHERE name = 'total_bytes'"
+            ).fetchone()
+            while total > self.max_bytes:
+                # The oldest entries (last_access is indexed)
+                rows = db.execute(
+                    'SELECT key, nbytes FROM entries '
+                    'ORDER BY last_access LIMIT ?',
+                    (self._evict_batch_size,)
+                ).fetchall()
+                if not rows:
+                    break
+                delete = []
+                for key, nbytes in rows:
+                    if total <= self.max_bytes:
+                        break
+                    delete.append((key,))
+                    total -= nbytes
+                db.executemany('DELETE FROM entries WHERE key = ?', delete)
+            db.execute(
+                "UPDATE stats SET value = ? WHERE name = 'total_bytes'",
+                (max(total, 0),)
+            )
+            # The shards of running writers are not closed, they are
+            # deleted later.
+            empty = [name for name, in db.execute(
+                'SELECT name FROM shards WHERE closed = 1 AND name NOT IN '
+                '(SELECT DISTINCT shard FROM entries)'
+            ).fetchall()]
+            db.executemany(
+                'DELETE FROM shards WHERE name = ?', [(n,) for n in empty])
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        for name in empty:
+            self._maps.pop(name, None)
+            try:
+                (self.cache_dir / name).unlink()
+            except FileNotFoundError:
+                pass
+        if self._shard_bytes > 0 and self._shard_bytes >= self.max_bytes:
+            # Close the own shard, so that it can be deleted.
+            self._open_shard()
+
+    def __call__(self, example):
+        key = self.entry_key(example)
+        with self._lock:
+            features = self._load(key)
+        if features is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # A shallow copy, i.e. a transform that adds keys inplace does
+            # not change the input example.
+            outputs = self._apply_transform(dict(example))
+            with self._lock:
+                features = self._store(key, outputs)
+        example.update(features)
+        return example
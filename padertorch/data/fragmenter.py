@@ -39,10 +39,48 @@ class Fragmenter(object):
     >>> pprint(channel_fragmenter(example))
     [{'a': array([0, 1, 2, 3]), 'b': array([1, 2, 3, 4])},
      {'a': array([4, 5, 6, 7]), 'b': array([1, 2, 3, 4])}]
+    >>> view_fragmenter = Fragmenter(\
+            {'a':2}, {'a':3}, views=True, copy_keys=['b'])
+    >>> example = {'a': np.arange(8).reshape((2, 4)), 'b': [1, 2]}
+    >>> fragments = view_fragmenter(example)
+    >>> pprint(fragments)
+    [{'a': array([[0, 1, 2],
+           [4, 5, 6]]), 'b': [1, 2]},
+     {'a': array([[2, 3],
+           [6, 7]]), 'b': [1, 2]}]
+    >>> np.shares_memory(fragments[0]['a'], example['a'])
+    True
+    >>> fragments[0]['a'].flags.writeable
+    False
+    >>> fragments[0]['b'] is example['b']
+    True
+    >>> view_fragmenter = Fragmenter({'a':2}, views=True, lazy=True)
+    >>> fragments = view_fragmenter(example)
+    >>> next(fragments)['a']
+    array([[0, 1],
+           [4, 5]])
+
+    Args:
+        fragment_steps: dict with the step (hop size) for each fragment key.
+        fragment_lengths: dict with the fragment length for each fragment
+            key. Defaults to fragment_steps.
+        axis: The axis along which the arrays are fragmented.
+        squeeze: If True and the fragment length is 1, remove the axis.
+        drop_last: If True, drop the fragments at the end, that are
+            shorter than the fragment length.
+        copy_keys: The keys, that are added to each fragment. Defaults to
+            all keys.
+        views: If True, the fragments are read-only strided views of the
+            arrays (see `np.lib.stride_tricks.as_strided`) and the values
+            of the copy_keys are shared between the fragments instead of
+            deep copied.
+        lazy: If True, return a generator of the fragments instead of a
+            list.
     """
     def __init__(
             self, fragment_steps, fragment_lengths=None, axis=-1,
-            squeeze=False, drop_last=False, copy_keys=None
+            squeeze=False, drop_last=False, copy_keys=None,
+            views=False, lazy=False,
     ):
         self.fragment_steps = fragment_steps
         self.fragment_lengths = fragment_lengths \
@@ -51,6 +89,8 @@ class Fragmenter(object):
         self.squeeze = squeeze
         self.drop_last = drop_last
         self.copy_keys = copy_keys
+        self.views = views
+        self.lazy = lazy
 
     def __call__(self, example, random_onset=False):
         copies = flatten(
@@ -74,7 +114,13 @@ class Fragmenter(object):
                 slc[self.axis] = slice(
                     int(start_idx), x.shape[self.axis]
                 )
-                x = x[slc]
+                x = x[tuple(slc)]
+
+            if self.views:
+                return strided_fragments(
+                    x, fragment_step, fragment_length, axis=self.axis,
+                    squeeze=self.squeeze, drop_last=self.drop_last,
+                )
 
             end_index = x.shape[self.axis]
             if self.drop_last:
@@ -99,11 +145,88 @@ class Fragmenter(object):
             [len(features[key]) for key in list(features.keys())]
         )
         assert all(num_fragments == num_fragments[0]), (list(features.keys()), num_fragments)
-        fragments = list()
-        for i in range(int(num_fragments[0])):
-            fragment = deepcopy(copies)
-            for key in features.keys():
-                fragment[key] = features[key][i]
-            fragment = deflatten(fragment)
-            fragments.append(fragment)
+
+        def build_fragments():
+            for i in range(int(num_fragments[0])):
+                if self.views:
+                    # Shallow copy: The values are shared between the
+                    # fragments.
+                    fragment = dict(copies)
+                else:
+                    fragment = deepcopy(copies)
+                for key in features.keys():
+                    fragment[key] = features[key][i]
+                yield deflatten(fragment)
+
+        if self.lazy:
+            return build_fragments()
+        return list(build_fragments())
+
+
+def strided_fragments(
+        x, step, length, axis=-1, squeeze=False, drop_last=False
+):
+    """
+    Returns the fragments of `x` along `axis` as read-only views, i.e. no
+    data is copied. The fragments with the full length are built with a
+    single `as_strided` call.
+
+    >>> x = np.arange(10).reshape((2, 5))
+    >>> f = strided_fragments(x, 2, 3)
+    >>> len(f)
+    3
+    >>> f[0]
+    array([[0, 1, 2],
+           [5, 6, 7]])
+    >>> f[2]
+    array([[4],
+           [9]])
+    >>> len(strided_fragments(x, 2, 3, drop_last=True))
+    2
+    >>> strided_fragments(x, 1, 1, axis=0, squeeze=True)[1]
+    array([5, 6, 7, 8, 9])
+
+    Args:
+        x: numpy array
+        step: The step (hop size) between the fragments.
+        length: The length of the fragments.
+        axis: The axis along which `x` is fragmented.
+        squeeze: If True and `length` is 1, remove the axis.
+        drop_last: If True, drop the fragments at the end, that are shorter
+            than `length`.
+
+    Returns:
+        A sequence of views. The full length fragments are the entries of a
+        single strided array.
+    """
+    x = np.asarray(x)
+    axis = axis % x.ndim
+    size = x.shape[axis]
+    num_full = max(0, (size - length) // step + 1)
+    squeeze = squeeze and length == 1
+
+    shape = list(x.shape)
+    if squeeze:
+        del shape[axis]
+        strides = list(x.strides)
+        del strides[axis]
+    else:
+        shape[axis] = length
+        strides = list(x.strides)
+    fragments = np.lib.stride_tricks.as_strided(
+        x,
+        shape=(num_full, *shape),
+        strides=(x.strides[axis] * step, *strides),
+        writeable=False,
+    )
+    if drop_last:
         return fragments
+
+    fragments = list(fragments)
+    for start_idx in range(num_full * step, size, step):
+        slc = [slice(None)] * x.ndim
+        slc[axis] = slice(start_idx, start_idx + length)
+        fragment = x[tuple(slc)].view()
+        fragment.flags.writeable = False
+        fragments.append(fragment)
+    return fragments
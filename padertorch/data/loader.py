@@ -0,0 +1,340 @@
+import mmap
+import multiprocessing
+import queue
+import time
+import traceback
+import weakref
+
+import numpy as np
+import torch
+from lazy_dataset import FilterException
+
+from padertorch.data.cache import _map_arrays, _Spilled
+
+__all__ = [
+    'Loader',
+]
+
+# Offsets in a slot are aligned, e.g. for SIMD instructions.
+_ALIGNMENT = 64
+
+
+class _SlotFull(Exception):
+    pass
+
+
+def _write_slot(example, buffer, capacity):
+    """
+    Copies the arrays of `example` into `buffer` and replaces them with
+    placeholders. Arrays, that cannot be stored (e.g. object arrays), stay
+    in the example and are pickled.
+    """
+    offset = 0
+
+    def write(array):
+        nonlocal offset
+        is_tensor = torch.is_tensor(array)
+        if is_tensor:
+            if array.dtype == torch.bfloat16:
+                # numpy has no bfloat16
+                return array
+            array = array.detach().cpu().numpy()
+        if array.dtype.hasobject:
+            return array
+        start = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        if start + array.nbytes > capacity:
+            raise _SlotFull()
+        np.ndarray(
+            array.shape, array.dtype, buffer=buffer, offset=start,
+        )[...] = array
+        offset = start + array.nbytes
+        return _Spilled(start, array.dtype, array.shape, is_tensor)
+
+    return _map_arrays(write, example)
+
+
+def _worker(
+        dataset, transform, catch_filter_exception, task_queue, result_queue,
+        free_slots, num_free_slots, ring, slot_bytes,
+):
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        index = task
+        try:
+            try:
+                example = dataset[index]
+                if transform is not None:
+                    example = transform(example)
+            except catch_filter_exception:
+                result_queue.put((index, 'filtered', None, None))
+                continue
+
+            # The semaphore counts the slots in `free_slots`. Unlike
+            # `get_nowait`, it does not race with the feeder thread of the
+            # queue.
+            if not num_free_slots.acquire(block=False):
+                # The consumer holds all slots, send the example with pickle.
+                result_queue.put((index, 'pickled', None, example))
+                continue
+            slot = free_slots.get()
+            try:
+                payload = _write_slot(
+                    example,
+                    memoryview(ring)[slot * slot_bytes:(slot + 1) * slot_bytes],
+                    slot_bytes,
+                )
+            except _SlotFull:
+                free_slots.put(slot)
+                num_free_slots.release()
+                result_queue.put((index, 'pickled', None, example))
+                continue
+            result_queue.put((index, 'shared', slot, payload))
+        except Exception:
+            result_queue.put((index, 'error', None, traceback.format_exc()))
+
+
+class Loader:
+    """
+    Loads and transforms (e.g. collates) the examples of an indexable
+    dataset (e.g. a batched lazy dataset) in worker processes. The workers
+    write the arrays into slots of a shared memory ring, and the loader
+    yields numpy views (or tensors) of the slots, i.e. the arrays are not
+    pickled and not copied in the main process.
+
+    A slot is reused, when all arrays of its example are deleted, hence
+    the examples can be kept (e.g. by a prefetcher). When no slot is free
+    or the arrays exceed `slot_bytes`, the example is pickled.
+
+    The ring is an anonymous shared memory map, that is created before the
+    workers are forked, hence the dataset and the transform do not have to
+    be picklable and the memory is freed, when the loader and all yielded
+    arrays are deleted. The workers are stopped at the end of
+    each iteration, also when the iteration is stopped early.
+
+    >>> import lazy_dataset
+    >>> def load(index):
+    ...     if index == 2:
+    ...         raise lazy_dataset.FilterException()
+    ...     return {'x': np.full(3, index, dtype=np.float32), 'id': index}
+    >>> dataset = lazy_dataset.new(list(range(5))).map(load)
+    >>> loader = Loader(dataset, num_workers=2, catch_filter_exception=True)
+    >>> for example in loader:
+    ...     print(example)
+    {'x': array([0., 0., 0.], dtype=float32), 'id': 0}
+    {'x': array([1., 1., 1.], dtype=float32), 'id': 1}
+    {'x': array([3., 3., 3.], dtype=float32), 'id': 3}
+    {'x': array([4., 4., 4.], dtype=float32), 'id': 4}
+
+    Args:
+        dataset: An indexable dataset with a length.
+        transform: A callable, that is applied to each element of the
+            dataset in the workers, e.g. `Collate()`.
+        num_workers: The number of worker processes.
+        num_slots: The number of slots. At most `num_slots - 1` examples
+            are loaded ahead. Defaults to `2 * num_workers + 2`.
+        slot_bytes: The size of a slot in bytes.
+        ordered: If True, yield the examples in the order of the dataset,
+            else in the order in which they are finished.
+        to_tensor: If True, the numpy arrays are converted to tensors.
+        catch_filter_exception: If True, an element that raises a
+            `lazy_dataset.FilterException` is dropped. Can also be an
+            exception type (or a tuple of types) to catch.
+        timeout: The interval in seconds, in which the workers are checked
+            while waiting for a result. A worker that died (e.g. a
+            segfault or the OOM killer) raises a RuntimeError instead of
+            a hang.
+    """
+    def __init__(
+            self,
+            dataset,
+            transform=None,
+            num_workers=4,
+            num_slots=None,
+            slot_bytes=64 * 2**20,
+            ordered=True,
+            to_tensor=False,
+            catch_filter_exception=False,
+            timeout=1.,
+    ):
+        assert num_workers > 0, num_workers
+        self.dataset = dataset
+        self.transform = transform
+        self.num_workers = num_workers
+        self.num_slots = 2 * num_workers + 2 if num_slots is None \
+            else num_slots
+        assert self.num_slots > 0, self.num_slots
+        self.slot_bytes = -(-slot_bytes // _ALIGNMENT) * _ALIGNMENT
+        self.ordered = ordered
+        self.to_tensor = to_tensor
+        if catch_filter_exception is True:
+            catch_filter_exception = FilterException
+        elif not catch_filter_exception:
+            catch_filter_exception = ()
+        elif isinstance(catch_filter_exception, list):
+            catch_filter_exception = tuple(catch_filter_exception)
+        self.catch_filter_exception = catch_filter_exception
+        self.timeout = timeout
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}({self.dataset!r}, '
+            f'num_workers={self.num_workers}, num_slots={self.num_slots}, '
+            f'ordered={self.ordered})'
+        )
+
+    def __len__(self):
+        if self.catch_filter_exception:
+            raise TypeError(
+                f'The length of {self.__class__.__name__} is unknown, when '
+                f'catch_filter_exception is set.'
+            )
+        return len(self.dataset)
+
+    def _load(self, payload, base):
+        def load(array):
+            if not isinstance(array, _Spilled):
+                if self.to_tensor and isinstance(array, np.ndarray) \
+                        and not array.dtype.hasobject:
+                    return torch.from_numpy(array)
+                return array
+            # The view keeps `base` alive, the slot is released when `base`
+            # is garbage collected.
+            array_ = np.ndarray(
+                array.shape, array.dtype, buffer=base, offset=array.offset)
+            if array.is_tensor or self.to_tensor:
+                return torch.from_numpy(array_)
+            return array_
+        return _map_arrays(load, payload)
+
+    def __iter__(self):
+        ctx = multiprocessing.get_context('fork')
+        # MAP_SHARED, i.e. the forked workers write into the same memory.
+        ring = mmap.mmap(-1, self.num_slots * self.slot_bytes)
+        free_slots = ctx.Queue()
+        for slot in range(self.num_slots):
+            free_slots.put(slot)
+        num_free_slots = ctx.Semaphore(self.num_slots)
+        task_queue = ctx.Queue()
+        result_queue = ctx.Queue()
+        workers = [
+            ctx.Process(
+                target=_worker,
+                args=(
+                    self.dataset, self.transform, self.catch_filter_exception,
+                    task_queue, result_queue, free_slots, num_free_slots,
+                    ring, self.slot_bytes,
+                ),
+                daemon=True,
+            )
+            for _ in range(self.num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            yield from self._iterate(
+                workers, ring, task_queue, result_queue, free_slots,
+                num_free_slots,
+            )
+        finally:
+            self._shutdown(workers, task_queue, result_queue, free_slots)
+
+    @staticmethod
+    def _shutdown(workers, task_queue, result_queue, free_slots, timeout=10):
+        for _ in workers:
+            task_queue.put(None)
+        deadline = time.monotonic() + timeout
+        while any([w.is_alive() for w in workers]) \
+                and time.monotonic() < deadline:
+            # A worker cannot exit, while its results are not read.
+            try:
+                result_queue.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        for q in [task_queue, result_queue, free_slots]:
+            q.cancel_join_thread()
+            q.close()
+
+    def _iterate(
+            self, workers, ring, task_queue, result_queue, free_slots,
+            num_free_slots,
+    ):
+        num_tasks = len(self.dataset)
+        # The consumer keeps the last yielded example, while it waits for
+        # the next one. With one slot for it, each pending task gets a slot,
+        # unless the consumer keeps more examples.
+        max_pending = max(self.num_slots - 1, 1)
+        submitted = 0
+        received = {}
+        next_index = 0
+
+        def release(slot):
+            try:
+                free_slots.put(slot)
+            except (ValueError, AssertionError):
+                # The iteration is finished and the queue is closed.
+                pass
+            else:
+                num_free_slots.release()
+
+        while next_index < num_tasks:
+            while submitted < num_tasks \
+                    and submitted - next_index < max_pending:
+                task_queue.put(submitted)
+                submitted += 1
+
+            try:
+                index, kind, slot, payload = result_queue.get(
+                    timeout=self.timeout)
+            except queue.Empty:
+                # The workers only exit at the end of the iteration.
+                dead = [
+                    (i, w.exitcode) for i, w in enumerate(workers)
+                    if w.exitcode is not None
+                ]
+                if dead:
+                    pending = [
+                        i for i in range(next_index, submitted)
+                        if i not in received
+                    ]
+                    raise RuntimeError(
+                        f'Worker(s) of {self.__class__.__name__} died '
+                        f'unexpectedly (worker, exitcode): {dead}. '
+                        f'Pending indices: {pending}'
+                    )
+                continue
+            if kind == 'error':
+                raise RuntimeError(
+                    f'Exception in a worker of {self.__class__.__name__} '
+                    f'for index {index}:\n{payload}'
+                )
+            elif kind == 'shared':
+                base = np.ndarray(
+                    (self.slot_bytes,), np.uint8, buffer=ring,
+                    offset=slot * self.slot_bytes,
+                )
+                weakref.finalize(base, release, slot)
+                example = self._load(payload, base)
+            elif kind == 'pickled':
+                example = self._load(payload, None)
+            else:
+                example = None
+            received[index] = kind, example
+
+            if self.ordered:
+                while next_index in received:
+                    kind, example = received.pop(next_index)
+                    next_index += 1
+                    if kind != 'filtered':
+                        yield example
+            else:
+                kind, example = received.pop(index)
+                next_index += 1
+                if kind != 'filtered':
+                    yield example
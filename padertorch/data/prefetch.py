@@ -0,0 +1,102 @@
+import queue
+import threading
+
+from padertorch.data.batch import example_to_device
+
+__all__ = [
+    'DevicePrefetcher',
+]
+
+
+class DevicePrefetcher:
+    """
+    Loads the examples of `iterable` in a background thread and moves them
+    to `device` (see `example_to_device`), while the consumer (e.g. the train
+    step) processes the previous example. At most `depth` examples are
+    loaded ahead.
+
+    The time, that the consumer waits for the next example, is the latency
+    of the data loading that is not hidden by the prefetching.
+
+    >>> import numpy as np
+    >>> it = DevicePrefetcher([{'a': np.array([1])}, {'a': np.array([2])}])
+    >>> len(it)
+    2
+    >>> list(it)
+    [{'a': tensor([1])}, {'a': tensor([2])}]
+
+    Note: The iterable is consumed in the background thread, hence an
+        iterable that draws from the global random state (e.g.
+        `np.random`) interleaves with the consumer thread and the
+        random numbers are not reproducible.
+    Note: With a cuda device, up to `depth + 1` examples are on the device
+        at the same time.
+
+    Args:
+        iterable: The examples.
+        depth: The maximum number of examples that are loaded ahead.
+        device: The target device, see `example_to_device`.
+    """
+    def __init__(self, iterable, depth=2, device=None):
+        assert depth > 0, depth
+        self.iterable = iterable
+        self.depth = depth
+        self.device = device
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}({self.iterable!r}, '
+            f'depth={self.depth}, device={self.device!r})'
+        )
+
+    def __len__(self):
+        return len(self.iterable)
+
+    @staticmethod
+    def _put(queue_, stop, item):
+        while not stop.is_set():
+            try:
+                queue_.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, iterator, queue_, stop):
+        try:
+            for example in iterator:
+                example = example_to_device(example, self.device)
+                if not self._put(queue_, stop, ('example', example)):
+                    return
+                del example
+            self._put(queue_, stop, ('end', None))
+        except BaseException as e:
+            self._put(queue_, stop, ('exception', e))
+        finally:
+            if hasattr(iterator, 'close'):
+                # e.g. a generator, that was not consumed completely
+                iterator.close()
+
+    def __iter__(self):
+        queue_ = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._produce,
+            args=(iter(self.iterable), queue_, stop),
+            name=self.__class__.__name__,
+            daemon=True,
+        )
+        thread.start()
+        try:
+            while True:
+                kind, value = queue_.get()
+                if kind == 'end':
+                    return
+                elif kind == 'exception':
+                    raise value
+                yield value
+                del value
+        finally:
+            # e.g. the consumer stopped the iteration (StopTraining, break)
+            stop.set()
+            thread.join()
@@ -0,0 +1,302 @@
+import multiprocessing
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+__all__ = [
+    'Reducer',
+    'MomentsReducer',
+    'LabelReducer',
+    'reduce_dataset',
+]
+
+
+class Reducer:
+    """
+    The interface of a statistic, that is computed by `reduce_dataset`.
+
+    The dataset is split into chunks. Each chunk starts with `initial()`,
+    `update` adds the examples of the chunk to the state and the states of
+    the chunks are combined with `merge`, i.e. `merge` has to be
+    associative and commutative. The states are sent between processes and
+    stored in the checkpoint, hence they have to be picklable.
+    """
+    def initial(self):
+        raise NotImplementedError
+
+    def update(self, state, example):
+        raise NotImplementedError
+
+    def merge(self, state, other):
+        raise NotImplementedError
+
+    def finalize(self, state):
+        return state
+
+
+class MomentsReducer(Reducer):
+    """
+    Computes the mean over `center_axis` and the scale over `scale_axis`
+    of `example[key]` (see `Normalizer` in `padertorch.contrib.je`).
+
+    The mean and the sum of the squared deviations of the mean are
+    accumulated per example and merged with the parallel algorithm of Chan
+    et al., i.e. the variance is numerically stable, unlike
+    E[x**2] - E[x]**2.
+
+    >>> reducer = MomentsReducer('x', center_axis=(1,), scale_axis=(1, 2))
+    >>> state = reducer.initial()
+    >>> state = reducer.update(state, {'x': np.array([[[1., 2.], [3., 6.]]])})
+    >>> state = reducer.update(state, {'x': np.array([[[5., 10.]]])})
+    >>> mean, scale = reducer.finalize(state)
+    >>> mean
+    array([[[3., 6.]]])
+    >>> scale ** 2
+    array([[[6.66666667]]])
+
+    Args:
+        key: The key of the array in the example.
+        center_axis: The axes of the mean. None means no centering.
+        scale_axis: The axes of the scale. None means no scaling. It has to
+            contain `center_axis`.
+    """
+    def __init__(self, key, center_axis=None, scale_axis=None):
+        self.key = key
+        self.center_axis = None if center_axis is None else tuple(center_axis)
+        self.scale_axis = None if scale_axis is None else tuple(scale_axis)
+        if self.center_axis is not None and self.scale_axis is not None:
+            assert set(self.center_axis) <= set(self.scale_axis), (
+                'scale_axis has to contain center_axis',
+                self.center_axis, self.scale_axis,
+            )
+
+    def initial(self):
+        # count, mean and the sum of the squared deviations (or the sum of
+        # squares, when there is no center_axis)
+        return 0, 0., 0.
+
+    def update(self, state, example):
+        x = np.asarray(example[self.key], dtype=np.float64)
+        if self.center_axis is not None:
+            count = np.prod(np.array(x.shape)[np.array(self.center_axis)])
+            mean = np.mean(x, axis=self.center_axis, keepdims=True)
+            m2 = np.sum((x - mean) ** 2, axis=self.center_axis, keepdims=True)
+        elif self.scale_axis is not None:
+            count = np.prod(np.array(x.shape)[np.array(self.scale_axis)])
+            mean = 0.
+            m2 = np.sum(x ** 2, axis=self.scale_axis, keepdims=True)
+        else:
+            return state
+        return self.merge(state, (int(count), mean, m2))
+
+    def merge(self, state, other):
+        count_a, mean_a, m2_a = state
+        count_b, mean_b, m2_b = other
+        if count_a == 0:
+            return other
+        if count_b == 0:
+            return state
+        count = count_a + count_b
+        if self.center_axis is None:
+            return count, 0., m2_a + m2_b
+        delta = mean_b - mean_a
+        mean = mean_a + delta * (count_b / count)
+        m2 = m2_a + m2_b + delta ** 2 * (count_a * count_b / count)
+        return count, mean, m2
+
+    def finalize(self, state):
+        count, mean, m2 = state
+        assert count > 0 or (
+            self.center_axis is None and self.scale_axis is None
+        ), 'No examples'
+        if self.scale_axis is not None:
+            # The mean over the remaining scale axes of the variances (or
+            # energies)
+            scale = np.sqrt(np.mean(
+                m2 / count, axis=self.scale_axis, keepdims=True))
+        else:
+            scale = np.array(1.)
+        return np.array(mean), scale
+
+
+class LabelReducer(Reducer):
+    """
+    Collects the sorted set of labels of `example[key]`.
+
+    >>> reducer = LabelReducer('labels')
+    >>> state = reducer.update(reducer.initial(), {'labels': ['b', 'a']})
+    >>> reducer.finalize(reducer.merge(state, {'c', 'a'}))
+    ['a', 'b', 'c']
+    """
+    def __init__(self, key):
+        self.key = key
+
+    def initial(self):
+        return set()
+
+    def update(self, state, example):
+        labels = example[self.key]
+        if isinstance(labels, np.ndarray):
+            labels = labels.tolist()
+        if isinstance(labels, (tuple, list, set)):
+            state.update(labels)
+        else:
+            state.add(labels)
+        return state
+
+    def merge(self, state, other):
+        return state | other
+
+    def finalize(self, state):
+        return sorted(state)
+
+
+def _reduce_chunk(dataset, reducers, indices):
+    states = {name: r.initial() for name, r in reducers.items()}
+    for index in indices:
+        example = dataset[index]
+        states = {
+            name: r.update(states[name], example)
+            for name, r in reducers.items()
+        }
+    return states
+
+
+# The dataset and the reducers of a worker process, that are inherited
+# with fork (i.e. they do not have to be picklable).
+_worker_args = None
+
+
+def _init_worker(dataset, reducers):
+    global _worker_args
+    _worker_args = dataset, reducers
+
+
+def _reduce_chunk_in_worker(task):
+    i, indices = task
+    return i, _reduce_chunk(*_worker_args, indices)
+
+
+def reduce_dataset(
+        dataset,
+        reducers,
+        num_workers=0,
+        chunk_size=1000,
+        checkpoint_file=None,
+        verbose=False,
+):
+    """
+    Computes multiple statistics (e.g. the moments for a `Normalizer` and
+    the labels for a `LabelEncoder`) in a single pass over a dataset.
+
+    With `num_workers > 0`, the chunks of the dataset are reduced in a
+    process pool (with fork, i.e. the dataset does not have to be
+    picklable) and the partial results are merged in the main process.
+    With a `checkpoint_file`, the merged state of the finished chunks is
+    stored after each chunk and an interrupted pass continues from the
+    checkpoint. The checkpoint is deleted at the end.
+
+    >>> dataset = [{'x': np.full((2, 3), i), 'labels': str(i % 2)}
+    ...            for i in range(5)]
+    >>> results = reduce_dataset(dataset, {
+    ...     'moments': MomentsReducer('x', center_axis=(0,), scale_axis=(0,)),
+    ...     'labels': LabelReducer('labels'),
+    ... }, chunk_size=2)
+    >>> results['moments'][0]
+    array([[2., 2., 2.]])
+    >>> results['labels']
+    ['0', '1']
+
+    Args:
+        dataset: An iterable of examples. When the dataset is indexable
+            (i.e. it has an `indexable` attribute, that is True, like most
+            lazy datasets), it is split into chunks of indices. Otherwise
+            (e.g. a list, a filtered or a prefetched lazy dataset), it is
+            iterated in the main process and `num_workers`, `chunk_size`
+            and `checkpoint_file` are ignored.
+        reducers: A dict of `Reducer`s.
+        num_workers: The number of worker processes. 0 reduces the dataset
+            in the main process.
+        chunk_size: The number of examples of a chunk.
+        checkpoint_file: The file of the checkpoint. None disables the
+            checkpointing.
+        verbose: If True, show a progress bar.
+
+    Returns:
+        A dict with the finalized results of the reducers.
+    """
+    states = {name: r.initial() for name, r in reducers.items()}
+
+    # Each lazy dataset has a `__getitem__`, but e.g. a prefetched dataset
+    # raises an exception for an index and a filtered dataset has no length.
+    if not getattr(dataset, 'indexable', False):
+        for example in tqdm(dataset, disable=not verbose):
+            states = {
+                name: r.update(states[name], example)
+                for name, r in reducers.items()
+            }
+        return {name: r.finalize(states[name]) for name, r in reducers.items()}
+
+    chunks = [
+        range(start, min(start + chunk_size, len(dataset)))
+        for start in range(0, len(dataset), chunk_size)
+    ]
+    done = set()
+    if checkpoint_file is not None:
+        checkpoint_file = Path(checkpoint_file)
+        if checkpoint_file.exists():
+            with checkpoint_file.open('rb') as fid:
+                checkpoint = pickle.load(fid)
+            assert checkpoint['chunks'] == [
+                (c.start, c.stop) for c in chunks
+            ], 'The dataset or the chunk_size changed.'
+            assert checkpoint['states'].keys() == reducers.keys(), (
+                checkpoint['states'].keys(), reducers.keys())
+            states, done = checkpoint['states'], checkpoint['done']
+            if verbose:
+                print(f'Resume from {checkpoint_file} ({len(done)} of '
+                      f'{len(chunks)} chunks done)')
+
+    def add(i, chunk_states):
+        nonlocal states
+        states = {
+            name: r.merge(states[name], chunk_states[name])
+            for name, r in reducers.items()
+        }
+        done.add(i)
+        if checkpoint_file is not None:
+            tmp_file = checkpoint_file.with_name(checkpoint_file.name + '.tmp')
+            with tmp_file.open('wb') as fid:
+                pickle.dump({
+                    'chunks': [(c.start, c.stop) for c in chunks],
+                    'states': states,
+                    'done': done,
+                }, fid)
+            os.replace(tmp_file, checkpoint_file)
+
+    todo = [i for i in range(len(chunks)) if i not in done]
+    with tqdm(total=len(todo), disable=not verbose) as progress:
+        if num_workers == 0:
+            for i in todo:
+                add(i, _reduce_chunk(dataset, reducers, chunks[i]))
+                progress.update()
+        else:
+            # The initializer of a ProcessPoolExecutor requires Python 3.7
+            with multiprocessing.get_context('fork').Pool(
+                    num_workers,
+                    initializer=_init_worker,
+                    initargs=(dataset, reducers),
+            ) as pool:
+                for i, chunk_states in pool.imap_unordered(
+                        _reduce_chunk_in_worker,
+                        [(i, chunks[i]) for i in todo],
+                ):
+                    add(i, chunk_states)
+                    progress.update()
+
+    if checkpoint_file is not None and checkpoint_file.exists():
+        checkpoint_file.unlink()
+    return {name: r.finalize(states[name]) for name, r in reducers.items()}
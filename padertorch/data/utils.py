@@ -1,5 +1,8 @@
 
+import itertools
+
 import numpy as np
+import torch
 
 
 def pad_tensor(vec, pad, axis):
@@ -15,16 +18,236 @@ def pad_tensor(vec, pad, axis):
 
     pad_size = list(vec.shape)
     pad_size[axis] = pad - vec.shape[axis]
-    return np.concatenate([vec, np.zeros(pad_size)], axis=axis)
+    return np.concatenate([vec, np.zeros(pad_size, dtype=vec.dtype)], axis=axis)
+
+
+def _allocate(shape, dtype, memory):
+    if memory is None:
+        return np.empty(shape, dtype=dtype)
+    torch_dtype = torch.from_numpy(np.empty(0, dtype=dtype)).dtype
+    if memory == 'pinned':
+        tensor = torch.empty(shape, dtype=torch_dtype, pin_memory=True)
+    elif memory == 'shared':
+        tensor = torch.empty(shape, dtype=torch_dtype).share_memory_()
+    else:
+        raise ValueError(
+            f'memory has to be None, "pinned" or "shared", not {memory!r}.')
+    # The numpy array keeps the tensor (and hence the memory) alive.
+    return tensor.numpy()
+
+
+def pad_stack(
+        arrays,
+        cut_end=False,
+        pad_value=0,
+        memory=None,
+        return_lengths=False,
+        return_mask=False,
+):
+    """
+    Stacks arrays, that differ at most in one axis, along a new first axis.
+    Shorter arrays are padded at the end with `pad_value` (or longer arrays
+    are cut, when `cut_end` is True).
+
+    The output is allocated once with the common dtype of the arrays (no
+    upcast, e.g. float32 stays float32) and each array is copied in place,
+    i.e. there are no temporary padded copies.
+
+    >>> batch, lengths, mask = pad_stack(
+    ...     [np.ones((3, 2), np.float32), np.ones((1, 2), np.float32)],
+    ...     return_lengths=True, return_mask=True,
+    ... )
+    >>> batch
+    array([[[1., 1.],
+            [1., 1.],
+            [1., 1.]],
+    <BLANKLINE>
+           [[1., 1.],
+            [0., 0.],
+            [0., 0.]]], dtype=float32)
+    >>> lengths
+    array([3, 1])
+    >>> mask
+    array([[ True,  True,  True],
+           [ True, False, False]])
+    >>> pad_stack([np.arange(3), np.arange(2)], cut_end=True)
+    array([[0, 1],
+           [0, 1]])
+
+    Args:
+        arrays: A list of numpy arrays with the same number of dimensions.
+        cut_end: If True, cut the arrays to the shortest array instead of
+            padding them to the longest.
+        pad_value: The value of the padding.
+        memory: None, 'pinned' (page locked memory for fast host to cuda
+            copies) or 'shared' (shared memory, e.g. to send the batch to
+            another process without a copy).
+        return_lengths: If True, also return the lengths of the arrays along
+            the axis that differs (the first axis, when all shapes are
+            equal).
+        return_mask: If True, also return a boolean mask with the shape
+            (batch size, padded length), that is True for the values of the
+            arrays and False for the padding.
+
+    Returns:
+        The stacked array and the lengths and the mask, if requested.
+    """
+    assert len(arrays) > 0, arrays
+    arrays = [np.asarray(array) for array in arrays]
+    assert len({array.ndim for array in arrays}) == 1, (
+        'The arrays need the same number of dimensions.',
+        [array.shape for array in arrays],
+    )
+    shapes = np.array([array.shape for array in arrays], dtype=np.int64)
+    shapes = shapes.reshape(len(arrays), arrays[0].ndim)
+    differs = np.flatnonzero(np.any(shapes != shapes[0], axis=0))
+    assert len(differs) <= 1, (
+        'The arrays are only allowed to differ in one axis.',
+        [array.shape for array in arrays],
+    )
+    if len(differs) == 1:
+        axis = int(differs[0])
+    elif arrays[0].ndim > 0:
+        axis = 0
+    else:
+        axis = None
+    target_shape = shapes.min(axis=0) if cut_end else shapes.max(axis=0)
+
+    out = _allocate(
+        (len(arrays), *target_shape), np.result_type(*arrays), memory)
+    if axis is None:
+        out[...] = arrays
+        lengths = None
+    else:
+        length = target_shape[axis]
+        lengths = np.minimum(shapes[:, axis], length)
+        leading = (slice(None),) * axis
+        for i, (array, n) in enumerate(zip(arrays, lengths)):
+            out[(i, *leading, slice(n))] = array[(*leading, slice(n))]
+            if n < length:
+                out[(i, *leading, slice(n, None))] = pad_value
+
+    if not (return_lengths or return_mask):
+        return out
+    ret = (out,)
+    if return_lengths:
+        ret += (lengths,)
+    if return_mask:
+        ret += (
+            None if lengths is None
+            else np.arange(target_shape[axis]) < lengths[:, None],
+        )
+    return ret
 
 
-def collate_fn(batch):
+def pack_arrays(arrays, include_channel=False, memory=None):
+    """
+    Packs arrays with different lengths along the first axis (or the
+    second axis, when `include_channel` is True) in the layout of a
+    `torch.nn.utils.rnn.PackedSequence`, e.g. in the data workers. The
+    model converts the output with `padertorch.ops.as_packed_sequence`
+    (after `example_to_device`) without padding, sorting or copying the
+    sequences.
+
+    The packed data is allocated once and each array is copied with a
+    single indexed assignment to its rows (cf. `pad_stack`).
+
+    >>> packed = pack_arrays([np.array([1, 2]), np.array([3, 4, 5])])
+    >>> packed['data']
+    array([3, 1, 4, 2, 5])
+    >>> packed['batch_sizes'], packed['sorted_indices']
+    (array([2, 2, 1]), array([1, 0]))
+    >>> packed = pack_arrays(
+    ...     [np.zeros((2, 3, 1)), np.ones((2, 1, 1))], include_channel=True)
+    >>> packed['data'][:, 0]
+    array([0., 0., 1., 1., 0., 0., 0., 0.])
+    >>> packed['num_channels']
+    array([2, 2])
+
+    Args:
+        arrays: A list of numpy arrays with the shape
+            (batch_dependent_sequence_length, ...) or
+            (channel, batch_dependent_sequence_length, ...), when
+            include_channel is True.
+        include_channel: If True, each channel is a sequence (cf.
+            `padertorch.ops.pack_sequence_include_channel`).
+        memory: See `pad_stack`.
+
+    Returns:
+        A dict with the numpy arrays 'data', 'batch_sizes',
+        'sorted_indices' and 'unsorted_indices' (the fields of a
+        `PackedSequence`) and 'num_channels' (the number of channels of
+        each array), when include_channel is True.
+    """
+    from padertorch.ops.sequence.pack_module import pack_indices
+
+    assert len(arrays) > 0, arrays
+    arrays = [np.asarray(array) for array in arrays]
+    if include_channel:
+        num_channels = np.array(
+            [array.shape[0] for array in arrays], dtype=np.int64)
+        lengths = np.repeat([array.shape[1] for array in arrays], num_channels)
+        # A contiguous array of shape (C, T, ...) is a concatenation of C
+        # sequences, i.e. the reshape is a view.
+        arrays = [
+            array.reshape(-1, *array.shape[2:]) for array in arrays
+        ]
+    else:
+        lengths = [array.shape[0] for array in arrays]
+    assert len({array.shape[1:] for array in arrays}) == 1, (
+        'The arrays are only allowed to differ in the sequence axis.',
+        [array.shape for array in arrays],
+    )
+
+    batch_sizes, sorted_indices, unsorted_indices, gather = pack_indices(
+        lengths)
+    # The row of the packed data of each row of the concatenated arrays
+    scatter = np.empty_like(gather)
+    scatter[gather] = np.arange(len(gather))
+
+    data = _allocate(
+        (len(gather), *arrays[0].shape[1:]), np.result_type(*arrays), memory)
+    offset = 0
+    for array in arrays:
+        data[scatter[offset:offset + len(array)]] = array
+        offset += len(array)
+
+    packed = {
+        'data': data,
+        'batch_sizes': batch_sizes,
+        'sorted_indices': sorted_indices,
+        'unsorted_indices': unsorted_indices,
+    }
+    if include_channel:
+        packed['num_channels'] = num_channels
+    return packed
+
+
+def collate_fn(
+        batch, stack_arrays=False, memory=None, pack_keys=(),
+        include_channel=False,
+):
     """Moves list inside of dict recursively.
 
     Can be used as input to batch iterator.
 
+    >>> batch = [{'a': np.ones(2), 'b': 1}, {'a': np.ones(1), 'b': 2}]
+    >>> collate_fn(batch)
+    {'a': [array([1., 1.]), array([1.])], 'b': [1, 2]}
+    >>> collate_fn(batch, stack_arrays=True)
+    {'a': array([[1., 1.],
+           [1., 0.]]), 'b': [1, 2]}
+    >>> collate_fn(batch, pack_keys=['a'])['a']['data']
+    array([1., 1., 1.])
+
     Args:
         batch:
+        stack_arrays: If True, the lists of numpy arrays are padded and
+            stacked with `pad_stack`.
+        memory: See `pad_stack` and `pack_arrays`.
+        pack_keys: The top level keys, whose lists of arrays are packed with
+            `pack_arrays`, e.g. the inputs of a recurrent model.
+        include_channel: See `pack_arrays`.
 
     Returns:
 
@@ -42,9 +265,52 @@ def collate_fn(batch):
             nested_batch[key].append(value)
         return nested_batch[key]
 
+    def nested_stacking(value):
+        if isinstance(value, dict):
+            return {k: nested_stacking(v) for k, v in value.items()}
+        elif isinstance(value[0], np.ndarray):
+            return pad_stack(value, memory=memory)
+        else:
+            return value
+
     nested_batch = {}
     for elem in batch:
         assert isinstance(elem, dict)
         nested_batch = {key: nested_batching(value, key, nested_batch)
                         for key, value in elem.items()}
+    for key in pack_keys:
+        nested_batch[key] = pack_arrays(
+            nested_batch[key], include_channel=include_channel, memory=memory)
+    if stack_arrays:
+        nested_batch = {
+            k: v if k in pack_keys else nested_stacking(v)
+            for k, v in nested_batch.items()
+        }
     return nested_batch
+
+
+def skip_examples(iterable, num_examples):
+    """
+    Skips the first `num_examples` examples of `iterable`, e.g. to resume
+    the training in the middle of an epoch.
+
+    Indexable iterables (list, tuple or an indexable `lazy_dataset.Dataset`)
+    are sliced, i.e. the skipped examples are neither loaded nor
+    transformed. Other iterables (e.g. after `.prefetch(...)` or
+    `.shuffle(reshuffle=True)`) are iterated and the skipped examples are
+    dropped.
+
+    >>> skip_examples([1, 2, 3], 2)
+    [3]
+    >>> list(skip_examples(iter(range(5)), 3))
+    The iterator is not indexable. Load and drop 3 examples to skip them.
+    [3, 4]
+    """
+    if num_examples == 0:
+        return iterable
+    if isinstance(iterable, (list, tuple)) \
+            or getattr(iterable, 'indexable', False):
+        return iterable[num_examples:]
+    print(f'The iterator is not indexable. Load and drop {num_examples} '
+          f'examples to skip them.')
+    return itertools.islice(iterable, num_examples, None)
@@ -1,10 +1,9 @@
 import einops
 import torch
-from torch.nn.utils.rnn import PackedSequence
 
 import padertorch as pt
 from padertorch.ops.mappings import ACTIVATION_FN_MAP
-from padertorch.summary import mask_to_image, stft_to_image
+from padertorch.summary import mask_to_image, stft_to_image, LazyArtifact
 from paderbox.transform import istft
 
 
@@ -67,41 +66,62 @@ class MultiChannelPermutationInvariantTraining(pt.Model):
     def normalize_batch(self, observation, target=None, target2=None):
         # normalizes batch in-place, only one call for forward/review needed
 
-        for b in range(len(observation)):
-            std = torch.sqrt(torch.mean(observation[b]**2))
-            observation[b] /= std
+        if isinstance(observation, (tuple, list)):
+            for b in range(len(observation)):
+                std = torch.sqrt(torch.mean(observation[b]**2))
+                observation[b] /= std
+                if target is not None:
+                    target[b] /= std
+                if target2 is not None:
+                    target2[b] /= std
+            return
+
+        # Packed observation (see pt.data.utils.pack_arrays)
+        packed = pt.ops.as_packed_sequence(observation)
+        std = torch.sqrt(pt.ops.sequence_reduction(
+            torch.mean, pt.ops.sequence.pointwise.sequence_elementwise(
+                torch.square, packed),
+            axis=(0, 2),
+        ))
+        num_sequences = len(std)
+        packed.data.div_(std[pt.ops.packed_sequence_ids(packed)][:, None])
+        for b in range(num_sequences):
             if target is not None:
-                target[b] /= std
+                target[b] /= std[b]
             if target2 is not None:
-                target2[b] /= std
+                target2[b] /= std[b]
         return
 
     def forward(self, batch):
         """
 
         Args:
-            batch: Dictionary with lists of tensors
+            batch: Dictionary with lists of tensors. The input 'Y_abs' can
+                also be packed in the data pipeline (see
+                `pt.data.utils.pack_arrays`).
 
         Returns: List of mask tensors
 
         """
 
         self.normalize_batch(batch['Y_abs'], batch['X_abs'], batch['X_clean'])
-        h = pt.ops.pack_sequence(batch['Y_abs'])
+        h = pt.ops.as_packed_sequence(batch['Y_abs'])
         h_data = pt.ops.sequence.log1p(h.data)
 
         if self.use_pd:
-            cos_pd = pt.ops.pack_sequence(batch['cos_inter_phase_difference'])
-            sin_pd = pt.ops.pack_sequence(batch['sin_inter_phase_difference'])
+            cos_pd = pt.ops.as_packed_sequence(
+                batch['cos_inter_phase_difference'])
+            sin_pd = pt.ops.as_packed_sequence(
+                batch['sin_inter_phase_difference'])
 
             input_data = torch.cat((h_data, cos_pd.data, sin_pd.data), dim=-1)
-            h = PackedSequence(input_data, h.batch_sizes)
+            h = h._replace(data=input_data)
         _, F = h.data.size()
         assert F == self.F, f'self.F = {self.F} != F = {F}'
 
         h_data = self.dropout_input(h.data)
 
-        h = PackedSequence(h_data, h.batch_sizes)
+        h = h._replace(data=h_data)
 
         # Returns tensor with shape (t, b, num_directions * hidden_size)
         h, _ = self.blstm(h)
@@ -111,21 +131,19 @@ class MultiChannelPermutationInvariantTraining(pt.Model):
         h_data = self.output_activation(h_data)
         h_data = self.linear2(h_data)
         h_data = self.output_activation(h_data)
-        h = PackedSequence(h_data, h.batch_sizes)
 
-        mask = PackedSequence(
-            einops.rearrange(h.data, 'tb (k f) -> tb k f', k=self.K),
-            h.batch_sizes,
-        )
+        mask = h._replace(
+            data=einops.rearrange(h_data, 'tb (k f) -> tb k f', k=self.K))
         return pt.ops.unpack_sequence(mask)
 
     def review(self, batch, model_out):
         # TODO: Maybe calculate only one loss? May be much faster.
+        observations = pt.ops.as_sequence_list(batch['Y_abs'])
         pit_mse_loss = list()
 
         for mask, observation, target in zip(
                 model_out,
-                batch['Y_abs'],
+                observations,
                 batch['X_abs']
         ):
 
@@ -138,7 +156,7 @@ class MultiChannelPermutationInvariantTraining(pt.Model):
         pit_ips_loss = list()
         for mask, observation, target, cos_phase_diff in zip(
                 model_out,
-                batch['Y_abs'],
+                observations,
                 batch['X_abs'],
                 batch['cos_phase_difference']
         ):
@@ -152,7 +170,7 @@ class MultiChannelPermutationInvariantTraining(pt.Model):
         pit_ips_clean_loss = list()
         for mask, observation, target, cos_phase_diff in zip(
                 model_out,
-                batch['Y_abs'],
+                observations,
                 batch['X_clean'],
                 batch['cos_phase_difference']
         ):
@@ -183,12 +201,14 @@ class MultiChannelPermutationInvariantTraining(pt.Model):
 
         b = 0
         images = dict()
-        images['observation'] = stft_to_image(batch['Y_abs'][b])
+        images['observation'] = LazyArtifact(stft_to_image, observations[b])
         for i in range(model_out[b].shape[1]):
-            images[f'mask_{i}'] = mask_to_image(model_out[b][:, i, :])
-            images[f'target_{i}'] = stft_to_image(batch['X_abs'][b][:, i, :])
-            images[f'estimation_{i}'] = stft_to_image(
-                batch['Y_abs'][b]*model_out[b][:, i, :])
+            images[f'mask_{i}'] = LazyArtifact(
+                mask_to_image, model_out[b][:, i, :])
+            images[f'target_{i}'] = LazyArtifact(
+                stft_to_image, batch['X_abs'][b][:, i, :])
+            images[f'estimation_{i}'] = LazyArtifact(
+                stft_to_image, observations[b]*model_out[b][:, i, :])
 
         return dict(losses=losses,
                     images=images
@@ -262,14 +282,16 @@ class PermutationInvariantTrainingModel(pt.Model):
         """
 
         Args:
-            batch: Dictionary with lists of tensors
+            batch: Dictionary with lists of tensors. The input 'Y_abs' can
+                also be packed in the data pipeline (see
+                `pt.data.utils.pack_arrays`).
 
         Returns: List of mask tensors
             Each list element has shape (T, K, F)
 
         """
 
-        h = pt.ops.pack_sequence(batch['Y_abs'])
+        h = pt.ops.as_packed_sequence(batch['Y_abs'])
 
         _, F = h.data.size()
         assert F == self.F, f'self.F = {self.F} != F = {F}'
@@ -277,7 +299,7 @@ class PermutationInvariantTrainingModel(pt.Model):
         h_data = self.dropout_input(h.data)
 
         h_data = pt.ops.sequence.log1p(h_data)
-        h = PackedSequence(h_data, h.batch_sizes)
+        h = h._replace(data=h_data)
 
         # Returns tensor with shape (t, b, num_directions * hidden_size)
         h, _ = self.blstm(h)
@@ -287,21 +309,19 @@ class PermutationInvariantTrainingModel(pt.Model):
         h_data = self.output_activation(h_data)
         h_data = self.linear2(h_data)
         h_data = self.output_activation(h_data)
-        h = PackedSequence(h_data, h.batch_sizes)
 
-        mask = PackedSequence(
-            einops.rearrange(h.data, 'tb (k f) -> tb k f', k=self.K),
-            h.batch_sizes,
-        )
+        mask = h._replace(
+            data=einops.rearrange(h_data, 'tb (k f) -> tb k f', k=self.K))
         return pt.ops.unpack_sequence(mask)
 
     def review(self, batch, model_out):
         # TODO: Maybe calculate only one loss? May be much faster.
+        observations = pt.ops.as_sequence_list(batch['Y_abs'])
 
         pit_mse_loss = list()
         for mask, observation, target in zip(
                 model_out,
-                batch['Y_abs'],
+                observations,
                 batch['X_abs']
         ):
             pit_mse_loss.append(pt.ops.losses.loss.pit_loss(
@@ -313,7 +333,7 @@ class PermutationInvariantTrainingModel(pt.Model):
         pit_ips_loss = list()
         for mask, observation, target, cos_phase_diff in zip(
             model_out,
-            batch['Y_abs'],
+            observations,
             batch['X_abs'],
             batch['cos_phase_difference']
         ):
@@ -330,11 +350,14 @@ class PermutationInvariantTrainingModel(pt.Model):
 
         b = 0
         images = dict()
-        images['observation'] = stft_to_image(batch['Y_abs'][b])
+        images['observation'] = LazyArtifact(stft_to_image, observations[b])
         for i in range(model_out[b].shape[1]):
-            images[f'mask_{i}'] = mask_to_image(model_out[b][:, i, :])
-            images[f'target_{i}'] = stft_to_image(batch['X_abs'][b][:, 0, :])
-            images[f'estimation_{i}'] = stft_to_image(batch['X_abs'][b][:, 0, :])
+            images[f'mask_{i}'] = LazyArtifact(
+                mask_to_image, model_out[b][:, i, :])
+            images[f'target_{i}'] = LazyArtifact(
+                stft_to_image, batch['X_abs'][b][:, 0, :])
+            images[f'estimation_{i}'] = LazyArtifact(
+                stft_to_image, batch['X_abs'][b][:, 0, :])
 
         return dict(losses=losses,
                     images=images
@@ -374,13 +397,15 @@ class DeepClusteringModel(pt.Model):
         """
 
         Args:
-            batch: Dictionary with lists of tensors
+            batch: Dictionary with lists of tensors. The input 'Y_abs' can
+                also be packed in the data pipeline (see
+                `pt.data.utils.pack_arrays`).
 
         Returns: List of mask tensors
 
         """
 
-        h = pt.ops.pack_sequence(batch['Y_abs'])
+        h = pt.ops.as_packed_sequence(batch['Y_abs'])
 
         if self.input_feature_transform == 'identity':
             pass
@@ -388,7 +413,7 @@ class DeepClusteringModel(pt.Model):
             # This is equal to the mu-law for mu=1.
             h = pt.ops.sequence.log1p(h)
         elif self.input_feature_transform == 'log':
-            h = PackedSequence(h.data + 1e-10, h.batch_sizes)
+            h = h._replace(data=h.data + 1e-10)
             h = pt.ops.sequence.log(h)
         else:
             raise NotImplementedError(self.input_feature_transform)
@@ -399,13 +424,13 @@ class DeepClusteringModel(pt.Model):
         # Returns tensor with shape (t, b, num_directions * hidden_size)
         h, _ = self.blstm(h)
 
-        h = PackedSequence(self.linear(h.data), h.batch_sizes)
-        h_data = einops.rearrange(h.data, 'tb (e f) -> tb e f', e=self.E)
+        h_data = self.linear(h.data)
+        h_data = einops.rearrange(h_data, 'tb (e f) -> tb e f', e=self.E)
 
         # Hershey 2016 page 2 top right paragraph: Unit norm
         h_data = torch.nn.functional.normalize(h_data, dim=-2)
 
-        embedding = PackedSequence(h_data, h.batch_sizes,)
+        embedding = h._replace(data=h_data)
         embedding = pt.ops.unpack_sequence(embedding)
         return embedding
 
@@ -6,7 +6,7 @@ from padertorch.modules.mask_estimator import MaskEstimator
 from padertorch.modules.mask_estimator import MaskKeys as K
 from padertorch.ops.mappings import TORCH_POOLING_FN_MAP
 
-from padertorch.summary import mask_to_image, stft_to_image
+from padertorch.summary import mask_to_image, stft_to_image, LazyArtifact
 
 class MaskLossKeys:
     NOISE_MASK = 'noise_mask_loss'
@@ -74,24 +74,28 @@ class MaskEstimatorModel(pt.Model):
                     )
 
     def add_images(self, batch, output):
+        # The images are only computed, when the SummaryHook writes them.
         images = dict()
         if K.SPEECH_PRED in output:
             speech_pred = output[K.SPEECH_PRED][0]
-            images['speech_pred'] = mask_to_image(speech_pred, True)
+            images['speech_pred'] = LazyArtifact(
+                mask_to_image, speech_pred, True)
         if K.SPEECH_MASK_PRED in output:
             speech_mask = output[K.SPEECH_MASK_PRED][0]
-            images['speech_mask'] = mask_to_image(speech_mask, True)
+            images['speech_mask'] = LazyArtifact(
+                mask_to_image, speech_mask, True)
         observation = batch[K.OBSERVATION_ABS][0]
-        images['observed_stft'] = stft_to_image(observation, True)
+        images['observed_stft'] = LazyArtifact(stft_to_image, observation, True)
         if K.NOISE_MASK_PRED in output:
             noise_mask = output[K.NOISE_MASK_PRED][0]
-            images['noise_mask'] = mask_to_image(noise_mask, True)
+            images['noise_mask'] = LazyArtifact(
+                mask_to_image, noise_mask, True)
         if batch is not None and K.SPEECH_MASK_TARGET in batch:
-            images['speech_mask_target'] = mask_to_image(
-                batch[K.SPEECH_MASK_TARGET][0], True)
+            images['speech_mask_target'] = LazyArtifact(
+                mask_to_image, batch[K.SPEECH_MASK_TARGET][0], True)
             if K.NOISE_MASK_TARGET in batch:
-                images['noise_mask_target'] = mask_to_image(
-                    batch[K.NOISE_MASK_TARGET][0], True)
+                images['noise_mask_target'] = LazyArtifact(
+                    mask_to_image, batch[K.NOISE_MASK_TARGET][0], True)
         return images
 
     # ToDo: add scalar review
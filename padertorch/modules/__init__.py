@@ -1,3 +1,4 @@
+from . import features
 from .fully_connected import fully_connected_stack
 from . import mask_estimator
 from .wavenet.wavenet import WaveNet
@@ -0,0 +1,356 @@
+"""
+Feature extraction in torch, that runs on padded batches, e.g. in the
+forward of a model on the device of the model:
+
+>>> extractor = AudioFeatures(
+...     sample_rate=16000, stft_size=512, stft_shift=160, window_length=400,
+...     n_mels=64,
+... )
+>>> audio = torch.randn(3, 16000)
+>>> features, frame_lengths = extractor(audio, [16000, 8000, 4000])
+>>> features.shape
+torch.Size([3, 102, 64])
+>>> frame_lengths
+[102, 52, 27]
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+from paderbox.transform.module_fbank import get_fbanks
+from scipy import signal
+from typing import Optional
+
+from padertorch.base import Module
+
+__all__ = [
+    'samples_to_stft_frames',
+    'mel_filterbank',
+    'STFT',
+    'MelTransform',
+    'AudioFeatures',
+]
+
+
+def _maximum(x, minimum):
+    if torch.is_tensor(x):
+        return torch.clamp(x, min=minimum)
+    return np.maximum(x, minimum)
+
+
+def samples_to_stft_frames(
+        num_samples, window_length, shift, fading='full', pad=True
+):
+    """
+    The number of frames of `STFT` (and `paderbox.transform.stft`) for
+    signals with `num_samples` samples.
+
+    >>> samples_to_stft_frames(16000, 400, 160, fading=None, pad=False)
+    98
+    >>> samples_to_stft_frames(np.array([19, 20, 21]), 16, 4)
+    array([8, 8, 9])
+    >>> samples_to_stft_frames(torch.tensor([10, 400]), 400, 160, None)
+    tensor([1, 1])
+
+    Args:
+        num_samples: An int, a numpy array or a tensor.
+        window_length:
+        shift:
+        fading: None, 'full' or 'half', see `STFT`.
+        pad: see `STFT`.
+
+    Returns:
+        The number of frames with the type of `num_samples`.
+    """
+    assert fading in [None, True, False, 'full', 'half'], fading
+    if fading not in [None, False]:
+        if fading == 'half':
+            num_samples = num_samples + window_length - shift
+        else:
+            num_samples = num_samples + 2 * (window_length - shift)
+    if pad:
+        frames = _maximum(
+            (num_samples - window_length + shift - 1) // shift, 0) + 1
+    else:
+        frames = _maximum((num_samples - window_length) // shift + 1, 0)
+    if isinstance(frames, np.generic):
+        frames = int(frames)
+    return frames
+
+
+def mel_filterbank(
+        sample_rate, fft_length, n_mels, fmin=50, fmax=None, normalize=True
+):
+    """
+    The mel filterbank of `paderbox.transform.module_fbank.MelTransform`
+    (triangular filters on the htk mel scale), with the shape
+    (fft_length // 2 + 1, n_mels), i.e. the features match the features of
+    the data pipeline.
+
+    >>> fbanks = mel_filterbank(16000, 512, 40)
+    >>> fbanks.shape
+    (257, 40)
+    >>> np.allclose(fbanks.sum(axis=0), 1.)
+    True
+
+    Args:
+        sample_rate:
+        fft_length: The fft size of the stft.
+        n_mels: The number of filters.
+        fmin: The lowest frequency (onset of the first filter).
+        fmax: The highest frequency (offset of the last filter). Defaults
+            to sample_rate / 2.
+        normalize: If True, each filter sums to one.
+
+    Returns:
+        The filterbank as numpy array.
+    """
+    fbanks = get_fbanks(
+        sample_rate=sample_rate,
+        stft_size=fft_length,
+        number_of_filters=n_mels,
+        lowest_frequency=fmin,
+        highest_frequency=fmax,
+    )
+    if normalize:
+        # The eps of paderbox.transform.module_fbank.MelTransform
+        fbanks = fbanks / (fbanks.sum(axis=-1, keepdims=True) + 1e-18)
+    return fbanks.T.astype(np.float32)
+
+
+class STFT(Module):
+    """
+    Short time Fourier transform with the parameters and the output of
+    `paderbox.transform.stft` (time axis -1, output shape
+    (..., frames, size // 2 + 1)), vectorized over the batch.
+
+    >>> stft = STFT(size=512, shift=160, window_length=400)
+    >>> x, frame_lengths = stft(torch.randn(2, 1, 1000), [1000, 500])
+    >>> x.shape, x.dtype, frame_lengths
+    (torch.Size([2, 1, 8, 257]), torch.complex64, [8, 5])
+
+    Args:
+        size: The fft size.
+        shift: The step between successive frames in samples.
+        window_length: The length of the window, defaults to size.
+        window: The name of a window in `scipy.signal.windows` or a window
+            function.
+        symmetric_window: If False, the window is periodic.
+        fading: None, 'full' or 'half'. Pads the signal with zeros to fade
+            in and fade out.
+        pad: If True, zero pad the end of the signal to complete the last
+            frame, else the incomplete frame is dropped.
+    """
+    def __init__(
+            self,
+            size: int = 1024,
+            shift: int = 256,
+            window_length: Optional[int] = None,
+            window='blackman',
+            symmetric_window: bool = False,
+            fading: Optional[str] = 'full',
+            pad: bool = True,
+    ):
+        super().__init__()
+        assert fading in [None, True, False, 'full', 'half'], fading
+        self.size = size
+        self.shift = shift
+        self.window_length = size if window_length is None else window_length
+        self.fading = fading
+        self.pad = pad
+
+        if isinstance(window, str):
+            window = getattr(signal.windows, window)
+        if symmetric_window:
+            window = window(self.window_length)
+        else:
+            window = window(self.window_length + 1)[:-1]
+        self.register_buffer(
+            'window', torch.from_numpy(np.asarray(window, np.float32)))
+
+    def frames(self, num_samples):
+        """See `samples_to_stft_frames`."""
+        return samples_to_stft_frames(
+            num_samples, self.window_length, self.shift,
+            fading=self.fading, pad=self.pad,
+        )
+
+    def forward(self, x, sequence_lengths=None):
+        """
+
+        Args:
+            x: Time signal with shape (batch_size, ..., num_samples).
+            sequence_lengths: The number of samples of each signal in the
+                batch or None, if no signal is padded.
+
+        Returns:
+            The stft with shape (batch_size, ..., frames, size // 2 + 1) and
+            the number of frames of each signal (None, if
+            sequence_lengths is None). The frames after the end of a
+            signal are zero.
+        """
+        if sequence_lengths is not None:
+            # The padding of the batch has to be zero, then it acts as the
+            # fading and the padding of the shorter signals.
+            mask = _mask(sequence_lengths, x.shape[-1], x.device)
+            x = x * mask.view(-1, *[1] * (x.dim() - 2), x.shape[-1])
+
+        pad_width = self.window_length - self.shift
+        if self.fading == 'half':
+            x = F.pad(x, [pad_width // 2, pad_width - pad_width // 2])
+        elif self.fading not in [None, False]:
+            x = F.pad(x, [pad_width, pad_width])
+        num_frames = self.frames(x.shape[-1] - (
+            0 if self.fading in [None, False]
+            else pad_width if self.fading == 'half' else 2 * pad_width
+        ))
+        missing = (num_frames - 1) * self.shift + self.window_length \
+            - x.shape[-1]
+        if missing > 0:
+            x = F.pad(x, [0, missing])
+
+        frames = x.unfold(-1, self.window_length, self.shift)[..., :num_frames, :]
+        x = torch.fft.rfft(frames * self.window, n=self.size, dim=-1)
+
+        if sequence_lengths is None:
+            return x, None
+        frame_lengths = self.frames(_as_lengths(sequence_lengths))
+        mask = _mask(frame_lengths, num_frames, x.device)
+        x = x * mask.view(-1, *[1] * (x.dim() - 3), num_frames, 1)
+        if isinstance(sequence_lengths, (list, tuple)):
+            frame_lengths = frame_lengths.tolist()
+        return x, frame_lengths
+
+
+def _as_lengths(sequence_lengths):
+    if torch.is_tensor(sequence_lengths):
+        return sequence_lengths
+    return np.asarray(sequence_lengths)
+
+
+def _mask(lengths, size, device):
+    lengths = torch.as_tensor(np.asarray(lengths) if not torch.is_tensor(
+        lengths) else lengths, device=device)
+    return torch.arange(size, device=device) < lengths[:, None]
+
+
+class MelTransform(Module):
+    """
+    Transforms a (power) spectrogram with the shape (..., fft_length // 2 + 1)
+    to a (log) mel spectrogram with the shape (..., n_mels).
+
+    >>> mel_transform = MelTransform(16000, 512, 40)
+    >>> mel_transform(torch.ones(2, 100, 257)).shape
+    torch.Size([2, 100, 40])
+
+    Args:
+        sample_rate: sample rate of audio signal
+        fft_length: fft_length used in stft
+        n_mels: number of filters to be applied
+        fmin: lowest frequency (onset of first filter)
+        fmax: highest frequency (offset of last filter)
+        log: apply log to mel spectrogram
+        eps:
+        trainable: If True, the filterbank is a parameter.
+    """
+    def __init__(
+            self,
+            sample_rate: int,
+            fft_length: int,
+            n_mels: int,
+            fmin: Optional[int] = 50,
+            fmax: Optional[int] = None,
+            log: bool = True,
+            eps=1e-18,
+            trainable: bool = False,
+    ):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.fft_length = fft_length
+        self.n_mels = n_mels
+        self.fmin = fmin
+        self.fmax = fmax
+        self.log = log
+        self.eps = eps
+        fbanks = torch.from_numpy(mel_filterbank(
+            sample_rate, fft_length, n_mels, fmin=fmin, fmax=fmax))
+        if trainable:
+            self.fbanks = torch.nn.Parameter(fbanks)
+        else:
+            self.register_buffer('fbanks', fbanks)
+
+    def forward(self, x):
+        x = torch.matmul(x, self.fbanks)
+        if self.log:
+            x = torch.log(x + self.eps)
+        return x
+
+
+class AudioFeatures(Module):
+    """
+    STFT, power spectrum, mel filterbank and log of a padded batch of
+    audio signals, see the module docstring.
+
+    Args:
+        sample_rate:
+        stft_size: see `STFT` size.
+        stft_shift: see `STFT` shift.
+        window_length: see `STFT`.
+        window: see `STFT`.
+        fading: see `STFT`.
+        pad: see `STFT`.
+        n_mels: The number of mel filters. None returns the (log) power
+            spectrum.
+        fmin: see `MelTransform`.
+        fmax: see `MelTransform`.
+        log: If True, return the log of the (mel) power spectrum.
+        eps:
+    """
+    def __init__(
+            self,
+            sample_rate: int = 16000,
+            stft_size: int = 512,
+            stft_shift: int = 160,
+            window_length: Optional[int] = None,
+            window='blackman',
+            fading: Optional[str] = 'full',
+            pad: bool = True,
+            n_mels: Optional[int] = 64,
+            fmin: Optional[int] = 50,
+            fmax: Optional[int] = None,
+            log: bool = True,
+            eps=1e-18,
+    ):
+        super().__init__()
+        self.stft = STFT(
+            size=stft_size, shift=stft_shift, window_length=window_length,
+            window=window, fading=fading, pad=pad,
+        )
+        if n_mels is None:
+            self.mel_transform = None
+        else:
+            self.mel_transform = MelTransform(
+                sample_rate, stft_size, n_mels, fmin=fmin, fmax=fmax,
+                log=False,
+            )
+        self.log = log
+        self.eps = eps
+
+    def forward(self, x, sequence_lengths=None):
+        """
+
+        Args:
+            x: Time signal with shape (batch_size, ..., num_samples).
+            sequence_lengths: The number of samples of each signal or None.
+
+        Returns:
+            The features with shape (batch_size, ..., frames, n_mels) and
+            the number of frames of each signal. The frames after the end
+            of a signal are log(eps) (or zero, when log is False).
+        """
+        x, frame_lengths = self.stft(x, sequence_lengths)
+        x = x.real ** 2 + x.imag ** 2
+        if self.mel_transform is not None:
+            x = self.mel_transform(x)
+        if self.log:
+            x = torch.log(x + self.eps)
+        return x, frame_lengths
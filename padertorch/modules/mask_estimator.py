@@ -1,12 +1,11 @@
 import torch
 from einops import rearrange
-from torch.nn.utils.rnn import PackedSequence
 
 import padertorch as pt
 from padertorch.modules import fully_connected_stack
 from padertorch.modules.normalization import Normalization
 from padertorch.modules.recurrent import StatefulLSTM
-from padertorch.ops import pack_sequence, pad_packed_sequence
+from padertorch.ops import as_packed_sequence, pad_packed_sequence
 from padertorch.ops.mappings import ACTIVATION_FN_MAP
 
 __all__ = [
@@ -110,22 +109,29 @@ class MaskEstimator(pt.Module):
 
     def forward(self, x):
         """
-        :param x: list of tensors of shape(C T F)
+        :param x: list of tensors of shape(C T F) or the output of
+            pt.data.utils.pack_arrays with include_channel=True
         :return:
         """
-        num_channels = x[0].shape[0]
-        h = [obs_single_channel for obs in x for obs_single_channel in obs]
-        h = pack_sequence(h)
+        if isinstance(x, dict):
+            num_channels = int(x['num_channels'][0])
+            assert all([int(c) == num_channels for c in x['num_channels']]), (
+                'All examples need the same number of channels',
+                x['num_channels'],
+            )
+        else:
+            num_channels = x[0].shape[0]
+        h = as_packed_sequence(x, include_channel=True)
         if self.normalization:
-            h = PackedSequence(self.normalization(h.data), h.batch_sizes) # only works with torch 1.0 and higher
-        h = PackedSequence(self.input_dropout(h.data), h.batch_sizes)
+            h = h._replace(data=self.normalization(h.data)) # only works with torch 1.0 and higher
+        h = h._replace(data=self.input_dropout(h.data))
 
         if not self.fix_states:
             del self.recurrent.states
         h = self.recurrent(h)
-        h = PackedSequence(self.fully_connected(h.data), h.batch_sizes)
+        h = h._replace(data=self.fully_connected(h.data))
         out = pad_packed_sequence(h, batch_first=True)[0]
-        out = rearrange(out, '(c b) t f -> b c t f', c=num_channels)
+        out = rearrange(out, '(b c) t f -> b c t f', c=num_channels)
         target_logits = out[..., :self.num_features]
         target_mask = ACTIVATION_FN_MAP[self.output_activation]()(target_logits)
         out_dict = {
@@ -1,5 +1,6 @@
 import torch
 import padertorch as pt
+from padertorch.ops.sequence.reduction import expand_packed
 from padertorch.ops.sequence.reduction import sequence_reduction
 from torch.nn.utils.rnn import PackedSequence
 
@@ -19,6 +20,10 @@ class Normalization(pt.Module):
             learnable affine parameters. Default: ``True
             and always uses batch statistics in both training and eval modes.
     :return: tuple of lp-statistics
+
+    For a PackedSequence the statistics are computed for each sequence
+    (statistics_axis 0 is the time axis) with a segment reduction over the
+    packed data.
     """
     def __init__(self, num_features=None, order='l2', statistics_axis=0,
                  independent_axis=-1, norm_epsilon=1e-5, affine=True):
@@ -50,6 +55,8 @@ class Normalization(pt.Module):
             torch.nn.init.zeros_(self.bias)
 
     def get_statistics(self, tensor):
+        if isinstance(tensor, PackedSequence):
+            return self._get_packed_statistics(tensor)
         if self.order == 'l1':
             mean = sequence_reduction(
                 torch.mean,
@@ -88,9 +95,49 @@ class Normalization(pt.Module):
 
         return mean, norm
 
+    def _get_packed_statistics(self, tensor):
+        mean = sequence_reduction(
+            torch.mean,
+            tensor,
+            axis=self.statistics_axis,
+            keepdims=True
+        )
+        if self.order == 'l1':
+            deviation = torch.abs(tensor.data)
+        elif self.order in ['l2', 'mean']:
+            deviation = torch.abs(
+                tensor.data - expand_packed(mean, tensor))**2
+        else:
+            raise ValueError(f'chosen order {self.order} in is not'
+                             f' known in {self}')
+        norm = sequence_reduction(
+            torch.mean,
+            tensor._replace(data=deviation),
+            axis=self.statistics_axis,
+            keepdims=True
+        )
+
+        norm = norm._replace(data=norm.data + self.norm_epsilon)
+        if self.order == 'l2':
+            norm = pt.ops.pointwise.sqrt(norm)
+        if self.order == 'mean':
+            norm = None
+
+        return mean, norm
+
     def forward(self, tensor):
         if isinstance(tensor, PackedSequence):
-            raise NotImplementedError
+            mean, norm = self.get_statistics(tensor)
+            data = tensor.data - expand_packed(mean, tensor)
+            if norm is not None:
+                data = data / expand_packed(norm, tensor)
+            if self.affine:
+                # The time and batch axes are collapsed in the data.
+                dims = data.dim() * [1]
+                for axis in self.independent_axis:
+                    dims[axis - 1 if axis > 0 else axis] = -1
+                data = (data + self.bias.view(dims)) * self.weight.view(dims)
+            return tensor._replace(data=data)
         mean, norm = self.get_statistics(tensor)
         if mean is not None:
             tensor -= mean
@@ -4,17 +4,23 @@ packed: PackedSequence
 padded
 list of tensor
 
+A packed sequence can also be built in the data pipeline with
+`padertorch.data.utils.pack_arrays` (e.g. in the workers of the data loader)
+and converted with `as_packed_sequence` in the model.
+
 # ToDo add contiguous to pack_padded_sequence if needed
-# TODO: Improve speed of pack_sequence by avoiding padding inbetween
 """
+import functools
+
+import numpy as np
 import torch
 from torch.nn.utils.rnn import PackedSequence
 from torch.nn.utils.rnn import pad_packed_sequence
 from torch.nn.utils.rnn import pack_padded_sequence
-from torch.nn.utils.rnn import pack_sequence
 from torch.nn.utils.rnn import pad_sequence
 
 __all__ = [
+    'pack_indices',
     'pack_sequence',
     'unpack_sequence',
     'pad_sequence',
@@ -23,9 +29,101 @@ __all__ = [
     'pack_padded_sequence',
     'pack_sequence_include_channel',
     'unpack_sequence_include_channel_like',
+    'as_packed_sequence',
+    'as_sequence_list',
+    'packed_ranks',
+    'packed_sequence_ids',
 ]
 
 
+def pack_indices(lengths, enforce_sorted=False):
+    """
+    Computes the layout of a `PackedSequence` for sequences with `lengths`.
+
+    The rows of the packed data are the rows of the concatenated sequences
+    in the order `gather`, i.e.
+    `packed.data == torch.cat(sequences)[gather]`.
+
+    >>> batch_sizes, sorted_indices, unsorted_indices, gather = pack_indices(
+    ...     [2, 3])
+    >>> batch_sizes, sorted_indices, unsorted_indices
+    (array([2, 2, 1]), array([1, 0]), array([1, 0]))
+    >>> gather
+    array([2, 0, 3, 1, 4])
+
+    Args:
+        lengths: The lengths of the sequences.
+        enforce_sorted: If True, the lengths have to be sorted in
+            decreasing order and the indices are None (cf.
+            `torch.nn.utils.rnn.pack_sequence`).
+
+    Returns:
+        batch_sizes, sorted_indices, unsorted_indices and gather as numpy
+        arrays.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    assert lengths.ndim == 1 and len(lengths) > 0, lengths
+    assert np.all(lengths > 0), ('Empty sequences are not supported', lengths)
+    if enforce_sorted:
+        assert np.all(np.diff(lengths) <= 0), (
+            'The lengths have to be sorted in decreasing order, when '
+            'enforce_sorted is True.', lengths
+        )
+        sorted_indices = unsorted_indices = None
+        sorted_lengths = lengths
+        offsets = np.cumsum(lengths) - lengths
+    else:
+        # Stable, i.e. equal lengths (e.g. channels) keep their order.
+        sorted_indices = np.argsort(-lengths, kind='stable')
+        unsorted_indices = np.empty_like(sorted_indices)
+        unsorted_indices[sorted_indices] = np.arange(len(lengths))
+        sorted_lengths = lengths[sorted_indices]
+        offsets = (np.cumsum(lengths) - lengths)[sorted_indices]
+
+    frames = np.arange(sorted_lengths[0])[:, None]
+    mask = frames < sorted_lengths[None, :]
+    batch_sizes = np.sum(mask, axis=1)
+    gather = (offsets[None, :] + frames)[mask]
+    return batch_sizes, sorted_indices, unsorted_indices, gather
+
+
+def _pack(data, lengths, enforce_sorted):
+    batch_sizes, sorted_indices, unsorted_indices, gather = pack_indices(
+        lengths, enforce_sorted=enforce_sorted)
+
+    def as_tensor(indices):
+        if indices is None:
+            return None
+        return torch.from_numpy(indices).to(data.device)
+
+    return PackedSequence(
+        data[as_tensor(gather)],
+        torch.from_numpy(batch_sizes),
+        as_tensor(sorted_indices),
+        as_tensor(unsorted_indices),
+    )
+
+
+def pack_sequence(sequences, enforce_sorted=True):
+    """
+    Same as `torch.nn.utils.rnn.pack_sequence`, but the sequences are
+    concatenated and gathered in the packed order, i.e. the sequences are
+    not padded inbetween.
+
+    >>> pack_sequence([torch.tensor([1, 2, 3]), torch.tensor([4, 5])])
+    PackedSequence(data=tensor([1, 4, 2, 5, 3]), batch_sizes=tensor([2, 2, 1]), sorted_indices=None, unsorted_indices=None)
+    >>> pack_sequence([torch.tensor([1]), torch.tensor([2, 3])],
+    ...               enforce_sorted=False)
+    PackedSequence(data=tensor([2, 1, 3]), batch_sizes=tensor([2, 1]), sorted_indices=tensor([1, 0]), unsorted_indices=tensor([1, 0]))
+    """
+    assert isinstance(sequences, (tuple, list)), type(sequences)
+    return _pack(
+        torch.cat(list(sequences)),
+        [len(sequence) for sequence in sequences],
+        enforce_sorted,
+    )
+
+
 def unpack_sequence(packed_sequence: PackedSequence) -> list:
     return unpad_sequence(*pad_packed_sequence(packed_sequence))
 
@@ -34,7 +132,7 @@ def unpad_sequence(padded_sequence: torch.Tensor, lengths: list):
     return [padded_sequence[:l, b, ...] for b, l in enumerate(lengths)]
 
 
-def pack_sequence_include_channel(list_of_tensors):
+def pack_sequence_include_channel(list_of_tensors, enforce_sorted=True):
     """
     Similar to pack_sequence, but expect that the input has the following
     shape:
@@ -104,14 +202,19 @@ def pack_sequence_include_channel(list_of_tensors):
     """
     assert isinstance(list_of_tensors, (tuple, list))
 
-    sequences = [
-        sequence
-        for entry in list_of_tensors
-        # Assume splitting of the tensor entry is cheap enough and later
-        # the python loop efficient enough with the memcopy.
-        for sequence in entry
-    ]
-    return pack_sequence(sequences)
+    # The channels of an entry are consecutive sequences in the
+    # concatenation, i.e. the entries are not split into channels.
+    return _pack(
+        torch.cat([
+            entry.reshape(-1, *entry.shape[2:]) for entry in list_of_tensors
+        ]),
+        [
+            entry.shape[1]
+            for entry in list_of_tensors
+            for _ in range(entry.shape[0])
+        ],
+        enforce_sorted,
+    )
 
 
 def unpack_sequence_include_channel_like(packed, like):
@@ -142,3 +245,120 @@ def unpack_sequence_include_channel_like(packed, like):
         index = index + channels
 
     return new
+
+
+def as_packed_sequence(x, include_channel=False):
+    """
+    Converts a list of tensors, the output of
+    `padertorch.data.utils.pack_arrays` (e.g. after `example_to_device`) or
+    a `PackedSequence` to a `PackedSequence`.
+
+    >>> import padertorch as pt
+    >>> packed = pt.data.utils.pack_arrays([np.ones((2, 3)), np.ones((3, 3))])
+    >>> as_packed_sequence(pt.data.example_to_device(packed)).batch_sizes
+    tensor([2, 2, 1])
+    >>> as_packed_sequence([torch.ones(2, 3), torch.ones(3, 3)]).batch_sizes
+    tensor([2, 2, 1])
+
+    Args:
+        x: A list of tensors (batch batch_dependent_sequence_length ... or
+            batch channel batch_dependent_sequence_length ..., when
+            include_channel is True), a dict with the keys 'data',
+            'batch_sizes', 'sorted_indices' and 'unsorted_indices' or a
+            `PackedSequence`.
+        include_channel: See `pack_sequence_include_channel`. Only used for
+            a list of tensors.
+
+    Returns:
+        A `PackedSequence`.
+    """
+    if isinstance(x, PackedSequence):
+        return x
+    elif isinstance(x, dict):
+        data = torch.as_tensor(x['data'])
+
+        def as_tensor(indices):
+            if indices is None:
+                return None
+            return torch.as_tensor(indices).to(data.device)
+
+        # The batch sizes have to be on the cpu.
+        return PackedSequence(
+            data,
+            torch.as_tensor(x['batch_sizes']).cpu(),
+            as_tensor(x['sorted_indices']),
+            as_tensor(x['unsorted_indices']),
+        )
+    elif include_channel:
+        return pack_sequence_include_channel(x, enforce_sorted=False)
+    else:
+        return pack_sequence(x, enforce_sorted=False)
+
+
+def as_sequence_list(x):
+    """
+    Returns the list of sequences of a list of tensors (unchanged), a
+    `PackedSequence` or the output of `padertorch.data.utils.pack_arrays`.
+    With `include_channel`, the channels of each entry are stacked again.
+
+    >>> import padertorch as pt
+    >>> packed = pt.data.utils.pack_arrays(
+    ...     [np.ones((2, 4, 3)), np.ones((2, 5, 3))], include_channel=True)
+    >>> [x.shape for x in as_sequence_list(pt.data.example_to_device(packed))]
+    [torch.Size([2, 4, 3]), torch.Size([2, 5, 3])]
+    """
+    # A PackedSequence is a tuple.
+    if isinstance(x, (tuple, list)) and not isinstance(x, PackedSequence):
+        return x
+    sequences = unpack_sequence(as_packed_sequence(x))
+    if isinstance(x, dict) and 'num_channels' in x:
+        num_channels = np.cumsum([int(c) for c in x['num_channels']])
+        sequences = [
+            torch.stack(sequences[start:stop])
+            for start, stop in zip([0, *num_channels[:-1]], num_channels)
+        ]
+    return sequences
+
+
+@functools.lru_cache(maxsize=64)
+def _packed_ranks(batch_sizes: bytes, device):
+    batch_sizes = np.frombuffer(batch_sizes, dtype=np.int64)
+    offsets = np.cumsum(batch_sizes) - batch_sizes
+    rank = np.arange(np.sum(batch_sizes)) - np.repeat(offsets, batch_sizes)
+    lengths = np.sum(
+        np.arange(batch_sizes[0])[:, None] < batch_sizes[None, :], axis=1)
+    return (
+        torch.from_numpy(rank).to(device),
+        torch.from_numpy(lengths).to(device),
+    )
+
+
+def packed_ranks(packed: PackedSequence):
+    """
+    Returns the position in the batch (i.e. the rank of the sorted
+    sequences) of each row of `packed.data` and the length of each sorted
+    sequence. The results of the last 64 `batch_sizes` (and devices) are
+    cached, i.e. the index is built once per batch, even when several
+    batches are processed alternately.
+
+    >>> packed_ranks(pack_sequence([torch.ones(2), torch.ones(1)]))
+    (tensor([0, 1, 0]), tensor([2, 1]))
+    """
+    batch_sizes = packed.batch_sizes.numpy().astype(np.int64, copy=False)
+    return _packed_ranks(batch_sizes.tobytes(), packed.data.device)
+
+
+def packed_sequence_ids(packed: PackedSequence):
+    """
+    Returns the index of the sequence (in the order of the unpacked
+    sequences) of each row of `packed.data`, e.g. for reductions over the
+    sequences.
+
+    >>> packed_sequence_ids(pack_sequence(
+    ...     [torch.ones(1), torch.ones(2)], enforce_sorted=False))
+    tensor([1, 0, 1])
+    """
+    rank, _ = packed_ranks(packed)
+    if packed.sorted_indices is None:
+        return rank
+    return packed.sorted_indices[rank]
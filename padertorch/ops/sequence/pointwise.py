@@ -20,10 +20,8 @@ __all__ = [
 def sequence_elementwise(function, x, *args, **kwargs):
     """Expects the desired function and a `Tensor` or `PackedSequence`."""
     if isinstance(x, torch.nn.utils.rnn.PackedSequence):
-        return torch.nn.utils.rnn.PackedSequence(
-            function(x.data, *args, **kwargs),
-            x.batch_sizes
-        )
+        # Keeps the sorted and unsorted indices
+        return x._replace(data=function(x.data, *args, **kwargs))
     else:
         return function(x, *args, **kwargs)
 
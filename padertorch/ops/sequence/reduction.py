@@ -1,6 +1,18 @@
+import numpy as np
 import torch
+from torch.nn.utils.rnn import PackedSequence
+
+from padertorch.ops.sequence.pack_module import packed_ranks
+from padertorch.ops.sequence.pack_module import packed_sequence_ids
 from padertorch.utils import normalize_axis
 
+__all__ = [
+    'packed_batch_sizes_to_sequence_lengths',
+    'segment_reduction',
+    'sequence_reduction',
+    'expand_packed',
+]
+
 
 def packed_batch_sizes_to_sequence_lengths(batch_sizes: list):
     """
@@ -18,17 +30,158 @@ def packed_batch_sizes_to_sequence_lengths(batch_sizes: list):
 
     """
     # TODO: May need to respect batch_first argument.
-    # TODO: This is a good candidate for Cython.
     # TODO: Neither we nor them support empty dimensions.
-    lengths = []
-    last_batch_size = 0
-    for length, batch_size in reversed(list(enumerate(batch_sizes, 1))):
-        if batch_size > last_batch_size:
-            lengths.extend((int(batch_size) - last_batch_size) * [length])
-            last_batch_size = int(batch_size)
-        else:
-            pass
-    return lengths
+    batch_sizes = np.asarray(batch_sizes)
+    return np.sum(
+        np.arange(batch_sizes[0])[:, None] < batch_sizes[None, :], axis=1
+    ).tolist()
+
+
+# The torch reductions, that `segment_reduction` supports.
+_SEGMENT_REDUCTIONS = {
+    torch.sum: 'sum',
+    torch.mean: 'mean',
+    torch.max: 'amax',
+    torch.amax: 'amax',
+    torch.min: 'amin',
+    torch.amin: 'amin',
+    torch.logsumexp: 'logsumexp',
+    torch.var: 'var',
+}
+
+
+def segment_reduction(
+        function, x, segment_ids, num_segments, counts=None, **kwargs
+):
+    """
+    Reduces the rows (first axis) of `x`, that have the same segment id,
+    with a single `index_add_` or `scatter_reduce` call (i.e. without a
+    python loop over the segments).
+
+    >>> x = torch.tensor([1., 2., 3., 4., 5.])
+    >>> ids = torch.tensor([0, 1, 0, 1, 1])
+    >>> segment_reduction(torch.sum, x, ids, 2)
+    tensor([ 4., 11.])
+    >>> segment_reduction('max', x, ids, 2)
+    tensor([3., 5.])
+    >>> segment_reduction(torch.var, x, ids, 2)
+    tensor([2.0000, 2.3333])
+
+    Args:
+        function: One of torch.sum, torch.mean, torch.max (torch.amax),
+            torch.min (torch.amin), torch.logsumexp and torch.var or the
+            name ('sum', 'mean', 'max', 'min', 'logsumexp' or 'var').
+        x: The tensor with the shape (rows, ...).
+        segment_ids: The segment (e.g. sequence) of each row.
+        num_segments: The number of segments.
+        counts: The number of rows of each segment, e.g. the cached
+            sequence lengths. Defaults to `torch.bincount(segment_ids)`.
+        **kwargs: `unbiased` or `correction` for var.
+
+    Returns:
+        A tensor with the shape (num_segments, ...).
+    """
+    name = _SEGMENT_REDUCTIONS.get(function, function)
+    name = {'max': 'amax', 'min': 'amin'}.get(name, name)
+    assert name in ['sum', 'mean', 'amax', 'amin', 'logsumexp', 'var'], (
+        'Unsupported segment reduction', function)
+
+    def segment_sum(v):
+        return v.new_zeros((num_segments, *v.shape[1:])).index_add_(
+            0, segment_ids, v)
+
+    def segment_extreme(v, reduce):
+        index = segment_ids.view(-1, *[1] * (v.dim() - 1)).expand_as(v)
+        return v.new_zeros((num_segments, *v.shape[1:])).scatter_reduce(
+            0, index, v, reduce, include_self=False)
+
+    def get_counts():
+        c = counts
+        if c is None:
+            c = torch.bincount(segment_ids, minlength=num_segments)
+        return c.to(x.dtype).view(-1, *[1] * (x.dim() - 1))
+
+    if name == 'sum':
+        return segment_sum(x)
+    elif name == 'mean':
+        return segment_sum(x) / get_counts()
+    elif name in ['amax', 'amin']:
+        return segment_extreme(x, name)
+    elif name == 'logsumexp':
+        maximum = segment_extreme(x.detach(), 'amax')
+        maximum = torch.where(
+            torch.isfinite(maximum), maximum, torch.zeros_like(maximum))
+        return torch.log(
+            segment_sum(torch.exp(x - maximum[segment_ids]))) + maximum
+    elif name == 'var':
+        correction = kwargs.pop('correction', None)
+        if correction is None:
+            correction = int(kwargs.pop('unbiased', True))
+        assert len(kwargs) == 0, kwargs
+        c = get_counts()
+        mean = segment_sum(x) / c
+        return segment_sum((x - mean[segment_ids]) ** 2) / (c - correction)
+    else:
+        raise ValueError(name)
+
+
+def _reduce_packed_time(function, x, axis, keepdims, **kwargs):
+    """Reduces the time axis (and the axes `axis`) of each sequence."""
+    sequence_ids = packed_sequence_ids(x)
+    _, lengths = packed_ranks(x)
+    if x.unsorted_indices is not None:
+        lengths = lengths[x.unsorted_indices]
+    num_sequences = len(lengths)
+
+    # The reduced axes of the data are flattened into the rows, i.e. all
+    # elements of a sequence are reduced in a single call.
+    data = x.data
+    kept = [a for a in range(1, data.dim()) if a not in axis]
+    data = data.permute(0, *axis, *kept)
+    size = int(np.prod([x.data.shape[a] for a in axis]))
+    data = data.reshape(-1, *[x.data.shape[a] for a in kept])
+    if size > 1:
+        sequence_ids = torch.repeat_interleave(sequence_ids, size)
+    result = segment_reduction(
+        function, data, sequence_ids, num_sequences,
+        counts=lengths * size, **kwargs
+    )
+    if not keepdims:
+        return result
+
+    for a in axis:
+        result = result.unsqueeze(a)
+    if x.sorted_indices is not None:
+        result = result[x.sorted_indices]
+    # One frame per sequence
+    return PackedSequence(
+        result,
+        torch.tensor([num_sequences]),
+        x.sorted_indices,
+        x.unsorted_indices,
+    )
+
+
+def expand_packed(statistic, like):
+    """
+    Expands a statistic of a `PackedSequence` (e.g. the output of
+    `sequence_reduction` with keepdims=True) to the rows of `like.data`,
+    i.e. the output can be combined with `like.data`.
+
+    >>> from padertorch.ops import pack_sequence
+    >>> x = pack_sequence([torch.tensor([1., 2., 3.]), torch.tensor([5.])])
+    >>> mean = sequence_reduction(torch.mean, x, axis=0, keepdims=True)
+    >>> x.data - expand_packed(mean, x)
+    tensor([-1.,  0.,  0.,  1.])
+    """
+    if torch.equal(statistic.batch_sizes, like.batch_sizes):
+        return statistic.data
+    assert len(statistic.batch_sizes) == 1, statistic.batch_sizes
+    if statistic.batch_sizes[0] == 1:
+        # Statistic over all sequences
+        return statistic.data
+    rank, _ = packed_ranks(like)
+    return statistic.data[rank]
 
 
 def sequence_reduction(function, x, *args, axis=None, keepdims=False, **kwargs):
@@ -82,45 +235,33 @@ def sequence_reduction(function, x, *args, axis=None, keepdims=False, **kwargs):
     TODO: but this is only known during creation time.
     """
     axis = normalize_axis(x, axis)
-    if isinstance(x, torch.nn.utils.rnn.PackedSequence):
+    if isinstance(x, PackedSequence):
         # May need to respect `batch_first` property?
         time_axis = 0  # Required when creating a `PackedSequence`.
         batch_axis = 1
+        function = {torch.max: torch.amax, torch.min: torch.amin}.get(
+            function, function)
         if time_axis in axis:
             if batch_axis in axis:
                 # Adjust `axis` since time and batch axes are collapsed.
                 axis = [a - 1 for a in axis if not a == 0]
+                result = function(
+                    x.data, *args, dim=axis, keepdim=keepdims, **kwargs)
                 if keepdims:
-                    return torch.nn.utils.rnn.PackedSequence(
-                        function(x.data, *args, dim=axis, keepdim=keepdims),
-                        [1]
-                    )
+                    return PackedSequence(result, torch.tensor([1]))
                 else:
-                    function(x.data, *args, dim=axis, keepdim=keepdims)
+                    return result
             else:
-                results = []
-                lengths = packed_batch_sizes_to_sequence_lengths(x.batch_sizes)
-                position = 0
-
+                assert len(args) == 0, (
+                    'Positional arguments are not supported for a reduction '
+                    'along the time axis of a PackedSequence.', args
+                )
                 # Adjust `axis` since time and batch axes are collapsed.
-                axis = [a - 1 if not a == 0 else 0 for a in axis]
-                for length in lengths:
-                    results.append(function(
-                        x.data[position:position+length],
-                        *args,
-                        dim=axis,
-                        keepdim=keepdims,
-                        **kwargs
-                    ))
-                    position += length
-                if keepdims:
-                    return torch.nn.utils.rnn.PackedSequence(
-                        torch.cat(results), [1 for b in x.batch_sizes]
-                    )
-                else:
-                    # PackedSequence is not necessary here, since
-                    # the sequence dimension is not kept
-                    return torch.stack(results)
+                axis = [a - 1 for a in axis if not a == 0]
+                # The packed data is not contiguous per sequence, hence
+                # the sequences are reduced as segments.
+                return _reduce_packed_time(
+                    function, x, axis, keepdims, **kwargs)
         else:
             if batch_axis in axis:
                 raise NotImplementedError(
@@ -130,9 +271,7 @@ def sequence_reduction(function, x, *args, axis=None, keepdims=False, **kwargs):
             else:
                 # Adjust `axis` since time and batch axes are collapsed.
                 axis = [a - 1 for a in axis]
-                return torch.nn.utils.rnn.PackedSequence(
-                    function(x.data, *args, dim=axis, keepdim=keepdims),
-                    x.batch_sizes
-                )
+                return x._replace(data=function(
+                    x.data, *args, dim=axis, keepdim=keepdims, **kwargs))
     else:
         return function(x, *args, dim=axis, keepdim=keepdims, **kwargs)
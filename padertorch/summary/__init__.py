@@ -1,2 +1,4 @@
 from .tbx_utils import *
+from .histogram import *
+from .writer import *
 from . import tfevents
@@ -0,0 +1,177 @@
+import numpy as np
+import torch
+
+from padertorch.utils import to_numpy
+
+__all__ = [
+    'HistogramSketch',
+]
+
+
+def _tensorflow_bins():
+    # Same bins as `tensorboardX.SummaryWriter.default_bins`, see
+    # generate_testdata.py in tensorflow/tensorboard
+    v = 1E-12
+    buckets = []
+    neg_buckets = []
+    while v < 1E20:
+        buckets.append(v)
+        neg_buckets.append(-v)
+        v *= 1.1
+    return np.array(neg_buckets[::-1] + [0] + buckets)
+
+
+class HistogramSketch:
+    """
+    Streaming histogram with a fixed memory footprint.
+
+    Instead of keeping all values until the summary is written, only the
+    bin counts and the moments (min, max, num, sum, sum of squares) are
+    accumulated.
+
+    Args:
+        bins:
+            'tensorflow': Fixed exponential bins. These are the default bins
+                of `tensorboardX.SummaryWriter.add_histogram`, hence the
+                written histogram is identical to the histogram of all values.
+            int: Number of linear bins. When `range` is None, the edges adapt
+                to the data: The initial range is given by the first values
+                and the range is doubled (and neighbouring bins are merged),
+                when a value is outside of the range.
+            array: Fixed bin edges.
+        range: (lower, upper) for linear bins with fixed edges. Values
+            outside of the range are counted in the first or last bin.
+
+    >>> sketch = HistogramSketch(bins=4)
+    >>> sketch.update(np.array([0., 1., 2., 3., 4.]))
+    >>> sketch.edges, sketch.counts
+    (array([0., 1., 2., 3., 4.]), array([1, 1, 1, 2]))
+    >>> sketch.update(np.array([7.]))
+    >>> sketch.edges, sketch.counts
+    (array([0., 2., 4., 6., 8.]), array([2, 3, 0, 1]))
+    >>> sketch.num, sketch.min, sketch.max, sketch.sum, sketch.sum_squares
+    (6, 0.0, 7.0, 17.0, 79.0)
+    """
+    _tf_bins = None
+
+    def __init__(self, bins='tensorflow', range=None):
+        self.num = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.sum = 0.
+        self.sum_squares = 0.
+
+        self.adaptive = False
+        if isinstance(bins, str):
+            assert bins == 'tensorflow', bins
+            assert range is None, range
+            if HistogramSketch._tf_bins is None:
+                HistogramSketch._tf_bins = _tensorflow_bins()
+            self.edges = HistogramSketch._tf_bins
+        elif isinstance(bins, int):
+            if range is None:
+                assert bins % 2 == 0, (
+                    'Adaptive bins require an even number of bins.', bins)
+                self.adaptive = True
+                self.edges = None
+            else:
+                lower, upper = range
+                assert lower < upper, range
+                self.edges = np.linspace(lower, upper, bins + 1)
+        else:
+            assert range is None, range
+            self.edges = np.asarray(bins, dtype=np.float64)
+        self.num_bins = bins if self.adaptive else len(self.edges) - 1
+        self.counts = np.zeros(self.num_bins, dtype=np.int64)
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}(num={self.num}, min={self.min}, '
+            f'max={self.max}, num_bins={self.num_bins})'
+        )
+
+    def _grow(self, lower, upper):
+        # Double the range until [lower, upper] is included. The edges stay
+        # aligned, because every second old edge is a new edge.
+        half = self.num_bins // 2
+        while lower < self.edges[0] or upper > self.edges[-1]:
+            width = 2 * (self.edges[1] - self.edges[0])
+            merged = self.counts.reshape(-1, 2).sum(axis=-1)
+            self.counts = np.zeros_like(self.counts)
+            if upper > self.edges[-1]:
+                self.counts[:half] = merged
+                self.edges = np.concatenate([
+                    self.edges[::2],
+                    self.edges[-1] + width * np.arange(1, half + 1),
+                ])
+            else:
+                self.counts[half:] = merged
+                self.edges = np.concatenate([
+                    self.edges[0] - width * np.arange(half, 0, -1),
+                    self.edges[::2],
+                ])
+
+    def update(self, values):
+        """Adds the values (array, tensor, list or scalar) to the sketch."""
+        if torch.is_tensor(values):
+            values = to_numpy(values, detach=True)
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return
+        lower, upper = values.min(), values.max()
+
+        self.num += values.size
+        self.min = min(self.min, float(lower))
+        self.max = max(self.max, float(upper))
+        self.sum += float(values.sum())
+        self.sum_squares += float(values.dot(values))
+
+        if self.adaptive:
+            if self.edges is None:
+                if upper <= lower:
+                    upper = lower + max(abs(lower), 1.)
+                self.edges = np.linspace(lower, upper, self.num_bins + 1)
+            else:
+                self._grow(lower, upper)
+
+        index = np.searchsorted(self.edges, values, side='right') - 1
+        # Values equal to the last edge belong to the last bin (cf.
+        # np.histogram). Values outside the edges are counted in the first or
+        # last bin.
+        index = np.clip(index, 0, self.num_bins - 1)
+        self.counts += np.bincount(index, minlength=self.num_bins)
+
+    def bucket_limits_and_counts(self):
+        """
+        Removes the empty bins at the borders like
+        `tensorboardX.summary.make_histogram`. TensorBoard only uses the right
+        bin limits, hence an empty bin is added on the left.
+        """
+        counts = self.counts
+        limits = self.edges
+        cum_counts = np.cumsum(np.greater(counts, 0))
+        start, end = np.searchsorted(
+            cum_counts, [0, cum_counts[-1] - 1], side='right')
+        start = int(start)
+        end = int(end) + 1
+        counts = counts[start - 1:end] if start > 0 \
+            else np.concatenate([[0], counts[:end]])
+        limits = limits[start:end + 1]
+        return limits.tolist(), counts.tolist()
+
+    def write(self, writer, tag, global_step):
+        """Writes the histogram with `writer.add_histogram_raw`."""
+        if self.num == 0:
+            return
+        bucket_limits, bucket_counts = self.bucket_limits_and_counts()
+        writer.add_histogram_raw(
+            tag,
+            min=self.min,
+            max=self.max,
+            num=self.num,
+            sum=self.sum,
+            sum_squares=self.sum_squares,
+            bucket_limits=bucket_limits,
+            bucket_counts=bucket_counts,
+            global_step=global_step,
+        )
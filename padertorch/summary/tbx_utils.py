@@ -10,9 +10,69 @@ __all__ = [
     'stft_to_image',
     'spectrogram_to_image',
     'review_dict',
+    'LazyArtifact',
+    'evaluate_lazy',
 ]
 
 
+class LazyArtifact:
+    """
+    Defers the computation of a review artifact (e.g. an image, audio, figure
+    or histogram) until it is written to the tfevents file.
+
+    Most of the review artifacts are discarded by the SummaryHook (e.g. only
+    the last image before a summary is dumped is kept). With a LazyArtifact
+    the conversion (e.g. colormap for spectrograms) is only executed for the
+    artifacts that are actually reported.
+
+    Tensors in `args` and `kwargs` are detached, so the artifact does not
+    keep the computational graph of the step alive.
+
+    >>> image = LazyArtifact(mask_to_image, torch.ones(3, 2))
+    >>> image
+    LazyArtifact(mask_to_image)
+    >>> image().shape
+    (1, 2, 3)
+
+    A LazyArtifact is a callable, hence a lambda or a function without
+    arguments is also accepted in the review by the SummaryHook.
+    """
+    __slots__ = ('fn', 'args', 'kwargs')
+
+    def __init__(self, fn, *args, **kwargs):
+        assert callable(fn), fn
+        self.fn = fn
+        self.args = tuple(
+            a.detach() if torch.is_tensor(a) else a for a in args
+        )
+        self.kwargs = {
+            k: v.detach() if torch.is_tensor(v) else v
+            for k, v in kwargs.items()
+        }
+
+    def __call__(self):
+        return self.fn(*self.args, **self.kwargs)
+
+    def __repr__(self):
+        name = getattr(self.fn, '__name__', repr(self.fn))
+        return f'{self.__class__.__name__}({name})'
+
+
+def evaluate_lazy(value):
+    """
+    Evaluates a LazyArtifact or a callable without arguments. Other values
+    are returned unchanged.
+
+    >>> evaluate_lazy(lambda: 1)
+    1
+    >>> evaluate_lazy(np.ones(2))
+    array([1., 1.])
+    """
+    if callable(value):
+        return value()
+    return value
+
+
 def _remove_batch_axis(array, batch_first, ndim=2):
     if array.ndim == ndim:
         pass
@@ -0,0 +1,101 @@
+import queue
+import threading
+
+__all__ = [
+    'AsyncSummaryWriter',
+]
+
+
+class AsyncSummaryWriter:
+    """
+    Wraps a summary writer (e.g. `tensorboardX.SummaryWriter` or
+    `pt.trainer.InteractiveWriter`) and executes all method calls in a
+    background thread.
+
+    The calls are executed in the order they are made. The queue is bounded,
+    i.e. when the background thread is too slow, the caller blocks
+    (backpressure). `close` waits until all pending calls are executed and
+    closes the wrapped writer. An exception from the background thread is
+    raised in the caller thread with the next call, `flush` or `close`.
+
+    >>> class Writer:
+    ...     def add_scalar(self, tag, scalar_value, global_step):
+    ...         print(tag, scalar_value, global_step)
+    ...     def close(self):
+    ...         print('close')
+    >>> writer = AsyncSummaryWriter(Writer())
+    >>> writer.add_scalar('loss', 1., 0)
+    >>> writer.add_scalar('loss', 0.5, 1)
+    >>> writer.close()
+    loss 1.0 0
+    loss 0.5 1
+    close
+    """
+    _stop = object()
+
+    def __init__(self, writer, max_queue_size=10):
+        self.writer = writer
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._exception = None
+        self._thread = threading.Thread(
+            target=self._worker, name='AsyncSummaryWriter', daemon=True,
+        )
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._stop:
+                    return
+                if self._exception is None:
+                    fn, args, kwargs = item
+                    fn(*args, **kwargs)
+            except Exception as e:
+                # Keep the first exception, the following calls are skipped.
+                self._exception = e
+            finally:
+                self._queue.task_done()
+
+    def _maybe_raise(self):
+        if self._exception is not None:
+            exception, self._exception = self._exception, None
+            raise RuntimeError(
+                'The summary writer thread failed. See the exception above.'
+            ) from exception
+
+    def _submit(self, fn, args, kwargs):
+        self._maybe_raise()
+        if not self._thread.is_alive():
+            raise RuntimeError(f'{self.__class__.__name__} is closed.')
+        self._queue.put((fn, args, kwargs))
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name == 'writer':
+            raise AttributeError(name)
+        # Resolve the method in the caller thread, so that e.g. an
+        # AttributeError is raised at the call site.
+        fn = getattr(self.writer, name)
+        if not callable(fn):
+            return fn
+
+        def submit(*args, **kwargs):
+            self._submit(fn, args, kwargs)
+        return submit
+
+    def flush(self):
+        """Blocks until all pending calls are executed."""
+        self._queue.join()
+        self._maybe_raise()
+        if hasattr(self.writer, 'flush'):
+            self.writer.flush()
+
+    def close(self):
+        """Executes all pending calls and closes the wrapped writer."""
+        if self._thread.is_alive():
+            self._queue.put(self._stop)
+            self._thread.join()
+        try:
+            self._maybe_raise()
+        finally:
+            self.writer.close()
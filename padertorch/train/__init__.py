@@ -1,5 +1,7 @@
 from . import optimizer
+from . import checkpoint
 from . import trigger
 from . import hooks
 from . import trainer
 from . import runtime_tests
+from . import distributed
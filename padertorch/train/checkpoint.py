@@ -0,0 +1,574 @@
+""" This module contains helpers to write trainer checkpoints.
+
+The `CheckpointWriter` serializes a snapshot of the trainer state in a
+background thread, so the training loop does not have to wait until the
+model and optimizer state are written to disk.
+
+Next to the pickled checkpoint (`ckpt_*.pth`), the model parameters can be
+written to a tensor checkpoint (`ckpt_*.tensors`, see
+`save_tensor_checkpoint`). Its header indexes the name, dtype, shape and
+offset of each tensor, hence a reader can memory map only the tensors it
+needs (e.g. one model of a multi model checkpoint), without reading the
+optimizer state.
+
+The `CheckpointStore` keeps cpu copies of the latest and the best checkpoint
+in memory (within a byte budget) and writes the checkpoints to the disk
+(optionally with the `CheckpointWriter`). A back off to the best
+checkpoint then does not read the file system.
+"""
+import collections
+import json
+import mmap
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import torch
+
+__all__ = [
+    'state_dict_to_cpu',
+    'atomic_save',
+    'update_symlink',
+    'remove_checkpoint',
+    'tensor_checkpoint_path',
+    'save_tensor_checkpoint',
+    'load_tensor_checkpoint',
+    'CheckpointWriter',
+    'CheckpointStore',
+]
+
+
+def state_dict_to_cpu(state_dict):
+    """
+    Creates a consistent snapshot of a (nested) state dict, where each tensor
+    is copied to the cpu. Later inplace updates of the model or optimizer
+    (e.g. `optimizer.step()`) do not change the snapshot.
+
+    >>> t = torch.zeros(2)
+    >>> snapshot = state_dict_to_cpu({'model': {'w': t}, 'iteration': 3})
+    >>> _ = t.add_(1)
+    >>> snapshot
+    {'model': {'w': tensor([0., 0.])}, 'iteration': 3}
+    """
+    if isinstance(state_dict, dict):
+        return state_dict.__class__(
+            (key, state_dict_to_cpu(value))
+            for key, value in state_dict.items()
+        )
+    elif isinstance(state_dict, (tuple, list)):
+        return state_dict.__class__([
+            state_dict_to_cpu(value) for value in state_dict
+        ])
+    elif torch.is_tensor(state_dict):
+        return state_dict.detach().to(device='cpu', copy=True)
+    else:
+        return state_dict
+
+
+def atomic_save(obj, checkpoint_path):
+    """
+    Write `obj` with `torch.save` to a temporary file and rename it to
+    `checkpoint_path`, when the write was successful. A reader will never see
+    a partially written checkpoint.
+    """
+    checkpoint_path = Path(checkpoint_path)
+    tmp_path = checkpoint_path.with_name(checkpoint_path.name + '.tmp')
+    try:
+        torch.save(obj, str(tmp_path))
+        os.replace(str(tmp_path), str(checkpoint_path))
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def update_symlink(symlink_path, checkpoint_path):
+    """
+    Let `symlink_path` point to `checkpoint_path`. The symlink is relative,
+    so the folder can be moved.
+    """
+    symlink_path = Path(symlink_path).absolute()
+    if symlink_path.is_symlink():
+        symlink_path.unlink()
+    symlink_path.symlink_to(Path(checkpoint_path).name)
+
+
+def tensor_checkpoint_path(checkpoint_path):
+    """
+    The path of the tensor checkpoint, that belongs to a (symlinked) pickled
+    checkpoint.
+
+    >>> tensor_checkpoint_path('/storage/checkpoints/ckpt_100.pth')
+    PosixPath('/storage/checkpoints/ckpt_100.tensors')
+    """
+    return Path(checkpoint_path).resolve().with_suffix('.tensors')
+
+
+def remove_checkpoint(checkpoint_path):
+    """Removes a checkpoint and the tensor checkpoint, if it exists."""
+    checkpoint_path = Path(checkpoint_path)
+    tensor_path = tensor_checkpoint_path(checkpoint_path)
+    checkpoint_path.unlink()
+    if tensor_path.exists():
+        tensor_path.unlink()
+
+
+_TENSOR_CHECKPOINT_MAGIC = b'PTTENSOR'
+_TENSOR_CHECKPOINT_ALIGNMENT = 64
+
+
+def _flatten_tensors(state_dict, prefix=''):
+    for key, value in state_dict.items():
+        assert isinstance(key, str), (key, prefix)
+        if isinstance(value, dict):
+            yield from _flatten_tensors(value, f'{prefix}{key}.')
+        elif torch.is_tensor(value):
+            yield f'{prefix}{key}', value
+
+
+def save_tensor_checkpoint(state_dict, path):
+    """
+    Writes the tensors of a (nested) state dict to a file with a header
+    index. The nested keys are joined with a dot, e.g.
+    `{'model': {'l.weight': ...}}` is stored as `model.l.weight`.
+    Values that are not tensors are ignored.
+
+    Layout:
+        8 bytes: magic `PTTENSOR`
+        8 bytes: length of the header (little endian uint64)
+        header: JSON, {name: {'dtype', 'shape', 'offset', 'nbytes'}}
+        data: The raw tensors, each aligned to 64 bytes. The offsets are
+            relative to the first (aligned) byte after the header.
+
+    The file is written with a rename, see `atomic_save`.
+    """
+    path = Path(path)
+    tensors = [
+        (name, tensor.detach().cpu().contiguous())
+        for name, tensor in _flatten_tensors(state_dict)
+    ]
+    header = {}
+    offset = 0
+    for name, tensor in tensors:
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {
+            'dtype': str(tensor.dtype).replace('torch.', ''),
+            'shape': list(tensor.shape),
+            'offset': offset,
+            'nbytes': nbytes,
+        }
+        offset += -(-nbytes // _TENSOR_CHECKPOINT_ALIGNMENT) \
+            * _TENSOR_CHECKPOINT_ALIGNMENT
+    header = json.dumps(header).encode()
+    header_end = len(_TENSOR_CHECKPOINT_MAGIC) + 8 + len(header)
+    data_start = -(-header_end // _TENSOR_CHECKPOINT_ALIGNMENT) \
+        * _TENSOR_CHECKPOINT_ALIGNMENT
+    header += b' ' * (data_start - header_end)
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    try:
+        with open(tmp_path, 'wb') as fd:
+            fd.write(_TENSOR_CHECKPOINT_MAGIC)
+            fd.write(struct.pack('<Q', len(header)))
+            fd.write(header)
+            for name, tensor in tensors:
+                position = fd.tell() - data_start
+                fd.write(b'\0' * (
+                    -position % _TENSOR_CHECKPOINT_ALIGNMENT))
+                if tensor.numel() > 0:
+                    # A byte view avoids the numpy conversion, which does
+                    # not support e.g. bfloat16.
+                    fd.write(tensor.reshape(-1).view(torch.uint8).numpy())
+        os.replace(str(tmp_path), str(path))
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def load_tensor_checkpoint(path, prefix='', map_location='cpu'):
+    """
+    Loads the tensors, whose name starts with `prefix`, from a tensor
+    checkpoint (see `save_tensor_checkpoint`). The prefix is removed from
+    the names.
+
+    The file is memory mapped (copy on write), i.e. the returned cpu tensors
+    share the memory with the page cache and only the requested tensors are
+    read from the disk.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     path = Path(tmp_dir) / 'ckpt_1.tensors'
+    ...     save_tensor_checkpoint({
+    ...         'model': {'a.w': torch.ones(2), 'b.w': torch.zeros(1, 2)},
+    ...         'iteration': 1,
+    ...     }, path)
+    ...     print(load_tensor_checkpoint(path, 'model.b'))
+    {'w': tensor([[0., 0.]])}
+    """
+    path = Path(path)
+    if prefix and not prefix.endswith('.'):
+        prefix += '.'
+    with open(path, 'rb') as fd:
+        magic = fd.read(len(_TENSOR_CHECKPOINT_MAGIC))
+        if magic != _TENSOR_CHECKPOINT_MAGIC:
+            raise ValueError(f'{path} is not a tensor checkpoint.')
+        header_length, = struct.unpack('<Q', fd.read(8))
+        header = json.loads(fd.read(header_length))
+        data_start = fd.tell()
+        buffer = None
+        if os.fstat(fd.fileno()).st_size > data_start:
+            buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    state_dict = {}
+    for name, info in header.items():
+        if not name.startswith(prefix):
+            continue
+        dtype = getattr(torch, info['dtype'])
+        if info['nbytes'] == 0:
+            tensor = torch.empty(info['shape'], dtype=dtype)
+        else:
+            tensor = torch.frombuffer(
+                buffer, dtype=torch.uint8, count=info['nbytes'],
+                offset=data_start + info['offset'],
+            ).view(dtype).reshape(info['shape'])
+        state_dict[name[len(prefix):]] = tensor.to(map_location)
+    return state_dict
+
+
+class CheckpointWriter:
+    """
+    Serializes checkpoints in a background thread.
+
+    The checkpoints are written in the order of `submit`. The symlink
+    `ckpt_latest.pth` is only updated after the checkpoint is completely
+    written. Exceptions from the background thread are raised in the caller
+    thread, when `wait` or `close` is called.
+
+    >>> import tempfile
+    >>> writer = CheckpointWriter()
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     path = Path(tmp_dir) / 'ckpt_1.pth'
+    ...     writer.submit({'iteration': 1}, path, verbose=False)
+    ...     writer.wait(path)
+    ...     print(torch.load(str(Path(tmp_dir) / 'ckpt_latest.pth')))
+    ...     writer.close()
+    {'iteration': 1}
+    """
+    latest_symlink_name = 'ckpt_latest.pth'
+
+    def __init__(self, tensor_checkpoint=False):
+        self.tensor_checkpoint = tensor_checkpoint
+        self._executor = None
+        # (path, future) in the order of the submission
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+
+    def _write(self, state_dict, checkpoint_path, verbose):
+        atomic_save(state_dict, checkpoint_path)
+        if self.tensor_checkpoint:
+            save_tensor_checkpoint(
+                {'model': state_dict['model']},
+                tensor_checkpoint_path(checkpoint_path),
+            )
+        update_symlink(
+            checkpoint_path.parent / self.latest_symlink_name,
+            checkpoint_path,
+        )
+        if verbose:
+            print(f"{datetime.now()}: Saved model and optimizer state "
+                  f"at iteration {state_dict.get('iteration')} to "
+                  f"{checkpoint_path}")
+
+    def submit(self, state_dict, checkpoint_path, verbose=True, copy=True):
+        """
+        Takes a cpu snapshot of `state_dict` and schedules the write.
+
+        Args:
+            state_dict: The (nested) state dict, e.g. `trainer.state_dict()`.
+            checkpoint_path: The final path of the checkpoint.
+            verbose: Print a message, when the checkpoint is written.
+            copy: If False, `state_dict` is already a snapshot, that is not
+                changed by the caller.
+        """
+        checkpoint_path = Path(checkpoint_path)
+        if copy:
+            state_dict = state_dict_to_cpu(state_dict)
+        self._submit(
+            checkpoint_path, self._write, state_dict, checkpoint_path, verbose)
+
+    def submit_symlink(self, symlink_path, checkpoint_path):
+        """
+        Schedules `update_symlink` after the pending writes, i.e. a pending
+        write does not move the symlink afterwards.
+        """
+        self._submit(
+            Path(symlink_path), update_symlink, symlink_path, checkpoint_path)
+
+    def _submit(self, path, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='CheckpointWriter'
+                )
+            self._pending.append((path, self._executor.submit(fn, *args)))
+
+    def wait(self, checkpoint_path=None):
+        """
+        Blocks until `checkpoint_path` is written. When `checkpoint_path` is
+        None, wait for all pending checkpoints.
+        """
+        with self._lock:
+            futures = list(self._pending)
+            if checkpoint_path is not None:
+                checkpoint_path = Path(checkpoint_path)
+                # The checkpoints are written in order, hence all checkpoints
+                # submitted before the last submission of `checkpoint_path`
+                # are written, too.
+                indices = [
+                    i for i, (path, _) in enumerate(futures)
+                    if path == checkpoint_path
+                ]
+                futures = futures[:indices[-1] + 1] if indices else []
+        for path, future in futures:
+            try:
+                future.result()
+            finally:
+                with self._lock:
+                    try:
+                        self._pending.remove((path, future))
+                    except ValueError:
+                        # Removed by a concurrent wait
+                        pass
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            with self._lock:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                    self._executor = None
+
+
+def _state_dict_nbytes(state_dict):
+    if isinstance(state_dict, dict):
+        return sum(map(_state_dict_nbytes, state_dict.values()))
+    elif isinstance(state_dict, (tuple, list)):
+        return sum(map(_state_dict_nbytes, state_dict))
+    elif torch.is_tensor(state_dict):
+        return state_dict.numel() * state_dict.element_size()
+    else:
+        return 0
+
+
+def _state_dict_to(state_dict, device):
+    if isinstance(state_dict, dict):
+        return state_dict.__class__(
+            (key, _state_dict_to(value, device))
+            for key, value in state_dict.items()
+        )
+    elif isinstance(state_dict, (tuple, list)):
+        return state_dict.__class__([
+            _state_dict_to(value, device) for value in state_dict
+        ])
+    elif torch.is_tensor(state_dict):
+        return state_dict.to(device=device, copy=True)
+    else:
+        return state_dict
+
+
+class CheckpointStore:
+    """
+    Tiered storage of the trainer checkpoints: The latest and the best
+    checkpoint are kept as cpu snapshots in memory, while all checkpoints
+    are written to the disk.
+
+    `load` returns the snapshot from memory, if available, and reads the
+    file otherwise. Hence the back off of the `BackOffValidationHook` does
+    not have to read the best checkpoint from the disk. The snapshots are
+    dropped, when they are neither the latest nor the best checkpoint
+    (see `set_best`). When both do not fit into `max_memory_bytes`, the best
+    checkpoint is preferred.
+
+    >>> import tempfile
+    >>> store = CheckpointStore(max_memory_bytes=1000)
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     for iteration in [1, 2, 3]:
+    ...         state = {'w': torch.full((2,), iteration), 'iteration': iteration}
+    ...         store.save(state, Path(tmp_dir) / f'ckpt_{iteration}.pth', verbose=False)
+    ...         if iteration == 1:
+    ...             store.set_best(Path(tmp_dir) / 'ckpt_1.pth')
+    ...     (Path(tmp_dir) / 'ckpt_1.pth').unlink()  # load from memory
+    ...     print(store.load(Path(tmp_dir) / 'ckpt_1.pth'))
+    ...     print(store.load(Path(tmp_dir) / 'ckpt_latest.pth'))
+    ...     store.close()
+    {'w': tensor([1, 1]), 'iteration': 1}
+    {'w': tensor([3, 3]), 'iteration': 3}
+    >>> sorted(p.name for p in store.cached_checkpoints)
+    ['ckpt_1.pth', 'ckpt_3.pth']
+
+    Args:
+        asynchronous: If True, the checkpoints are written by a
+            `CheckpointWriter` in a background thread.
+        tensor_checkpoint: If True, the model parameters are also written
+            to a tensor checkpoint (see `save_tensor_checkpoint`).
+        max_memory_bytes: The budget for the in memory snapshots. Zero
+            disables the memory tier.
+    """
+    latest_symlink_name = CheckpointWriter.latest_symlink_name
+
+    def __init__(
+            self,
+            asynchronous=False,
+            tensor_checkpoint=False,
+            max_memory_bytes=0,
+    ):
+        self.asynchronous = asynchronous
+        self.tensor_checkpoint = tensor_checkpoint
+        self.max_memory_bytes = max_memory_bytes
+        self._writer = None
+        self._memory = {}
+        self._latest = None
+        self._best = None
+
+    @staticmethod
+    def _key(checkpoint_path):
+        return Path(checkpoint_path).absolute()
+
+    @property
+    def cached_checkpoints(self):
+        return list(self._memory.keys())
+
+    @property
+    def memory_bytes(self):
+        return sum(nbytes for _, nbytes in self._memory.values())
+
+    def _evict(self):
+        keep = [self._best, self._latest]
+        for key in list(self._memory.keys()):
+            if key not in keep:
+                del self._memory[key]
+        # Prefer the best checkpoint, it is the target of a back off.
+        for key in keep[::-1]:
+            if self.memory_bytes <= self.max_memory_bytes:
+                break
+            self._memory.pop(key, None)
+
+    def save(self, state_dict, checkpoint_path, verbose=True):
+        """
+        Writes `state_dict` to `checkpoint_path`, updates the
+        `ckpt_latest.pth` symlink and keeps a snapshot in memory.
+        """
+        checkpoint_path = Path(checkpoint_path)
+        if self.max_memory_bytes > 0 or self.asynchronous:
+            state_dict = state_dict_to_cpu(state_dict)
+
+        if self.max_memory_bytes > 0:
+            key = self._key(checkpoint_path)
+            self._memory[key] = (state_dict, _state_dict_nbytes(state_dict))
+            self._latest = key
+            self._evict()
+
+        if self.asynchronous:
+            if self._writer is None:
+                self._writer = CheckpointWriter(
+                    tensor_checkpoint=self.tensor_checkpoint)
+            self._writer.submit(
+                state_dict, checkpoint_path, verbose=verbose, copy=False)
+            return
+
+        torch.save(state_dict, str(checkpoint_path))
+        if self.tensor_checkpoint:
+            save_tensor_checkpoint(
+                {'model': state_dict['model']},
+                tensor_checkpoint_path(checkpoint_path),
+            )
+        # Create relative symlink to latest checkpoint
+        update_symlink(
+            checkpoint_path.parent / self.latest_symlink_name, checkpoint_path
+        )
+        if verbose:
+            print(f"{datetime.now()}: Saved model and optimizer state "
+                  f"at iteration {state_dict.get('iteration')} to "
+                  f"{checkpoint_path}")
+
+    def set_latest(self, checkpoint_path):
+        """
+        Lets the `ckpt_latest.pth` symlink point to `checkpoint_path` (e.g.
+        after a back off). With a `CheckpointWriter` the symlink is updated
+        after the pending writes, i.e. the caller does not wait for the
+        file system.
+        """
+        checkpoint_path = Path(checkpoint_path)
+        key = self._key(checkpoint_path)
+        if key in self._memory:
+            self._latest = key
+            self._evict()
+        symlink_path = checkpoint_path.parent / self.latest_symlink_name
+        if self._writer is not None:
+            self._writer.submit_symlink(symlink_path, checkpoint_path)
+        else:
+            update_symlink(symlink_path, checkpoint_path)
+
+    def set_best(self, checkpoint_path):
+        """
+        Marks `checkpoint_path` as best checkpoint, i.e. its snapshot is kept
+        in memory, when it is still cached.
+        """
+        self._best = self._key(checkpoint_path)
+        self._evict()
+
+    def load(self, checkpoint_path, map_location='cpu'):
+        """
+        Returns the state dict of `checkpoint_path`. A symlink (e.g.
+        `ckpt_latest.pth`) is resolved, after the pending writes finished.
+        The returned tensors are copies, i.e. inplace changes do not modify
+        the snapshot in memory.
+
+        Args:
+            checkpoint_path: The checkpoint file or symlink.
+            map_location: The device of the tensors.
+        """
+        checkpoint_path = Path(checkpoint_path)
+        if self._key(checkpoint_path) not in self._memory:
+            self.wait()
+            if checkpoint_path.is_symlink():
+                checkpoint_path = checkpoint_path.resolve()
+        key = self._key(checkpoint_path)
+        if key in self._memory:
+            state_dict, _ = self._memory[key]
+            return _state_dict_to(state_dict, map_location)
+        assert checkpoint_path.is_file(), checkpoint_path
+        return torch.load(str(checkpoint_path), map_location=map_location)
+
+    def remove(self, checkpoint_path):
+        """Drops the snapshot and removes the files of `checkpoint_path`."""
+        key = self._key(checkpoint_path)
+        self._memory.pop(key, None)
+        if self._latest == key:
+            self._latest = None
+        if self._best == key:
+            self._best = None
+        self.wait(checkpoint_path)
+        if Path(checkpoint_path).exists():
+            remove_checkpoint(checkpoint_path)
+
+    def wait(self, checkpoint_path=None):
+        """
+        Blocks until `checkpoint_path` (or all pending checkpoints, when None)
+        is written.
+        """
+        if self._writer is not None:
+            self._writer.wait(checkpoint_path)
+
+    def clear(self):
+        """Drops the snapshots in memory."""
+        self._memory.clear()
+        self._latest = None
+        self._best = None
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
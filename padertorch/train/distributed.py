@@ -0,0 +1,556 @@
+""" This module contains a trainer for data parallel training with multiple
+processes, which communicate with `torch.distributed` (gloo backend).
+
+Each process (rank) trains a replica of the model on a shard of the train
+iterator. The gradients are averaged across the ranks by
+`torch.nn.parallel.DistributedDataParallel`, i.e. they are all-reduced in
+buckets, while the backward is still running.
+
+Usage:
+
+    def train(storage_dir):
+        trainer = DistributedTrainer.from_config(...)
+        trainer.train(train_dataset, device='cpu')
+
+    launch(train, world_size=8, storage_dir=...)
+"""
+import contextlib
+import datetime
+import itertools
+import os
+from collections import defaultdict
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+import padertorch as pt
+from padertorch.train.trainer import Trainer
+from padertorch.train.hooks import (
+    Hook, Priority, SummaryHook, CheckpointHook, ValidationHook,
+    ProgressBarHook, StopTraining,
+)
+
+__all__ = [
+    'launch',
+    'get_rank',
+    'get_world_size',
+    'shard_iterator',
+    'DistributedSummaryHook',
+    'DistributedTrainer',
+]
+
+
+def launch(
+        fn,
+        world_size,
+        *args,
+        nprocs=None,
+        node_rank=0,
+        master_addr='127.0.0.1',
+        master_port=29500,
+        timeout=None,
+        **kwargs,
+):
+    """
+    Spawns `nprocs` processes on this node, initializes the gloo process
+    group in each process and calls `fn(*args, **kwargs)`.
+
+    For multiple nodes, call `launch` on each node with the same
+    `world_size`, `master_addr` and `master_port` and a different
+    `node_rank`. The global rank of a process is
+    `node_rank * nprocs + local_rank`.
+
+    Args:
+        fn: A picklable function (e.g. defined on module level).
+        world_size: The total number of processes on all nodes.
+        nprocs: The number of processes on this node. Defaults to
+            `world_size`, i.e. a single node.
+        node_rank: The index of this node.
+        master_addr: The address of the node with rank 0.
+        master_port: A free port on the node with rank 0.
+        timeout: `datetime.timedelta` or seconds for collective operations.
+            Note, that all ranks wait for rank 0, while it runs the
+            validation and writes the checkpoints.
+    """
+    nprocs = world_size if nprocs is None else nprocs
+    assert 0 < nprocs <= world_size, (nprocs, world_size)
+    torch.multiprocessing.spawn(
+        _worker,
+        args=(fn, args, kwargs, world_size, node_rank * nprocs,
+              master_addr, master_port, timeout),
+        nprocs=nprocs,
+        join=True,
+    )
+
+
+def _worker(
+        local_rank, fn, args, kwargs, world_size, rank_offset,
+        master_addr, master_port, timeout,
+):
+    os.environ['MASTER_ADDR'] = str(master_addr)
+    os.environ['MASTER_PORT'] = str(master_port)
+    init_kwargs = {}
+    if timeout is not None:
+        if not isinstance(timeout, datetime.timedelta):
+            timeout = datetime.timedelta(seconds=timeout)
+        init_kwargs['timeout'] = timeout
+    dist.init_process_group(
+        'gloo',
+        rank=rank_offset + local_rank,
+        world_size=world_size,
+        **init_kwargs,
+    )
+    try:
+        fn(*args, **kwargs)
+        dist.barrier()
+    finally:
+        dist.destroy_process_group()
+
+
+def get_rank():
+    """The rank of this process, 0 if `torch.distributed` is not used."""
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank()
+    return 0
+
+
+def get_world_size():
+    """The number of processes, 1 if `torch.distributed` is not used."""
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_world_size()
+    return 1
+
+
+class _ShardedIterable:
+    """
+    Yields every `world_size`-th example of `iterable`, starting at `rank`.
+    All ranks yield the same number of examples per epoch, otherwise a rank
+    would wait forever in the all-reduce of the gradients.
+
+    >>> list(_ShardedIterable(range(10), rank=1, world_size=3, sync=False))
+    [1, 4, 7]
+    >>> len(_ShardedIterable(range(10), rank=1, world_size=3, sync=False))
+    3
+
+    An indexable iterable stays indexable, i.e. the resume in the middle of
+    an epoch (see `padertorch.data.utils.skip_examples`) slices the
+    iterable instead of loading and dropping the skipped examples:
+
+    >>> sharded = _ShardedIterable(
+    ...     list(range(10)), rank=1, world_size=3, sync=False)
+    >>> sharded.indexable
+    True
+    >>> list(pt.data.utils.skip_examples(sharded, 1))
+    [4, 7]
+    >>> sharded[2]
+    7
+    """
+    def __init__(
+            self, iterable, rank, world_size, shard=True, sync=True,
+            prefetch_depth=0, device=None,
+    ):
+        self.iterable = iterable
+        self.rank = rank
+        self.world_size = world_size
+        self.shard = shard
+        self.sync = sync
+        self.prefetch_depth = prefetch_depth
+        self.device = device
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}({self.iterable!r}, rank={self.rank}, '
+            f'world_size={self.world_size})'
+        )
+
+    def __len__(self):
+        length = len(self.iterable)
+        if self.shard:
+            return length // self.world_size
+        return length
+
+    @property
+    def indexable(self):
+        return isinstance(self.iterable, (list, tuple)) \
+            or getattr(self.iterable, 'indexable', False)
+
+    def __getitem__(self, item):
+        assert self.indexable, self.iterable
+        if isinstance(item, slice):
+            assert item.step in [None, 1], item
+            start, stop = item.start, item.stop
+            if self.shard:
+                # The examples of the other ranks in between
+                start = None if start is None else start * self.world_size
+                stop = None if stop is None else stop * self.world_size
+            return self.__class__(
+                self.iterable[start:stop], rank=self.rank,
+                world_size=self.world_size, shard=self.shard,
+                sync=self.sync, prefetch_depth=self.prefetch_depth,
+                device=self.device,
+            )
+        if self.shard:
+            assert item >= 0, item
+            item = self.rank + item * self.world_size
+        return self.iterable[item]
+
+    def _min_over_ranks(self, value):
+        value = torch.tensor(value, dtype=torch.int64)
+        dist.all_reduce(value, op=dist.ReduceOp.MIN)
+        return int(value)
+
+    def __iter__(self):
+        iterator = iter(self.iterable)
+        if self.shard:
+            iterator = itertools.islice(
+                iterator, self.rank, None, self.world_size)
+        if self.prefetch_depth > 0:
+            # Only the examples of this rank are prefetched. The collectives
+            # below stay in the main thread, a background thread would
+            # interleave them with the collectives of the training.
+            iterator = iter(pt.data.DevicePrefetcher(
+                iterator, depth=self.prefetch_depth, device=self.device))
+
+        try:
+            length = len(self)
+        except TypeError:
+            length = None
+
+        if not self.sync:
+            assert length is not None, self.iterable
+            yield from itertools.islice(iterator, length)
+        elif length is not None:
+            # One collective per epoch, when the length is known.
+            yield from itertools.islice(
+                iterator, self._min_over_ranks(length))
+        else:
+            # Unknown length: Stop all ranks, when the first rank is
+            # exhausted.
+            for example in iterator:
+                if self._min_over_ranks(1) == 0:
+                    return
+                yield example
+            self._min_over_ranks(0)
+
+
+def shard_iterator(
+        iterator, rank=None, world_size=None, shard=True,
+        prefetch_depth=0, device=None,
+):
+    """
+    Shards the iterator for data parallel training. Rank `r` gets the
+    examples `r, r + world_size, r + 2 * world_size, ...`. All ranks get the
+    same number of examples per epoch (the remaining examples are dropped).
+
+    Note: Each rank iterates over the complete `iterator` and skips the
+        examples of the other ranks. When the loading is expensive or the
+        iterator is shuffled with a different seed on each rank, shard
+        the dataset before the shuffle/map/prefetch (e.g. with
+        `lazy_dataset.Dataset.shard(get_world_size(), get_rank())`)
+        and use `shard=False`. Then the iterator is only truncated to the
+        minimum length over the ranks.
+
+    Args:
+        iterator: The train iterator.
+        rank: Defaults to `get_rank()`.
+        world_size: Defaults to `get_world_size()`.
+        shard: If False, the iterator is already sharded.
+        prefetch_depth: If larger than zero, the examples of this rank are
+            loaded in a background thread and moved to `device` (see
+            `padertorch.data.DevicePrefetcher`).
+        device: The device for the prefetching.
+    """
+    rank = get_rank() if rank is None else rank
+    world_size = get_world_size() if world_size is None else world_size
+    assert 0 <= rank < world_size, (rank, world_size)
+    if world_size == 1:
+        if prefetch_depth > 0:
+            return pt.data.DevicePrefetcher(
+                iterator, depth=prefetch_depth, device=device)
+        return iterator
+    return _ShardedIterable(
+        iterator, rank=rank, world_size=world_size, shard=shard,
+        prefetch_depth=prefetch_depth, device=device,
+    )
+
+
+class DistributedSummaryHook(SummaryHook):
+    """
+    SummaryHook for the `DistributedTrainer`. It has to run on all ranks.
+
+    The scalars of all ranks are gathered (i.e. the mean in
+    `Model.modify_summary` is over all ranks), but only rank 0 computes the
+    remaining summary (timings, histograms, images, ...) and writes it.
+    """
+
+    def materialize_scalars(self):
+        super().materialize_scalars()
+        world_size = get_world_size()
+        if world_size == 1:
+            return self.summary
+
+        gathered = [None] * world_size
+        dist.all_gather_object(gathered, dict(self.summary['scalars']))
+        scalars = defaultdict(list)
+        for rank_scalars in gathered:
+            for key, values in rank_scalars.items():
+                scalars[key].extend(values)
+        self.summary['scalars'].clear()
+        self.summary['scalars'].update(scalars)
+        return self.summary
+
+    def finalize_summary(self, trainer):
+        if get_rank() == 0:
+            super().finalize_summary(trainer)
+        else:
+            trainer.train_timer.clear()
+            self.materialize_scalars()
+
+    def dump_summary(self, trainer: 'pt.Trainer', iteration=None):
+        if get_rank() == 0:
+            super().dump_summary(trainer, iteration)
+        else:
+            self.reset_summary()
+
+
+class _RankSynchronizedHooks(Hook):
+    """
+    Runs the hooks of this rank and synchronizes the decisions of the hooks
+    that only run on rank 0:
+     - StopTraining (e.g. early stopping of the validation) stops all ranks.
+     - When rank 0 loaded a checkpoint (e.g. back off of the validation), the
+       trainer state of rank 0 is broadcasted to the other ranks.
+    """
+    def __init__(self, hooks):
+        self.hooks = sorted(hooks, key=lambda h: h.priority, reverse=True)
+        self._first_step = True
+
+    @property
+    def priority(self):
+        return Priority.SUMMARY
+
+    def pre_step(self, trainer: 'DistributedTrainer'):
+        if self._first_step:
+            # Wait until all ranks checked the storage_dir, before rank 0
+            # writes the first checkpoint.
+            dist.barrier()
+            self._first_step = False
+
+        trainer._state_changed = False
+        stop = False
+        try:
+            for hook in self.hooks:
+                hook.pre_step(trainer)
+        except StopTraining:
+            stop = True
+
+        flags = torch.tensor([stop, trainer._state_changed], dtype=torch.int64)
+        dist.all_reduce(flags, op=dist.ReduceOp.MAX)
+        stop, state_changed = flags.tolist()
+        if state_changed:
+            trainer._broadcast_state(self.hooks)
+        if stop:
+            raise StopTraining
+
+    def post_step(self, trainer, example, model_output, review):
+        for hook in self.hooks:
+            hook.post_step(trainer, example, model_output, review)
+
+    def close(self, trainer):
+        for hook in self.hooks:
+            hook.close(trainer)
+
+    def set_last(self, iteration, epoch):
+        for hook in self.hooks:
+            hook.set_last(iteration, epoch)
+
+
+class _NullWriter:
+    """Summary writer for the ranks that do not write a summary."""
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+
+class DistributedTrainer(Trainer):
+    """
+    Data parallel trainer with one process per rank (see `launch`).
+
+    Each rank runs the forward and backward on its shard of the train
+    iterator. The gradients are averaged with
+    `torch.nn.parallel.DistributedDataParallel`, which all-reduces them in
+    buckets (`bucket_cap_mb`) overlapped with the backward. With
+    `virtual_minibatch_size > 1`, the gradients are only accumulated locally
+    and all-reduced in the step that calls the optimizer.
+
+    The `SummaryHook` (see `DistributedSummaryHook`) writes only on rank 0,
+    but the scalars are gathered from all ranks. The `CheckpointHook`, the
+    `ValidationHook` and the progress bar run only on rank 0. All other hooks
+    (e.g. `LRSchedulerHook`) run on every rank.
+
+    Note: The summary, the checkpoints and the validation use `self.model`,
+        i.e. the checkpoints are compatible with the `Trainer`.
+    Note: When a rank fails, the other ranks wait in the next collective
+        operation until the timeout of the process group is reached.
+    """
+    _rank_zero_hooks = (CheckpointHook, ValidationHook, ProgressBarHook)
+
+    def __init__(
+            self,
+            model,
+            storage_dir,
+            optimizer,
+            loss_weights=None,
+            summary_trigger=(1, 'epoch'),
+            checkpoint_trigger=(1, 'epoch'),
+            stop_trigger=(1, 'epoch'),
+            virtual_minibatch_size=1,
+            async_checkpoint=False,
+            async_summary=False,
+            tensor_checkpoint=False,
+            checkpoint_memory_bytes=0,
+            prefetch_depth=0,
+            bucket_cap_mb=25,
+            find_unused_parameters=False,
+    ):
+        """
+
+        Args:
+            See `Trainer`. `max_oom_splits` is not supported, because all
+            ranks have to run the same number of backward steps.
+            bucket_cap_mb: The size of the gradient buckets, that are
+                all-reduced while the backward is running.
+            find_unused_parameters: Necessary, when some parameters do not
+                get a gradient in the forward of a train step.
+        """
+        super().__init__(
+            model=model,
+            storage_dir=storage_dir,
+            optimizer=optimizer,
+            loss_weights=loss_weights,
+            summary_trigger=summary_trigger,
+            checkpoint_trigger=checkpoint_trigger,
+            stop_trigger=stop_trigger,
+            virtual_minibatch_size=virtual_minibatch_size,
+            async_checkpoint=async_checkpoint,
+            async_summary=async_summary,
+            tensor_checkpoint=tensor_checkpoint,
+            checkpoint_memory_bytes=checkpoint_memory_bytes,
+            prefetch_depth=prefetch_depth,
+        )
+        assert type(self.hooks[0]) is SummaryHook, self.hooks
+        self.hooks[0] = DistributedSummaryHook(summary_trigger)
+        self.bucket_cap_mb = bucket_cap_mb
+        self.find_unused_parameters = find_unused_parameters
+        self.distributed_model = None
+        self._state_changed = False
+
+    def train(
+            self,
+            train_iterator,
+            *,
+            progress_bar=True,
+            resume=False,
+            device='cpu',
+            shard=True,
+    ):
+        """
+        Args:
+            See `Trainer.train`.
+            shard: Whether to shard the `train_iterator` (see
+                `shard_iterator`). Use False, when the `train_iterator` is
+                already the shard of this rank.
+        """
+        if not dist.is_initialized():
+            # e.g. started with torchrun
+            dist.init_process_group('gloo', init_method='env://')
+        rank = get_rank()
+
+        hooks = self.hooks
+        writer_cls = self.writer_cls
+        self.hooks = [_RankSynchronizedHooks([
+            hook for hook in hooks
+            if rank == 0 or not isinstance(hook, self._rank_zero_hooks)
+        ])]
+        if rank != 0:
+            self.writer_cls = _NullWriter
+        try:
+            super().train(
+                shard_iterator(
+                    train_iterator, shard=shard,
+                    prefetch_depth=self.prefetch_depth, device=device,
+                ),
+                progress_bar=progress_bar and rank == 0,
+                resume=resume,
+                device=device,
+            )
+        finally:
+            self.hooks = hooks
+            self.writer_cls = writer_cls
+            self.distributed_model = None
+
+    def _maybe_prefetch_train(self, iterator):
+        # The train iterator is prefetched in `shard_iterator`.
+        return iterator
+
+    def _get_distributed_model(self):
+        if self.distributed_model is None:
+            # The constructor broadcasts the parameters of rank 0.
+            self.distributed_model = DistributedDataParallel(
+                self.model,
+                bucket_cap_mb=self.bucket_cap_mb,
+                find_unused_parameters=self.find_unused_parameters,
+            )
+        return self.distributed_model
+
+    def train_step(self, example, optimize=True):
+        assert self.max_oom_splits == 0, self.max_oom_splits
+        distributed_model = self._get_distributed_model()
+        if optimize:
+            # contextlib.nullcontext requires Python 3.7
+            context = contextlib.suppress()
+        else:
+            # Accumulate the gradients locally, the all-reduce is done in the
+            # backward of the optimize step.
+            context = distributed_model.no_sync()
+        with context:
+            return super().train_step(example, optimize)
+
+    def step(self, example, timer):
+        if not self.model.training or self.distributed_model is None:
+            # Validation on rank 0 does not communicate.
+            return super().step(example, timer)
+
+        with timer['time_per_to_device']:
+            example = pt.data.example_to_device(
+                example, self.device
+            )
+        with timer['time_per_forward']:
+            model_out = self.distributed_model(example)
+        with timer['time_per_review']:
+            review = self.model.review(example, model_out)
+            return model_out, self._maybe_add_loss_to_review(review)
+
+    def _copy_for_validation(self):
+        trainer = super()._copy_for_validation()
+        trainer.distributed_model = None
+        return trainer
+
+    def load_checkpoint(self, map_location='cpu', checkpoint_path=None):
+        super().load_checkpoint(
+            map_location=map_location, checkpoint_path=checkpoint_path)
+        self._state_changed = True
+
+    def _broadcast_state(self, hooks):
+        """Sends the trainer state of rank 0 to the other ranks."""
+        state = [self.state_dict() if get_rank() == 0 else None]
+        dist.broadcast_object_list(state, src=0)
+        if get_rank() != 0:
+            self.load_state_dict(state[0])
+            for hook in hooks:
+                hook.set_last(self.iteration, self.epoch)
@@ -11,6 +11,9 @@ trainer.
 from collections import defaultdict
 from enum import IntEnum
 from pathlib import Path
+import copy
+import multiprocessing
+import traceback
 import types
 
 from distutils.version import LooseVersion
@@ -22,6 +25,9 @@ from natsort import natsorted
 import paderbox as pb
 import padertorch as pt
 from padertorch.train.trigger import IntervalTrigger, EndTrigger
+from padertorch.train.checkpoint import (
+    update_symlink, state_dict_to_cpu,
+)
 
 __all__ = [
     'SummaryHook',
@@ -123,6 +129,12 @@ class SummaryHook(TriggeredHook):
     the checkpoints.
 
     To save results of the validation refer to ValidationHook.
+
+    Scalar tensors (e.g. the loss) are accumulated in a running sum and a
+    count per key on their device, i.e. the memory does not grow with the
+    summary interval and there is no device synchronisation per step. When
+    the summary is finalized, each of them becomes a list with the mean.
+    Other values (e.g. labels) are kept per step in a list.
     """
 
     def __init__(
@@ -145,7 +157,7 @@ class SummaryHook(TriggeredHook):
         return types.MappingProxyType(dict(
             # losses=defaultdict(list),
             scalars=defaultdict(list),
-            histograms=defaultdict(list),
+            histograms=defaultdict(pt.summary.HistogramSketch),
             audios=dict(),
             images=dict(),
             texts=dict(),
@@ -156,6 +168,8 @@ class SummaryHook(TriggeredHook):
     def reset_summary(self):
         # Todo: add figures
         self.summary = self.empty_summary_dict()
+        # key -> [sum, count] of the scalar tensors
+        self._scalar_sums = {}
 
     def update_summary(self, review):
         allowed_keys = {
@@ -173,17 +187,29 @@ class SummaryHook(TriggeredHook):
 
         poped_review = {**review}  # copy for "pop"
 
-        # note item is the pytorch function to get the value of a tensor
-        self.summary['scalars']['loss'].append(poped_review.pop('loss').item())
+        # Tensors are only detached and stay on their device. Calling `.item()`
+        # here would force a device synchronisation in each step. The values
+        # are moved to the host in `materialize_scalars`, when the summary is
+        # finalized.
+        self._add_scalar('loss', poped_review.pop('loss'))
         for key, loss in poped_review.pop('losses', dict()).items():
-            self.summary['scalars'][key].append(loss.item())
+            self._add_scalar(key, loss)
         for key, scalars in poped_review.pop('scalars', dict()).items():
-            self.summary['scalars'][key].extend(self._to_list(scalars))
+            self._add_scalar(key, scalars)
         for key, histogram in poped_review.pop('histograms', dict()).items():
-            self.summary['histograms'][key].extend(self._to_list(histogram))
-            # do not hold more than 1M values in memory
-            self.summary['histograms'][key] = \
-                self.summary['histograms'][key][-1000000:]
+            if callable(histogram):
+                # A lazy histogram is a snapshot
+                self.summary['histograms'][key] = histogram
+                continue
+            if callable(self.summary['histograms'][key]):
+                # Drop a lazy snapshot, when eager values follow
+                del self.summary['histograms'][key]
+            # The HistogramSketch has a fixed memory footprint, independent
+            # of the number of values.
+            self.summary['histograms'][key].update(histogram)
+        # audios, images and figures may be lazy (i.e. a callable, see
+        # pt.summary.LazyArtifact). They are evaluated in
+        # `evaluate_lazy_artifacts`, when the summary is finalized.
         for key, audio in poped_review.pop('audios', dict()).items():
             self.summary['audios'][key] = audio  # snapshot
         for key, image in poped_review.pop('images', dict()).items():
@@ -196,6 +222,113 @@ class SummaryHook(TriggeredHook):
 
         assert len(poped_review) == 0, (poped_review, review)
 
+    def _add_scalar(self, key, value):
+        if torch.is_tensor(value) and value.dim() == 0:
+            value = value.detach()
+            if key in self._scalar_sums:
+                self._scalar_sums[key][0] += value
+                self._scalar_sums[key][1] += 1
+            else:
+                dtype = torch.float64 if value.dtype == torch.float64 \
+                    else torch.float32
+                self._scalar_sums[key] = [value.to(dtype, copy=True), 1]
+                # Keep the order of the keys
+                self.summary['scalars'][key]
+        elif torch.is_tensor(value):
+            self.summary['scalars'][key].append(value.detach())
+        else:
+            self.summary['scalars'][key].extend(self._to_list(value))
+
+    @staticmethod
+    def _scalars_to_list(values):
+        """
+        Converts a list of python scalars and (not yet transferred) tensors to
+        a flat list of python scalars. All tensors on the same device and
+        with the same dtype are concatenated and moved with one transfer to
+        the host.
+
+        >>> SummaryHook._scalars_to_list([torch.tensor(1.), torch.tensor(2.)])
+        [1.0, 2.0]
+        >>> SummaryHook._scalars_to_list([
+        ...     torch.tensor(1.), 2., torch.tensor([3., 4.]), 5])
+        [1.0, 2.0, 3.0, 4.0, 5]
+        """
+        if values and all(
+                torch.is_tensor(v) and v.dim() == 0 for v in values
+        ):
+            try:
+                # Common case (e.g. loss): One scalar tensor per step
+                return torch.stack(values).cpu().tolist()
+            except RuntimeError:
+                # Different devices or dtypes
+                pass
+
+        groups = defaultdict(list)
+        for value in values:
+            if torch.is_tensor(value):
+                groups[(value.device, value.dtype)].append(value)
+
+        host_values = {}
+        for key, tensors in groups.items():
+            if all(t.dim() == 0 for t in tensors):
+                # One value per step
+                flat = torch.stack(tensors).cpu().tolist()
+                host_values[key] = iter([[v] for v in flat])
+            else:
+                flat = torch.cat([t.reshape(-1) for t in tensors]).cpu()
+                host_values[key] = iter(
+                    split.tolist()
+                    for split in torch.split(flat, [t.numel() for t in tensors])
+                )
+
+        scalars = []
+        for value in values:
+            if torch.is_tensor(value):
+                scalars.extend(next(host_values[(value.device, value.dtype)]))
+            else:
+                scalars.extend(SummaryHook._to_list(value))
+        return scalars
+
+    def materialize_scalars(self):
+        """
+        Moves the accumulated scalars to the host, so that each entry in
+        `self.summary['scalars']` is a list of python scalars. The running
+        sum of a key becomes a list with the mean.
+        """
+        for key, values in self.summary['scalars'].items():
+            if isinstance(values, list):
+                self.summary['scalars'][key] = self._scalars_to_list(values)
+        if self._scalar_sums:
+            totals = self._scalars_to_list(
+                [total for total, _ in self._scalar_sums.values()])
+            for (key, (_, count)), total in zip(
+                    self._scalar_sums.items(), totals
+            ):
+                if self.summary['scalars'][key]:
+                    # The key has also other values, keep the weight of the
+                    # mean.
+                    self.summary['scalars'][key].extend(
+                        [total / count] * count)
+                else:
+                    self.summary['scalars'][key] = [total / count]
+            self._scalar_sums = {}
+        return self.summary
+
+    def evaluate_lazy_artifacts(self):
+        """
+        Evaluates the lazy audios, images, figures and histograms of the
+        summary (see `pt.summary.LazyArtifact`).
+        """
+        for key in ['audios', 'images', 'figures']:
+            for k, value in self.summary[key].items():
+                self.summary[key][k] = pt.summary.evaluate_lazy(value)
+        for key, histogram in self.summary['histograms'].items():
+            if callable(histogram):
+                sketch = pt.summary.HistogramSketch()
+                sketch.update(pt.summary.evaluate_lazy(histogram))
+                self.summary['histograms'][key] = sketch
+        return self.summary
+
     @staticmethod
     def _to_list(scalars):
         if torch.is_tensor(scalars):
@@ -278,11 +411,14 @@ class SummaryHook(TriggeredHook):
         assert len(self.summary['timings']) == 0, self.summary['timings']
         for key, timing in self.compute_timings(trainer.train_timer).items():
             self.summary['timings'][key] = timing
+        self.materialize_scalars()
+        self.evaluate_lazy_artifacts()
         self.maybe_add_lr_to_summary(trainer)
         self.summary = trainer.model.modify_summary(self.summary)
 
-    def dump_summary(self, trainer: 'pt.Trainer'):
-        iteration = trainer.iteration
+    def dump_summary(self, trainer: 'pt.Trainer', iteration=None):
+        if iteration is None:
+            iteration = trainer.iteration
         prefix = self.summary_prefix
 
         time_prefix = f'{prefix}_timings'
@@ -294,9 +430,13 @@ class SummaryHook(TriggeredHook):
             trainer.writer.add_scalar(
                 f'{time_prefix}/{key}', scalar.mean(), iteration)
         for key, histogram in self.summary['histograms'].items():
-            trainer.writer.add_histogram(
-                f'{prefix}/{key}', np.array(histogram), iteration
-            )
+            if isinstance(histogram, pt.summary.HistogramSketch):
+                histogram.write(trainer.writer, f'{prefix}/{key}', iteration)
+            else:
+                # e.g. replaced in `Model.modify_summary`
+                trainer.writer.add_histogram(
+                    f'{prefix}/{key}', np.array(histogram), iteration
+                )
         for key, audio in self.summary['audios'].items():
             if isinstance(audio, (tuple, list)):
                 assert len(audio) == 2, (len(audio), audio)
@@ -375,7 +515,9 @@ class ValidationHook(SummaryHook):
 
     def __init__(
             self, trigger, iterator, metric='loss', maximize=False,
-            max_checkpoints=1, early_stopping_patience=None
+            max_checkpoints=1, early_stopping_patience=None,
+            asynchronous=False, async_device='cpu', async_start_method=None,
+            cache=False,
     ):
         """
 
@@ -390,8 +532,32 @@ class ValidationHook(SummaryHook):
                 When max_checkpoints is None, keep all checkpoints.
             early_stopping_patience: the number of allowed degradations before
                 stopping training. Should be larger than back_off_patience.
+            cache: If True, the examples of the first validation are cached
+                and replayed in the following validations (see
+                `padertorch.data.CachedIterable`). A dict is used as keyword
+                arguments for `CachedIterable` (e.g. `max_memory_bytes` and
+                `spill_file`). The iterator has to be deterministic.
+            asynchronous: If True, the validation runs in a background
+                process on a snapshot of the trainer state, while the
+                training continues. The result is processed (summary at the
+                iteration of the snapshot, checkpoint ranking, early stopping,
+                back off) in the first `pre_step` after it arrived. At most
+                one validation is pending, i.e. when the next validation is
+                triggered, the training waits for the previous result.
+            async_device: The device of the model in the background process.
+            async_start_method: The start method of the background process
+                ('fork', 'spawn' or 'forkserver'). Defaults to 'forkserver',
+                if available, else 'spawn'. The trainer and the validation
+                iterator have to be picklable. The background process is
+                started, while other threads run (e.g. prefetch workers or
+                the checkpoint writer), hence 'fork' may copy locks in an
+                acquired state and deadlock. Use 'fork' only, when no other
+                thread runs. Use 'spawn' for validation on a GPU.
         """
         super().__init__(trigger, summary_prefix='validation')
+        if cache:
+            iterator = pt.data.CachedIterable(
+                iterator, **({} if cache is True else cache))
         self.iterator = iterator
         self.metric = metric
         self.maximize = maximize
@@ -401,6 +567,18 @@ class ValidationHook(SummaryHook):
         self.ckpt_ranking = []
         self.n_degradations = 0
 
+        self.asynchronous = asynchronous
+        self.async_device = async_device
+        if async_start_method is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                async_start_method = 'forkserver'
+            else:
+                async_start_method = 'spawn'
+        self.async_start_method = async_start_method
+        self._worker = None
+        self._connection = None
+        self._pending = None
+
     @property
     def priority(self):
         return Priority.VALIDATION
@@ -439,10 +617,14 @@ class ValidationHook(SummaryHook):
         assert len(self.summary['timings']) == 0, self.summary['timings']
         for key, timing in self.compute_timings(trainer.validate_timer).items():
             self.summary['timings'][key] = timing
+        self.materialize_scalars()
+        self.evaluate_lazy_artifacts()
         self.maybe_add_lr_to_summary(trainer)
         self.summary = trainer.model.modify_summary(self.summary)
 
     def pre_step(self, trainer: 'pt.Trainer'):
+        if self.asynchronous:
+            self.collect_validation(trainer)
         if self.trigger(iteration=trainer.iteration, epoch=trainer.epoch):
             self.run_validation(trainer)
 
@@ -453,14 +635,14 @@ class ValidationHook(SummaryHook):
             if self._json_file.exists():
                 self.load_validation_state()
         ckpt_path: Path = trainer.default_checkpoint_path()
-        if not ckpt_path.exists():
-            raise RuntimeError(
-                'Before each validation the CheckpointHook has to write '
-                f'a checkpoint.\n'
-                f'Could not find {ckpt_path}.\n'
-                f'Found only:\n'
-                f'{[str(file) for file in ckpt_dir.iterdir()]}'
-            )
+        if self.asynchronous:
+            self._submit_validation(trainer, ckpt_path)
+        else:
+            self._validate(trainer)
+            self._finish_validation(trainer, ckpt_path, trainer.iteration)
+
+    def _validate(self, trainer: 'pt.Trainer'):
+        """Iterates over the validation data and finalizes the summary."""
         assert all([len(value) == 0 for value in self.summary.values()]), self.summary
         assert len(trainer.validate_timer.timings) == 0, trainer.validate_timer
         print('Starting Validation')
@@ -473,11 +655,32 @@ class ValidationHook(SummaryHook):
                 f'Got an empty validation iterator: {self.iterator}'
             )
         self.finalize_summary(trainer)
-        score = self.summary['scalars'][self.metric]
-        self.dump_summary(trainer)
         assert len(trainer.validate_timer.timings) == 0, trainer.validate_timer
+        return self.summary
+
+    def _finish_validation(self, trainer: 'pt.Trainer', ckpt_path, iteration):
+        """
+        Writes the summary and updates the checkpoint ranking with the
+        score of the checkpoint `ckpt_path`.
+        """
+        ckpt_dir = trainer.checkpoint_dir
+        score = self.summary['scalars'][self.metric]
+        self.dump_summary(trainer, iteration)
         print(f'Finished Validation. Mean {self.metric}: {score}')
 
+        # The validation uses the model in memory. The checkpoint file is
+        # only necessary from here on, hence an asynchronous write of the
+        # checkpoint could overlap with the validation.
+        trainer.wait_for_checkpoint(ckpt_path)
+        if not ckpt_path.exists():
+            raise RuntimeError(
+                'Before each validation the CheckpointHook has to write '
+                f'a checkpoint.\n'
+                f'Could not find {ckpt_path}.\n'
+                f'Found only:\n'
+                f'{[str(file) for file in ckpt_dir.iterdir()]}'
+            )
+
         # Only save the relative checkpoint path, so the folder can be
         # moved.
         self.ckpt_ranking.append((ckpt_path.name, score))
@@ -488,22 +691,20 @@ class ValidationHook(SummaryHook):
                 -x[1] if self.maximize else x[1],  # score
                 x[0],  # ckpt name
         ))
-        best_ckpt_path = ckpt_dir / self._best_ckpt_name
-        if best_ckpt_path.is_symlink():
-            best_ckpt_path.unlink()
-        best_ckpt_path.symlink_to(self.ckpt_ranking[0][0])
+        update_symlink(ckpt_dir / self._best_ckpt_name, self.ckpt_ranking[0][0])
+        trainer.checkpoint_store.set_best(ckpt_dir / self.ckpt_ranking[0][0])
         if self.max_checkpoints is not None:
             for ckpt_name, _ in self.ckpt_ranking[self.max_checkpoints:]:
-                ckpt = ckpt_dir / ckpt_name
-                if ckpt.exists():
-                    ckpt.unlink()
+                trainer.checkpoint_store.remove(ckpt_dir / ckpt_name)
             self.ckpt_ranking = self.ckpt_ranking[:self.max_checkpoints]
         if self.ckpt_ranking[0][0] != ckpt_path.name:
             self.n_degradations += 1
         else:
             self.n_degradations = 0
         self.save_validation_state()
+        self._check_degradations(trainer)
 
+    def _check_degradations(self, trainer: 'pt.Trainer'):
         if (
             self.early_stopping_patience is not None
             and self.n_degradations > self.early_stopping_patience
@@ -512,10 +713,118 @@ class ValidationHook(SummaryHook):
                   f' {trainer.iteration} iterations')
             raise StopTraining
 
+    def _submit_validation(self, trainer: 'pt.Trainer', ckpt_path):
+        # Process the previous validation first, it may stop the training
+        # or back off.
+        iteration = trainer.iteration
+        self.collect_validation(trainer, block=True)
+        if trainer.iteration != iteration:
+            # Back off: The checkpoint belongs to the discarded trajectory.
+            if ckpt_path.name not in dict(self.ckpt_ranking):
+                trainer.checkpoint_store.remove(ckpt_path)
+            return
+
+        if self._worker is None:
+            # A plain process instead of a ProcessPoolExecutor, because the
+            # initializer of the executor requires Python 3.7.
+            context = multiprocessing.get_context(self.async_start_method)
+            self._connection, connection = context.Pipe()
+            self._worker = context.Process(
+                target=_validation_worker,
+                args=(
+                    connection, trainer._copy_for_validation(),
+                    self._copy_for_worker(), self.async_device,
+                ),
+                name='ValidationHook',
+            )
+            self._worker.start()
+            # The worker has the only other end, i.e. `recv` raises an
+            # EOFError, when the worker dies.
+            connection.close()
+        self._connection.send(state_dict_to_cpu(trainer.state_dict()))
+        self._pending = (ckpt_path, iteration)
+        print(f'Started background validation of {ckpt_path.name}')
+
+    def _copy_for_worker(self):
+        hook = copy.copy(self)
+        hook.asynchronous = False
+        hook._worker = None
+        hook._connection = None
+        hook._pending = None
+        # The summary (a MappingProxyType) is not picklable, the worker
+        # creates a new one.
+        hook.summary = None
+        return hook
+
+    def collect_validation(self, trainer: 'pt.Trainer', block=False):
+        """
+        Processes the result of the background validation, if it is
+        available (or `block` is True).
+        """
+        if self._pending is None:
+            return
+        if not block and not self._connection.poll():
+            return
+        ckpt_path, iteration = self._pending
+        self._pending = None
+        try:
+            success, result = self._connection.recv()
+        except EOFError:
+            self._worker.join()
+            raise RuntimeError(
+                f'The background validation of {ckpt_path.name} died '
+                f'unexpectedly (exitcode: {self._worker.exitcode}).'
+            ) from None
+        if not success:
+            raise RuntimeError(
+                f'The background validation of {ckpt_path.name} failed:\n'
+                f'{result}'
+            )
+        self.summary = result
+        self._finish_validation(trainer, ckpt_path, iteration)
+
+    def close(self, trainer: 'pt.Trainer'):
+        try:
+            if self.asynchronous:
+                try:
+                    self.collect_validation(trainer, block=True)
+                except StopTraining:
+                    pass
+        finally:
+            if self._worker is not None:
+                if self._worker.is_alive():
+                    self._connection.send(None)
+                self._worker.join()
+                self._connection.close()
+                self._worker = None
+                self._connection = None
+        super().close(trainer)
+
     def post_step(self, trainer: 'pt.Trainer', example, model_out, review):
         pass
 
 
+def _validation_worker(connection, trainer, hook, device):
+    """
+    Validates the state dicts, that are received from the `connection`,
+    and sends back the summaries, until it receives None.
+    """
+    trainer.to(device)
+    hook.reset_summary()
+    while True:
+        state_dict = connection.recv()
+        if state_dict is None:
+            break
+        try:
+            trainer.load_state_dict(state_dict)
+            summary = dict(hook._validate(trainer))
+            hook.reset_summary()
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+        else:
+            connection.send((True, summary))
+
+
 class BackOffValidationHook(ValidationHook):
     """ Performs model validation and deletes stale checkpoints
     (checkpoints that are not among the max_checkpoints best checkpoints).
@@ -533,7 +842,9 @@ class BackOffValidationHook(ValidationHook):
     def __init__(
             self, trigger, iterator, metric='loss', maximize=False,
             max_checkpoints=1, early_stopping_patience=None, n_back_off=0,
-            lr_update_factor=1 / 10, back_off_patience=None
+            lr_update_factor=1 / 10, back_off_patience=None,
+            asynchronous=False, async_device='cpu', async_start_method=None,
+            cache=False,
     ):
         """
 
@@ -554,11 +865,15 @@ class BackOffValidationHook(ValidationHook):
                 of back off. Should be smaller than 1.
             back_off_patience: the number of allowed degradations before
                 backing off
+            asynchronous, async_device, async_start_method, cache:
+                See `ValidationHook`.
         """
         super().__init__(
             trigger, iterator,
             metric=metric, maximize=maximize, max_checkpoints=max_checkpoints,
-            early_stopping_patience=early_stopping_patience
+            early_stopping_patience=early_stopping_patience,
+            asynchronous=asynchronous, async_device=async_device,
+            async_start_method=async_start_method, cache=cache,
         )
 
         self.remaining_back_offs = n_back_off
@@ -588,8 +903,8 @@ class BackOffValidationHook(ValidationHook):
         self.remaining_back_offs = validation_state['remaining_back_offs']
         self.n_degradations = validation_state['n_degradations']
 
-    def run_validation(self, trainer: 'pt.Trainer'):
-        super().run_validation(trainer)
+    def _check_degradations(self, trainer: 'pt.Trainer'):
+        super()._check_degradations(trainer)
         if (
             self.remaining_back_offs > 0
             and self.n_degradations > self.back_off_patience
@@ -601,21 +916,21 @@ class BackOffValidationHook(ValidationHook):
         print(f'Back off to {best_ckpt}.')
 
         ckpt_dir = trainer.checkpoint_dir
-        latest_symlink_path = (ckpt_dir / f'ckpt_latest.pth').absolute()
-        if latest_symlink_path.is_symlink():  # CB: Change to assert?
-            latest_symlink_path.unlink()
-        latest_symlink_path.symlink_to(best_ckpt)
-
         best_iter = int(best_ckpt[len('ckpt_'): -len('.pth')])
-        for j in range(1, len(self.ckpt_ranking)):
-            ckpt = self.ckpt_ranking[-j]
+        ckpt_ranking = []
+        for ckpt, score in self.ckpt_ranking:
             if int(ckpt[len('ckpt_'): -len('.pth')]) > best_iter:
-                ckpt_path = ckpt_dir / ckpt
-                assert ckpt_path.exists(), ckpt_path
-                ckpt_path.unlink()
-                self.ckpt_ranking.pop(-j)
-
-        trainer.load_checkpoint()
+                trainer.checkpoint_store.remove(ckpt_dir / ckpt)
+            else:
+                ckpt_ranking.append((ckpt, score))
+        self.ckpt_ranking = ckpt_ranking
+
+        # The store keeps the best checkpoint in memory, i.e. the back off
+        # does not have to read it from the disk.
+        trainer.load_checkpoint(checkpoint_path=ckpt_dir / best_ckpt)
+        # The symlink is moved after the pending writes, which would move it
+        # again, i.e. the back off does not wait for the file system.
+        trainer.checkpoint_store.set_latest(ckpt_dir / best_ckpt)
 
         def update_lr(optim):
             for param_group in optim.optimizer.param_groups:
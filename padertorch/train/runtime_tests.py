@@ -27,6 +27,9 @@ LOG = logging.getLogger('runtime_test')
 
 def nested_test_assert_allclose(struct1, struct2, rtol=1e-5, atol=1e-5):
     def assert_func(array1, array2):
+        # Lazy review artifacts (e.g. pt.summary.LazyArtifact)
+        array1 = pt.summary.evaluate_lazy(array1)
+        array2 = pt.summary.evaluate_lazy(array2)
         if array1 is None:
             assert array2 is None, 'Validation step has not been deterministic'
         elif isinstance(array1, str):
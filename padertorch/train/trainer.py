@@ -3,10 +3,11 @@
     configurable padertorch models.
 """
 import contextlib
+import copy
 import itertools
+import random
 import time
 from collections import defaultdict
-from datetime import datetime
 from pathlib import Path
 import functools
 import collections
@@ -20,6 +21,7 @@ from paderbox.utils.nested import deflatten
 import padertorch as pt
 from padertorch.configurable import Configurable
 from padertorch.train.optimizer import Optimizer, Adam
+from padertorch.train.checkpoint import CheckpointStore
 from padertorch.train.runtime_tests import test_run
 from padertorch.train.hooks import *
 from padertorch.train.trigger import AnyTrigger
@@ -47,6 +49,12 @@ class Trainer(Configurable):
             checkpoint_trigger=(1, 'epoch'),
             stop_trigger=(1, 'epoch'),
             virtual_minibatch_size=1,
+            async_checkpoint=False,
+            async_summary=False,
+            max_oom_splits=0,
+            tensor_checkpoint=False,
+            checkpoint_memory_bytes=0,
+            prefetch_depth=0,
     ):
         """
 
@@ -85,6 +93,45 @@ class Trainer(Configurable):
                 Note: The gradients are accumulated and not averaged.
                 Note: The virtual_minibatch_size is fixed and can contain data
                     from two epochs.
+            async_checkpoint: If True, save_checkpoint only takes a cpu
+                snapshot of the model and optimizer state. The snapshot is
+                written in a background thread with an atomic rename and
+                `ckpt_latest.pth` is updated after the write finished.
+                Use `wait_for_checkpoint` to block until a checkpoint is
+                on the disk.
+            async_summary: If True, the summary writer (`writer_cls`) is
+                wrapped by `padertorch.summary.AsyncSummaryWriter`, i.e.
+                the tfevents are written in a background thread (e.g.
+                rendering of figures and histogram binning). If an int, it
+                is the maximum number of pending writer calls (default 10).
+            max_oom_splits: If larger than zero, an out of memory error in
+                the forward or backward of a train step is caught, the
+                example is split along the batch axis (see
+                `padertorch.data.split_example`) into two halves and the
+                gradients of the halves are accumulated. The halves are
+                split again, up to `max_oom_splits` times. The loss of a
+                half is weighted with its relative batch size, i.e. the loss
+                is assumed to be a mean over the batch. The number of splits
+                is reported as scalar `oom_splits`.
+            tensor_checkpoint: If True, the model parameters are also written
+                to `ckpt_*.tensors` next to each checkpoint. The header of
+                this file indexes the tensors, so
+                `Module.from_storage_dir` memory maps only the parameters of
+                the requested (sub) module and does not read the optimizer
+                state. See `padertorch.train.checkpoint`.
+            checkpoint_memory_bytes: If larger than zero, cpu copies of the
+                latest and the best checkpoint are kept in memory, as long as
+                they fit into this number of bytes. A back off
+                (`BackOffValidationHook`) to the best checkpoint is then
+                served from memory and does not read the disk. See
+                `padertorch.train.checkpoint.CheckpointStore`.
+            prefetch_depth: If larger than zero, a background thread loads
+                up to `prefetch_depth` examples of the train and validation
+                iterators ahead and moves them to the device, while the
+                model processes the current example (see
+                `padertorch.data.DevicePrefetcher`). The timing
+                `time_per_data_loading` is then the time, that the training
+                loop waits for the next example.
 
 
         Usage:
@@ -132,6 +179,17 @@ class Trainer(Configurable):
 
         self.loss_weights = loss_weights
         self.virtual_minibatch_size = virtual_minibatch_size
+        self.async_summary = async_summary
+        self.max_oom_splits = max_oom_splits
+        self.prefetch_depth = prefetch_depth
+        self.checkpoint_store = CheckpointStore(
+            asynchronous=async_checkpoint,
+            tensor_checkpoint=tensor_checkpoint,
+            max_memory_bytes=checkpoint_memory_bytes,
+        )
+        self._epoch_start_iteration = None
+        self._epoch_rng_state = None
+        self._resume_epoch_state = (0, None)
 
         self.hooks = [
             SummaryHook(summary_trigger),
@@ -207,6 +265,16 @@ class Trainer(Configurable):
             progress_bar: flag whether to show a progress bar or not.
             resume:
                 Whether to resume a training or start a fresh one.
+                The checkpoint records the number of examples of the
+                current epoch that were consumed and the random state
+                (numpy and python) at the beginning of the epoch. The
+                random state is restored, i.e. a shuffle that draws a new
+                permutation from the global random state in each epoch
+                yields the same order, and the consumed examples are
+                skipped (see `padertorch.data.utils.skip_examples`).
+                Note: `lazy_dataset`'s `.shuffle(reshuffle=True)` shuffles
+                the permutation of the previous epoch, hence its order
+                after a restart is different.
             device:
                 Defines the device which shall be used ('cpu', 0, 1, ...).
                 If None, the device of the model will not be changed and the
@@ -215,12 +283,14 @@ class Trainer(Configurable):
         if resume:
             assert resume is True, resume
             self.load_checkpoint()
+            skip, epoch_rng_state = self._resume_epoch_state
         else:
             assert not self.checkpoint_dir.exists(),\
                 f'A checkpoint directory already exists. If you want to ' \
                 f'restart the training set resume to True.'
             self.iteration = 0
             self.epoch = 0
+            skip, epoch_rng_state = 0, None
         torch.backends.cudnn.enabled = True
         torch.backends.cudnn.benchmark = False
 
@@ -233,6 +303,12 @@ class Trainer(Configurable):
         self.optimizer_zero_grad()
 
         self.writer = self.writer_cls(str(self.storage_dir))
+        if self.async_summary:
+            self.writer = pt.summary.AsyncSummaryWriter(
+                self.writer,
+                **({} if self.async_summary is True
+                   else {'max_queue_size': self.async_summary}),
+            )
         hooks = [*self.hooks]
         if progress_bar:
             try:
@@ -249,13 +325,21 @@ class Trainer(Configurable):
             # typical stop condition is a firing `StopTrainingHook`.
             for self.epoch in itertools.count(start=self.epoch):
                 epoch_start = True
+                self._epoch_start_iteration = self.iteration - skip
+                if epoch_rng_state is not None:
+                    _set_rng_state(epoch_rng_state)
+                self._epoch_rng_state = _get_rng_state()
+                epoch_iterator = self._maybe_prefetch_train(
+                    pt.data.utils.skip_examples(train_iterator, skip))
+                skip, epoch_rng_state = 0, None
+
                 for hook in hooks:
                     hook.pre_step(self)
 
                 for self.iteration, example in self.train_timer(
                     key='time_per_data_loading',
                     iterable=enumerate(
-                        train_iterator,
+                        epoch_iterator,
                         start=self.iteration,
                     )
                 ):
@@ -298,6 +382,8 @@ class Trainer(Configurable):
                 print('Exception in finally. May hide actual exception!!!\n'
                       'You may comment this finally block for debugging.')
                 raise
+            finally:
+                self.checkpoint_store.close()
             self.writer.close()
             self.writer = None
 
@@ -324,7 +410,8 @@ class Trainer(Configurable):
             try:
                 for i, example in self.validate_timer(
                     key='time_per_data_loading',
-                    iterable=enumerate(validation_iterator)
+                    iterable=enumerate(
+                        self._maybe_prefetch(validation_iterator))
                 ):
                     with self.validate_timer['time_per_step']:
                         yield self.validation_step(example)
@@ -333,6 +420,15 @@ class Trainer(Configurable):
                 self.model.train()
                 self._non_validation_start_time = self.validate_timer.timestamp()
 
+    def _maybe_prefetch(self, iterator):
+        if self.prefetch_depth > 0:
+            return pt.data.DevicePrefetcher(
+                iterator, depth=self.prefetch_depth, device=self.device)
+        return iterator
+
+    def _maybe_prefetch_train(self, iterator):
+        return self._maybe_prefetch(iterator)
+
     def optimizer_zero_grad(self):
         if isinstance(self.optimizer, dict):
             for opti in self.optimizer.values():
@@ -348,6 +444,8 @@ class Trainer(Configurable):
             self.optimizer.step()
 
     def train_step(self, example, optimize=True):
+        if self.max_oom_splits > 0:
+            return self._oom_resilient_train_step(example, optimize)
 
         model_out, review = self.step(example, self.train_timer)
 
@@ -360,6 +458,98 @@ class Trainer(Configurable):
 
         return model_out, review
 
+    def _oom_resilient_train_step(self, example, optimize=True):
+        model_out, review, num_splits = self._oom_resilient_forward_backward(
+            example)
+        review.setdefault('scalars', {})['oom_splits'] = num_splits
+
+        with self.train_timer['time_per_backward']:
+            if optimize:
+                review = self.clip_grad(review)
+                self.optimizer_step()
+                self.optimizer_zero_grad()
+
+        return model_out, review
+
+    def _oom_resilient_forward_backward(self, example, weight=1., depth=0):
+        """
+        Runs forward, review and backward. On an out of memory error, the
+        example is split into two halves and this function is called
+        recursively for each half.
+
+        The gradients of previous steps (e.g. virtual_minibatch_size > 1)
+        are moved aside before the backward, so a failed backward does not
+        leave partially accumulated gradients.
+
+        Returns:
+            model_out: The model output or a list of model outputs, when the
+                example was split.
+            review: The (merged) review.
+            num_splits: The number of split events.
+        """
+        stash = self._stash_grads()
+        model_out = review = None
+        try:
+            model_out, review = self.step(example, self.train_timer)
+            with self.train_timer['time_per_backward']:
+                if weight == 1:
+                    self.backward(review)
+                else:
+                    self.backward({**review, 'loss': review['loss'] * weight})
+        except RuntimeError as e:
+            self._restore_grads(stash, accumulate=False)
+            if not _is_out_of_memory(e) or depth >= self.max_oom_splits:
+                raise
+            message = str(e)
+        else:
+            self._restore_grads(stash, accumulate=True)
+            return model_out, review, 0
+
+        # Release the graph of the failed step, before the halves are
+        # processed. The exception is out of scope here, so its traceback
+        # does not keep the tensors alive.
+        del model_out, review
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+        try:
+            examples = pt.data.split_example(example, 2)
+        except ValueError as e:
+            raise RuntimeError(
+                f'{message}\n\nThe example could not be split further: {e}'
+            ) from None
+        print(f'Out of memory in iteration {self.iteration}. Split the '
+              f'example in two parts (split depth {depth + 1}).')
+
+        batch_size = pt.data.batch_size_of_example(example)
+        model_outs, reviews, weights = [], [], []
+        num_splits = 1
+        for e in examples:
+            w = pt.data.batch_size_of_example(e) / batch_size
+            out, rev, n = self._oom_resilient_forward_backward(
+                e, weight * w, depth + 1
+            )
+            model_outs.append(out)
+            reviews.append(rev)
+            weights.append(w)
+            num_splits += n
+        return model_outs, _merge_reviews(reviews, weights), num_splits
+
+    def _stash_grads(self):
+        stash = []
+        for parameter in self.model.parameters():
+            stash.append((parameter, parameter.grad))
+            parameter.grad = None
+        return stash
+
+    @staticmethod
+    def _restore_grads(stash, accumulate):
+        for parameter, grad in stash:
+            if not accumulate or parameter.grad is None:
+                parameter.grad = grad
+            elif grad is not None:
+                parameter.grad += grad
+
     def validation_step(self, example):
         return self.step(example, self.validate_timer)
 
@@ -427,7 +617,8 @@ class Trainer(Configurable):
     def register_validation_hook(
             self, validation_iterator, metric='loss', maximize=False,
             max_checkpoints=1, n_back_off=0, lr_update_factor=1 / 10,
-            back_off_patience=None, early_stopping_patience=None
+            back_off_patience=None, early_stopping_patience=None,
+            async_validation=False, cache_validation=False,
     ):
         """
 
@@ -448,6 +639,13 @@ class Trainer(Configurable):
                 backing off
             early_stopping_patience: the number of allowed degradations before
                 stopping training. Should be larger than back_off_patience.
+            async_validation: If True, the validation runs in a background
+                process on the cpu, while the training continues.
+                See `ValidationHook` for details.
+            cache_validation: If True, the examples of the first validation
+                are cached (after the conversion to tensors) and replayed in
+                the following validations. The validation_iterator has to be
+                deterministic. See `padertorch.data.CachedIterable`.
 
 
         Returns:
@@ -463,6 +661,8 @@ class Trainer(Configurable):
             lr_update_factor=lr_update_factor,
             back_off_patience=back_off_patience,
             early_stopping_patience=early_stopping_patience,
+            asynchronous=async_validation,
+            cache=cache_validation,
         ))
 
     def clip_grad(self, summary: dict):
@@ -505,30 +705,54 @@ class Trainer(Configurable):
         else:
             optimizer_state_dict = self.optimizer.state_dict()
             
+        if self._epoch_start_iteration is None:
+            iteration_in_epoch = 0
+        else:
+            iteration_in_epoch = self.iteration - self._epoch_start_iteration
+
         return dict(
                 model=self.model.state_dict(),
                 iteration=self.iteration,
                 epoch=self.epoch,
                 optimizer=optimizer_state_dict,
+                iteration_in_epoch=iteration_in_epoch,
+                epoch_rng_state=self._epoch_rng_state,
         )
 
     def save_checkpoint(self, checkpoint_path=None):
         if checkpoint_path is None:
             checkpoint_path = self.default_checkpoint_path()
 
-        torch.save(
-            self.state_dict(),
-            str(checkpoint_path)
-        )
+        self.checkpoint_store.save(self.state_dict(), checkpoint_path)
+
+    def wait_for_checkpoint(self, checkpoint_path=None):
+        """
+        Blocks until the checkpoint is written to the disk.
+        Only necessary, when `async_checkpoint` is True.
 
-        # Create relative symlink to latest checkpoint
-        latest_symlink_path = (checkpoint_path.parent / f'ckpt_latest.pth').absolute()
-        if latest_symlink_path.is_symlink():
-            latest_symlink_path.unlink()
-        latest_symlink_path.symlink_to(checkpoint_path.name)
+        Args:
+            checkpoint_path: The checkpoint to wait for. If None, wait for all
+                pending checkpoints.
+        """
+        self.checkpoint_store.wait(checkpoint_path)
 
-        print(f"{datetime.now()}: Saved model and optimizer state "
-              f"at iteration {self.iteration} to {checkpoint_path}")
+    def _copy_for_validation(self):
+        """
+        Returns a copy of the trainer for the background validation
+        (see `ValidationHook`). The model and the optimizer are copied to the
+        cpu, the writer and the hooks are removed.
+        """
+        trainer = copy.copy(self)
+        trainer.writer = None
+        trainer.hooks = []
+        trainer.checkpoint_store = None
+        trainer.train_timer = ContextTimerDict()
+        trainer.validate_timer = ContextTimerDict()
+        trainer._non_validation_start_time = None
+        trainer.model, trainer.optimizer = copy.deepcopy(
+            (self.model, self.optimizer))
+        trainer.to('cpu')
+        return trainer
 
     def load_state_dict(self, state_dict):
         self.model.load_state_dict(state_dict['model'])
@@ -544,13 +768,23 @@ class Trainer(Configurable):
 
         self.iteration = state_dict['iteration']
         self.epoch = state_dict['epoch']
+        # Older checkpoints do not have the position in the epoch.
+        self._resume_epoch_state = (
+            state_dict.get('iteration_in_epoch', 0),
+            state_dict.get('epoch_rng_state', None),
+        )
 
-    def load_checkpoint(self, map_location='cpu'):
-        checkpoint_path = self.checkpoint_dir / 'ckpt_latest.pth'
-        assert checkpoint_path.is_file(), checkpoint_path
+    def load_checkpoint(self, map_location='cpu', checkpoint_path=None):
+        """
+        Loads the trainer state from `checkpoint_path` (Default:
+        `ckpt_latest.pth`). The checkpoint store serves the latest and the
+        best checkpoint from memory, if available.
+        """
+        if checkpoint_path is None:
+            checkpoint_path = self.checkpoint_dir / 'ckpt_latest.pth'
 
-        checkpoint_dict = torch.load(
-            str(checkpoint_path), map_location=map_location
+        checkpoint_dict = self.checkpoint_store.load(
+            checkpoint_path, map_location=map_location
         )
 
         self.load_state_dict(checkpoint_dict)
@@ -584,6 +818,95 @@ class Trainer(Configurable):
         return self.to(device)
 
 
+def _get_rng_state():
+    """
+    The state of the global numpy and python random number generators, e.g.
+    used by `lazy_dataset.Dataset.shuffle`. The numpy state is converted to
+    a tensor, so the checkpoint can be loaded with `weights_only=True`.
+    """
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return dict(
+        numpy=(name, torch.from_numpy(keys.astype(np.int64)), pos,
+               has_gauss, cached_gaussian),
+        python=random.getstate(),
+    )
+
+
+def _set_rng_state(state):
+    """
+    >>> state = _get_rng_state()
+    >>> a = np.random.randint(1000, size=3), random.randint(0, 1000)
+    >>> _set_rng_state(state)
+    >>> b = np.random.randint(1000, size=3), random.randint(0, 1000)
+    >>> np.testing.assert_equal(a, b)
+    """
+    name, keys, pos, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((
+        name, np.asarray(keys, dtype=np.int64).astype(np.uint32), pos,
+        has_gauss, cached_gaussian,
+    ))
+    version, internal_state, gauss_next = state['python']
+    random.setstate((version, tuple(internal_state), gauss_next))
+
+
+def _is_out_of_memory(exception):
+    """
+    >>> _is_out_of_memory(RuntimeError('CUDA out of memory. Tried to ...'))
+    True
+    >>> _is_out_of_memory(RuntimeError('Expected all tensors to be on ...'))
+    False
+    """
+    message = str(exception)
+    return (
+        'out of memory' in message
+        # CPU: "DefaultCPUAllocator: can't allocate memory: ..."
+        or "can't allocate memory" in message
+        or 'not enough memory' in message
+    )
+
+
+def _merge_reviews(reviews, weights):
+    """
+    Merges the reviews of the parts of a split example.
+
+    loss and losses are weighted with the relative batch sizes (i.e. assumed
+    to be means over the batch). The values of scalars and histograms are
+    concatenated, so e.g. counts that are summed in `Model.modify_summary`
+    stay correct. For audios, images, figures and texts the snapshot of the
+    first part is used.
+
+    >>> _merge_reviews([
+    ...     {'loss': torch.tensor(1.), 'scalars': {'a': 1}},
+    ...     {'loss': torch.tensor(4.), 'scalars': {'a': torch.tensor([2, 3])}},
+    ... ], [0.5, 0.5])
+    {'loss': tensor(2.5000), 'scalars': {'a': [1, 2, 3]}}
+    """
+    def concatenate(values):
+        if all(torch.is_tensor(v) for v in values):
+            return torch.cat([v.detach().reshape(-1) for v in values])
+        return [x for v in values for x in SummaryHook._to_list(v)]
+
+    merged = {}
+    for key, value in reviews[0].items():
+        if key == 'loss':
+            merged[key] = sum(
+                w * r[key].detach() for r, w in zip(reviews, weights))
+        elif key == 'losses':
+            merged[key] = {
+                k: sum(w * r[key][k].detach() for r, w in zip(reviews, weights))
+                for k in value
+            }
+        elif key in ['scalars', 'histograms']:
+            merged[key] = {
+                k: v if callable(v)  # lazy histogram
+                else concatenate([r[key][k] for r in reviews])
+                for k, v in value.items()
+            }
+        else:
+            merged[key] = value
+    return merged
+
+
 class MultiDeviceTrainer(Trainer):
     """
 
@@ -749,6 +1072,11 @@ class InteractiveWriter:
                       bins='tensorflow', walltime=None):
         pass
 
+    def add_histogram_raw(self, tag, min, max, num, sum, sum_squares,
+                          bucket_limits, bucket_counts, global_step,
+                          walltime=None):
+        pass
+
     def close(self):
         pass
 
@@ -0,0 +1,117 @@
+"""
+Benchmark of `pt.data.example_to_device` with batches, that look like the
+batches of the pit (bss) and the mask estimator examples.
+
+    python tests/test_data/benchmark_example_to_device.py [--device 0]
+
+The reference is the recursive implementation (one `torch.from_numpy(...)
+.to(device)` per array), that was used before the transfer plans.
+"""
+import argparse
+import timeit
+
+import numpy as np
+import torch
+
+import padertorch as pt
+
+
+def recursive_example_to_device(example, device=None):
+    if isinstance(example, dict):
+        return example.__class__({
+            key: recursive_example_to_device(value, device=device)
+            for key, value in example.items()
+        })
+    elif isinstance(example, (tuple, list)):
+        return example.__class__([
+            recursive_example_to_device(element, device=device)
+            for element in example
+        ])
+    elif torch.is_tensor(example):
+        return example.to(device=device)
+    elif isinstance(example, np.ndarray):
+        return recursive_example_to_device(
+            torch.from_numpy(example), device=device)
+    else:
+        return example
+
+
+def pit_batch(batch_size=4, num_samples=32000, num_speakers=2):
+    # See padertorch.contrib.ldrude.data.pre_batch_transform
+    rng = np.random.RandomState(0)
+    num_frames = (num_samples - 512) // 128 + 1
+    frequencies = 257
+
+    def stft_like(*shape):
+        return (rng.randn(*shape) + 1j * rng.randn(*shape)).astype(
+            np.complex64)
+
+    return {
+        'example_id': [str(i) for i in range(batch_size)],
+        's': [rng.randn(num_speakers, num_samples).astype(np.float32)
+              for _ in range(batch_size)],
+        'y': [rng.randn(num_samples).astype(np.float32)
+              for _ in range(batch_size)],
+        'Y': [stft_like(num_frames, frequencies) for _ in range(batch_size)],
+        'X_abs': [rng.rand(num_frames, num_speakers, frequencies).astype(
+            np.float32) for _ in range(batch_size)],
+        'Y_abs': [rng.rand(num_frames, frequencies).astype(np.float32)
+                  for _ in range(batch_size)],
+        'cos_phase_difference': [
+            rng.rand(num_frames, num_speakers, frequencies).astype(
+                np.float32) for _ in range(batch_size)],
+        'target_mask': [
+            rng.rand(num_frames, num_speakers, frequencies).astype(
+                np.float32) for _ in range(batch_size)],
+        'num_frames': [num_frames] * batch_size,
+    }
+
+
+def mask_estimator_batch(batch_size=16, num_frames=128, frequencies=257):
+    # See padertorch.contrib.examples.mask_estimator.simple_train.prepare_data
+    rng = np.random.RandomState(0)
+    shape = (batch_size, num_frames, frequencies)
+    return {
+        'observation_stft': (rng.randn(*shape) + 1j * rng.randn(*shape))
+        .astype(np.complex64),
+        'observation_abs': rng.rand(*shape).astype(np.float32),
+        'speech_mask_target': rng.rand(*shape).astype(np.float32),
+        'noise_mask_target': rng.rand(*shape).astype(np.float32),
+    }
+
+
+def benchmark(name, fn, example, device, number):
+    def run():
+        fn(example, device)
+        if torch.device(device).type == 'cuda':
+            torch.cuda.synchronize(device)
+
+    run()  # warm up (transfer plan, cuda context)
+    seconds = min(timeit.repeat(run, number=number, repeat=5)) / number
+    print(f'{name:>40}: {seconds * 1e3:8.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--device', default=0 if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+    device = int(args.device) if str(args.device).isdigit() else args.device
+
+    for name, example in [
+        ('pit', pit_batch()),
+        ('mask_estimator', mask_estimator_batch()),
+    ]:
+        benchmark(
+            f'{name} recursive', recursive_example_to_device, example,
+            device, args.number,
+        )
+        benchmark(
+            f'{name} example_to_device', pt.data.example_to_device, example,
+            device, args.number,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import dataclasses
+
+import numpy as np
+import torch
+
+import padertorch as pt
+
+
+@dataclasses.dataclass
+class Segment:
+    start: int
+    signal: np.ndarray
+
+
+def get_example(num_frames=5):
+    rng = np.random.RandomState(num_frames)
+    return {
+        'example_id': 'a',
+        'Y': (rng.randn(num_frames, 3)
+              + 1j * rng.randn(num_frames, 3)).astype(np.complex64),
+        'Y_abs': rng.rand(num_frames, 3).astype(np.float32),
+        'target_mask': rng.rand(num_frames, 2, 3).astype(np.float32),
+        'num_frames': [num_frames],
+        'index': torch.arange(num_frames),
+        'segment': Segment(2, rng.randn(4).astype(np.float32)),
+        'nested': ({'w': torch.ones(2, requires_grad=True)},),
+    }
+
+
+def assert_transferred(example, transferred, device):
+    if isinstance(example, dict):
+        assert type(transferred) is type(example), (example, transferred)
+        assert list(transferred.keys()) == list(example.keys())
+        for key in example:
+            assert_transferred(example[key], transferred[key], device)
+    elif isinstance(example, (tuple, list)):
+        assert type(transferred) is type(example), (example, transferred)
+        assert len(transferred) == len(example)
+        for e, t in zip(example, transferred):
+            assert_transferred(e, t, device)
+    elif isinstance(example, (np.ndarray, torch.Tensor)):
+        assert torch.is_tensor(transferred), transferred
+        expected = torch.as_tensor(example)
+        assert transferred.shape == expected.shape, (transferred, expected)
+        assert transferred.dtype == expected.dtype, (transferred, expected)
+        assert transferred.device == torch.device(device), transferred
+        assert transferred.requires_grad == expected.requires_grad
+        if transferred.device.type != 'meta':
+            np.testing.assert_equal(
+                transferred.detach().numpy(), expected.detach().numpy())
+    elif dataclasses.is_dataclass(example):
+        assert type(transferred) is type(example), (example, transferred)
+        assert_transferred(
+            dataclasses.asdict(example), dataclasses.asdict(transferred),
+            device,
+        )
+    else:
+        assert transferred == example, (example, transferred)
+
+
+def test_example_to_device_cpu():
+    for num_frames in [5, 7, 5]:
+        example = get_example(num_frames)
+        assert_transferred(
+            example, pt.data.example_to_device(example, 'cpu'), 'cpu')
+
+
+def test_example_to_device_coalesced():
+    # The meta device has no data, but it uses the same code path as cuda
+    # (without pinned memory), i.e. the leaves are coalesced by dtype.
+    for num_frames in [5, 7, 5]:
+        example = get_example(num_frames)
+        transferred = pt.data.example_to_device(example, 'meta')
+        assert_transferred(example, transferred, 'meta')
+
+
+def test_example_to_device_complex():
+    example = get_example()
+    transferred = pt.data.example_to_device(example, convert_complex=False)
+    assert isinstance(transferred['Y'], np.ndarray), transferred['Y']
+    assert torch.is_tensor(transferred['Y_abs']), transferred['Y_abs']
+    transferred = pt.data.example_to_device(example)
+    assert transferred['Y'].dtype == torch.complex64, transferred['Y']
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import padertorch as pt
+
+
+def get_lengths(size=200, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.randint(8000, 30 * 8000, size=size)
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(max_total_length=1_000_000),
+    dict(max_padded_length=1_000_000),
+    dict(max_padded_length=1_000_000, max_batch_size=4),
+    dict(max_total_length=1_000_000, bucket_size=50),
+])
+def test_budget_and_coverage(kwargs):
+    lengths = get_lengths()
+    sampler = pt.data.BucketBatchSampler(lengths, **kwargs)
+    batches = list(sampler)
+
+    # Each example is in exactly one batch.
+    np.testing.assert_equal(
+        np.sort(np.concatenate(batches)), np.arange(len(lengths)))
+
+    for batch in batches:
+        batch_lengths = lengths[batch]
+        if len(batch) == 1:
+            continue
+        if 'max_total_length' in kwargs:
+            assert batch_lengths.sum() <= kwargs['max_total_length']
+        if 'max_padded_length' in kwargs:
+            assert len(batch) * batch_lengths.max() \
+                <= kwargs['max_padded_length']
+        if 'max_batch_size' in kwargs:
+            assert len(batch) <= kwargs['max_batch_size']
+
+
+def test_padding_efficiency():
+    lengths = get_lengths()
+    sampler = pt.data.BucketBatchSampler(
+        lengths, max_batch_size=8, seed=1)
+    assert sampler.padding_efficiency is None
+    batches = list(sampler)
+    assert sampler.padding_efficiency == pt.data.padding_efficiency(
+        batches, lengths)
+
+    rng = np.random.RandomState(1)
+    unsorted = np.array_split(rng.permutation(len(lengths)), len(batches))
+    assert sampler.padding_efficiency > 0.9
+    assert sampler.padding_efficiency > pt.data.padding_efficiency(
+        unsorted, lengths)
+
+
+def test_deterministic_seeding():
+    lengths = get_lengths()
+
+    def make(seed):
+        return pt.data.BucketBatchSampler(
+            lengths, max_total_length=1_000_000, bucket_size=50, seed=seed)
+
+    sampler = make(0)
+    epoch_0 = list(sampler)
+    epoch_1 = list(sampler)
+    assert epoch_0 != epoch_1
+    assert epoch_0 == list(make(0))
+    assert epoch_1 == list(make(0).set_epoch(1))
+    assert epoch_0 != list(make(1))
+
+
+def test_no_shuffle_sorted():
+    lengths = get_lengths()
+    sampler = pt.data.BucketBatchSampler(
+        lengths, max_batch_size=10, shuffle=False)
+    order = np.concatenate(list(sampler))
+    assert np.all(np.diff(lengths[order]) <= 0)
+
+
+def test_drop_last():
+    sampler = pt.data.BucketBatchSampler(
+        [5] * 10, max_batch_size=4, shuffle=False, drop_last=True)
+    assert [len(b) for b in sampler] == [4, 4]
+
+
+def test_get_lengths_without_loading():
+    class Dataset:
+        def __iter__(self):
+            for n in [3, 4]:
+                yield {'num_samples': {'observation': n}, 'audio_path': ...}
+
+    np.testing.assert_equal(pt.data.get_lengths(Dataset()), [3, 4])
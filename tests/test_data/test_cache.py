@@ -0,0 +1,237 @@
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+
+import padertorch as pt
+
+
+class Dataset:
+    def __init__(self, size=4):
+        self.size = size
+        self.num_loads = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for i in range(self.size):
+            self.num_loads += 1
+            yield {
+                'x': np.full((2, 3), i, dtype=np.float32),
+                'c': np.full(2, i + 1j),
+                'example_id': str(i),
+            }
+
+
+def assert_examples_equal(examples, size):
+    assert len(examples) == size, examples
+    for i, example in enumerate(examples):
+        assert torch.is_tensor(example['x']), example
+        np.testing.assert_equal(example['x'].numpy(), np.full((2, 3), i))
+        assert torch.is_tensor(example['c']), example
+        np.testing.assert_equal(example['c'].numpy(), np.full(2, i + 1j))
+        assert example['example_id'] == str(i), example
+
+
+def test_memory_cache():
+    dataset = Dataset()
+    it = pt.data.CachedIterable(dataset)
+    for _ in range(3):
+        assert_examples_equal(list(it), 4)
+    assert dataset.num_loads == 4, dataset.num_loads
+    assert it.is_cached
+
+
+def test_incomplete_iteration_is_not_cached():
+    dataset = Dataset()
+    it = pt.data.CachedIterable(dataset)
+    next(iter(it))
+    assert not it.is_cached
+    assert_examples_equal(list(it), 4)
+    assert_examples_equal(list(it), 4)
+    assert dataset.num_loads == 5, dataset.num_loads
+
+
+def test_spill_file():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        spill_file = Path(tmp_dir) / 'cache.bin'
+        dataset = Dataset()
+        it = pt.data.CachedIterable(
+            dataset, max_memory_bytes=2 * (24 + 32), spill_file=spill_file)
+        assert_examples_equal(list(it), 4)
+        assert it.memory_bytes == 2 * (24 + 32), it.memory_bytes
+        assert it.spill_bytes == 2 * (24 + 32), it.spill_bytes
+        assert spill_file.stat().st_size == it.spill_bytes
+
+        assert_examples_equal(list(it), 4)
+        assert dataset.num_loads == 4, dataset.num_loads
+
+        it.clear()
+        assert not spill_file.exists()
+
+
+def test_budget_exceeded():
+    dataset = Dataset()
+    it = pt.data.CachedIterable(dataset, max_memory_bytes=100)
+    assert_examples_equal(list(it), 4)
+    assert it.disabled
+    assert_examples_equal(list(it), 4)
+    assert dataset.num_loads == 8, dataset.num_loads
+
+
+class Transform:
+    def __init__(self, scale=1.):
+        self.scale = scale
+        self._calls = 0
+
+    def __call__(self, example):
+        self._calls += 1
+        data = np.loadtxt(example['audio_path'], ndmin=1)
+        example['audio_data'] = data
+        example['mel_transform'] = np.outer(data, np.arange(3)) * self.scale
+        return example
+
+
+def write_audio(tmpdir, size=4):
+    paths = []
+    for i in range(size):
+        path = Path(tmpdir) / f'{i}.txt'
+        np.savetxt(path, np.arange(i + 2) + i)
+        paths.append(path)
+    return paths
+
+
+def get_examples(paths):
+    return [
+        {'example_id': str(i), 'audio_path': str(path)}
+        for i, path in enumerate(paths)
+    ]
+
+
+def test_feature_cache_hit():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = write_audio(tmpdir)
+        transform = Transform()
+        cache = pt.data.FeatureCache(
+            transform, Path(tmpdir) / 'cache', keys='mel_transform')
+        expected = [Transform()(ex) for ex in get_examples(paths)]
+        for _ in range(2):
+            examples = [cache(ex) for ex in get_examples(paths)]
+            for example, ref in zip(examples, expected):
+                assert example['mel_transform'].dtype == np.float32
+                np.testing.assert_allclose(
+                    example['mel_transform'], ref['mel_transform'])
+        assert transform._calls == 4
+        assert (cache.hits, cache.misses) == (4, 4)
+        # The transform is skipped, i.e. the audio is not read.
+        assert 'audio_data' not in examples[0]
+        cache.close()
+
+        # A new instance (e.g. the next training) reuses the cache.
+        cache = pt.data.FeatureCache(
+            transform, Path(tmpdir) / 'cache', keys='mel_transform')
+        [cache(ex) for ex in get_examples(paths)]
+        assert transform._calls == 4
+        cache.close()
+
+
+def test_feature_cache_hit_and_miss_keys():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = write_audio(tmpdir, size=1)
+        cache = pt.data.FeatureCache(
+            Transform(), Path(tmpdir) / 'cache', keys='mel_transform')
+        miss = cache(get_examples(paths)[0])
+        hit = cache(get_examples(paths)[0])
+        assert (cache.hits, cache.misses) == (1, 1)
+        # The other outputs of the transform (audio_data) are dropped.
+        assert set(miss.keys()) == set(hit.keys()) == {
+            'example_id', 'audio_path', 'mel_transform'}, (miss, hit)
+        cache.close()
+
+
+def test_feature_cache_invalidation():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = write_audio(tmpdir)
+        cache_dir = Path(tmpdir) / 'cache'
+        transform = Transform()
+        cache = pt.data.FeatureCache(transform, cache_dir, 'mel_transform')
+        [cache(ex) for ex in get_examples(paths)]
+
+        # Changed parameters of the transform
+        cache = pt.data.FeatureCache(
+            Transform(scale=2.), cache_dir, 'mel_transform')
+        example = cache(get_examples(paths)[1])
+        assert cache.misses == 1
+        np.testing.assert_equal(example['mel_transform'][:, 1], [2, 4, 6])
+
+        # Changed audio file
+        np.savetxt(paths[0], [5, 5])
+        stat = paths[0].stat()
+        os.utime(paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        cache = pt.data.FeatureCache(transform, cache_dir, 'mel_transform')
+        example = cache(get_examples(paths)[0])
+        assert cache.misses == 1
+        np.testing.assert_equal(example['mel_transform'][:, 1], [5, 5])
+
+
+def test_feature_cache_float16_and_eviction():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = write_audio(tmpdir, size=8)
+        cache_dir = Path(tmpdir) / 'cache'
+        transform = Transform()
+        cache = pt.data.FeatureCache(
+            transform, cache_dir, keys='mel_transform', dtype=np.float16,
+            max_bytes=100, shard_bytes=30,
+        )
+        for example in get_examples(paths):
+            assert cache(example)['mel_transform'].dtype == np.float16
+        cache.close()
+        cached_bytes = sum([
+            f.stat().st_size for f in cache_dir.glob('shard-*.bin')])
+        # One shard with (2 + 8) * 3 * 2 bytes can exceed the cap shortly.
+        assert cached_bytes <= 100 + 60, cached_bytes
+
+        # The most recently used examples are still cached.
+        cache = pt.data.FeatureCache(
+            transform, cache_dir, keys='mel_transform', dtype=np.float16,
+            max_bytes=100, shard_bytes=30,
+        )
+        cache(get_examples(paths)[-1])
+        assert cache.hits == 1
+        cache(get_examples(paths)[0])
+        assert cache.misses == 1
+        cache.close()
+
+
+def _fill_cache(cache, examples):
+    for example in examples:
+        cache(example)
+    cache.close()
+    return cache.misses
+
+
+def test_feature_cache_processes():
+    import concurrent.futures
+    import multiprocessing
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = write_audio(tmpdir, size=8)
+        cache = pt.data.FeatureCache(
+            Transform(), Path(tmpdir) / 'cache', keys='mel_transform')
+        examples = get_examples(paths)
+        with concurrent.futures.ProcessPoolExecutor(
+                2, mp_context=multiprocessing.get_context('spawn')
+        ) as executor:
+            misses = list(executor.map(
+                _fill_cache, [cache, cache], [examples[:6], examples[2:]]))
+        assert sum(misses) >= 8
+
+        expected = [Transform()(ex) for ex in get_examples(paths)]
+        for example, ref in zip(examples, expected):
+            np.testing.assert_allclose(
+                cache(dict(example))['mel_transform'], ref['mel_transform'])
+        assert cache.misses == 0
+        cache.close()
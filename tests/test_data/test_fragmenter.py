@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from padertorch.data.fragmenter import Fragmenter
+
+
+def get_example():
+    return {
+        'audio': np.random.randn(2, 16000).astype(np.float32),
+        'stft': np.random.randn(2, 100, 257).astype(np.float32),
+        'meta': {'speaker': ['a', 'b']},
+    }
+
+
+@pytest.mark.parametrize('drop_last', [False, True])
+@pytest.mark.parametrize('lazy', [False, True])
+def test_views_equal_copies(drop_last, lazy):
+    example = get_example()
+    steps = {'audio': 1600, 'stft': 10}
+    lengths = {'audio': 3200, 'stft': 20}
+    kwargs = dict(axis=-1, drop_last=drop_last)
+    example['stft'] = example['stft'].transpose(0, 2, 1)
+
+    expected = Fragmenter(steps, lengths, **kwargs)(example)
+    fragments = Fragmenter(
+        steps, lengths, views=True, lazy=lazy, **kwargs)(example)
+    if lazy:
+        assert not isinstance(fragments, list)
+    fragments = list(fragments)
+
+    assert len(fragments) == len(expected)
+    for fragment, ref in zip(fragments, expected):
+        assert fragment.keys() == ref.keys()
+        for key in steps:
+            np.testing.assert_equal(fragment[key], ref[key])
+            assert np.shares_memory(fragment[key], example[key])
+            assert not fragment[key].flags.writeable
+        assert fragment['meta'] == ref['meta']
+        # The metadata is referenced, not copied.
+        assert fragment['meta']['speaker'] is example['meta']['speaker']
+        assert ref['meta']['speaker'] is not example['meta']['speaker']
+
+
+def test_views_squeeze():
+    example = {'a': np.arange(12).reshape((3, 4))}
+    expected = Fragmenter({'a': 1}, axis=0, squeeze=True)(example)
+    fragments = Fragmenter(
+        {'a': 1}, axis=0, squeeze=True, views=True)(example)
+    assert len(fragments) == len(expected) == 3
+    for fragment, ref in zip(fragments, expected):
+        assert fragment['a'].shape == (4,)
+        np.testing.assert_equal(fragment['a'], ref['a'])
@@ -0,0 +1,145 @@
+import multiprocessing
+import time
+
+import lazy_dataset
+import numpy as np
+import pytest
+import torch
+
+import padertorch as pt
+from padertorch.contrib.je.data.transforms import Collate
+
+
+def get_dataset(size=20, batch_size=None, fail=None, filtered=()):
+    def load(index):
+        if index == fail:
+            raise ValueError(f'Failed {index}')
+        if index in filtered:
+            raise lazy_dataset.FilterException()
+        # Random durations, that the workers finish out of order
+        time.sleep(np.random.RandomState(index).uniform(0, 0.01))
+        return {
+            'x': np.full((index % 3 + 1, 8), index, dtype=np.float32),
+            'index': index,
+            'name': str(index),
+        }
+    dataset = lazy_dataset.new(list(range(size))).map(load)
+    if batch_size is not None:
+        dataset = dataset.batch(batch_size)
+    return dataset
+
+
+def assert_no_workers():
+    for _ in range(50):
+        if not multiprocessing.active_children():
+            return
+        time.sleep(0.1)
+    assert not multiprocessing.active_children()
+
+
+def test_ordered():
+    loader = pt.data.Loader(get_dataset(), num_workers=3)
+    examples = list(loader)
+    assert [ex['index'] for ex in examples] == list(range(20))
+    for ex in examples:
+        np.testing.assert_equal(ex['x'], ex['index'])
+        assert ex['x'].shape == (ex['index'] % 3 + 1, 8)
+        assert ex['x'].dtype == np.float32
+    assert_no_workers()
+
+
+def test_unordered():
+    loader = pt.data.Loader(get_dataset(), num_workers=3, ordered=False)
+    examples = list(loader)
+    assert sorted([ex['index'] for ex in examples]) == list(range(20))
+    for ex in examples:
+        np.testing.assert_equal(ex['x'], ex['index'])
+
+
+def test_collate_to_tensor():
+    loader = pt.data.Loader(
+        get_dataset(batch_size=4), transform=Collate(), num_workers=2,
+        to_tensor=True,
+    )
+    assert len(loader) == 5
+    batches = list(loader)
+    assert len(batches) == 5
+    for i, batch in enumerate(batches):
+        assert torch.is_tensor(batch['x'])
+        assert batch['x'].shape[0] == 4
+        assert batch['name'] == [str(j) for j in range(4 * i, 4 * i + 4)]
+        np.testing.assert_equal(
+            batch['x'][:, 0, 0].numpy(), np.arange(4 * i, 4 * i + 4))
+
+
+def test_arrays_are_views_of_the_ring():
+    # Each example is shared, when the consumer does not keep the examples.
+    loader = pt.data.Loader(get_dataset(size=40), num_workers=2)
+    for i, example in enumerate(loader):
+        assert not example['x'].flags.owndata, i
+        assert example['x'].base.shape == (loader.slot_bytes,), i
+
+
+def test_kept_examples_stay_valid():
+    # More examples than slots are kept, i.e. the slots are exhausted and
+    # the remaining examples are pickled.
+    loader = pt.data.Loader(
+        get_dataset(size=30), num_workers=2, num_slots=3)
+    examples = list(loader)
+    for i, example in enumerate(examples):
+        np.testing.assert_equal(example['x'], i)
+
+
+def test_slot_too_small():
+    # 64 bytes fit only the examples with one or two rows.
+    loader = pt.data.Loader(get_dataset(size=6), num_workers=2, slot_bytes=64)
+    for i, example in enumerate(loader):
+        np.testing.assert_equal(example['x'], i)
+        shared = getattr(example['x'].base, 'shape', None) == (64,)
+        assert shared == (i % 3 != 2)
+
+
+def test_filter_exception():
+    dataset = get_dataset(filtered=(3, 7))
+    loader = pt.data.Loader(
+        dataset, num_workers=2, catch_filter_exception=True)
+    indices = [ex['index'] for ex in loader]
+    assert indices == [i for i in range(20) if i not in (3, 7)]
+    with pytest.raises(TypeError):
+        len(loader)
+
+    loader = pt.data.Loader(dataset, num_workers=2)
+    with pytest.raises(RuntimeError, match='FilterException'):
+        list(loader)
+    assert_no_workers()
+
+
+def test_worker_exception():
+    loader = pt.data.Loader(get_dataset(fail=5), num_workers=2)
+    with pytest.raises(RuntimeError, match='Failed 5'):
+        list(loader)
+    assert_no_workers()
+
+
+def test_killed_worker():
+    import os
+    import signal
+
+    def load(index):
+        if index == 3:
+            os.kill(os.getpid(), signal.SIGKILL)
+        return {'index': index}
+    dataset = lazy_dataset.new(list(range(10))).map(load)
+    loader = pt.data.Loader(dataset, num_workers=2, timeout=0.1)
+    with pytest.raises(RuntimeError, match=r'died unexpectedly(.|\n)*3'):
+        list(loader)
+    assert_no_workers()
+
+
+def test_early_stop():
+    loader = pt.data.Loader(get_dataset(size=100), num_workers=3)
+    for i, example in enumerate(loader):
+        if i == 5:
+            break
+    del example
+    assert_no_workers()
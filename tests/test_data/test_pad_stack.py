@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import torch
+
+from padertorch.contrib.je.data.transforms import Collate
+from padertorch.contrib.jensheit.batch import Padder
+from padertorch.data.utils import pad_stack, collate_fn
+
+
+def test_pad_stack_keeps_dtype():
+    arrays = [
+        np.ones((2, 5, 3), np.float32),
+        np.ones((2, 7, 3), np.float32),
+    ]
+    batch, lengths, mask = pad_stack(
+        arrays, return_lengths=True, return_mask=True)
+    assert batch.dtype == np.float32
+    assert batch.shape == (2, 2, 7, 3)
+    np.testing.assert_equal(lengths, [5, 7])
+    np.testing.assert_equal(mask.sum(axis=-1), [5, 7])
+    np.testing.assert_equal(batch[0, :, 5:], 0)
+    np.testing.assert_equal(batch[1], 1)
+
+
+def test_pad_stack_cut_end_and_pad_value():
+    arrays = [np.arange(4), np.arange(2)]
+    np.testing.assert_equal(
+        pad_stack(arrays, pad_value=-1), [[0, 1, 2, 3], [0, 1, -1, -1]])
+    np.testing.assert_equal(pad_stack(arrays, cut_end=True), [[0, 1], [0, 1]])
+
+
+def test_pad_stack_only_one_axis_may_differ():
+    with pytest.raises(AssertionError):
+        pad_stack([np.ones((2, 3)), np.ones((3, 2))])
+
+
+def test_pad_stack_shared_memory():
+    batch = pad_stack(
+        [np.ones(3, np.float32), np.ones(2, np.float32)], memory='shared')
+    np.testing.assert_equal(batch, [[1, 1, 1], [1, 1, 0]])
+    with pytest.raises(ValueError):
+        pad_stack([np.ones(3)], memory='gpu')
+
+
+def test_collate_and_padder_use_pad_stack():
+    examples = [
+        {'a': np.ones((3, 2), np.float32), 'b': 'x'},
+        {'a': np.ones((1, 2), np.float32), 'b': 'y'},
+    ]
+    expected = pad_stack([ex['a'] for ex in examples])
+
+    collated = Collate(to_tensor=True)(examples)
+    assert collated['a'].dtype == torch.float32
+    np.testing.assert_equal(collated['a'].numpy(), expected)
+
+    padded = Padder(to_torch=True)(examples)
+    assert padded['a'].dtype == torch.float32
+    np.testing.assert_equal(padded['a'].numpy(), expected)
+
+    stacked = collate_fn(examples, stack_arrays=True)
+    np.testing.assert_equal(stacked['a'], expected)
+    assert stacked['b'] == ['x', 'y']
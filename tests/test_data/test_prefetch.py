@@ -0,0 +1,114 @@
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+
+import padertorch as pt
+
+
+class Dataset:
+    def __init__(self, size=6, delay=0.):
+        self.size = size
+        self.delay = delay
+        self.threads = set()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for i in range(self.size):
+            self.threads.add(threading.current_thread().name)
+            time.sleep(self.delay)
+            yield {'x': np.full(3, i, dtype=np.float32), 'index': i}
+
+
+def test_prefetch_order():
+    dataset = Dataset()
+    examples = list(pt.data.DevicePrefetcher(dataset, depth=2))
+    assert [example['index'] for example in examples] == list(range(6))
+    for i, example in enumerate(examples):
+        assert torch.is_tensor(example['x']), example
+        np.testing.assert_equal(example['x'].numpy(), np.full(3, i))
+    assert dataset.threads == {'DevicePrefetcher'}, dataset.threads
+
+
+def test_prefetch_exception():
+    def examples():
+        yield {'x': np.zeros(3)}
+        raise ValueError('broken example')
+
+    it = iter(pt.data.DevicePrefetcher(examples()))
+    next(it)
+    with pytest.raises(ValueError, match='broken example'):
+        next(it)
+
+
+def test_prefetch_stop():
+    num_threads = threading.active_count()
+    it = iter(pt.data.DevicePrefetcher(Dataset(size=100), depth=1))
+    next(it)
+    it.close()
+    assert threading.active_count() == num_threads
+
+
+class Model(pt.Model):
+
+    def __init__(self):
+        super().__init__()
+        self.l = torch.nn.Linear(3, 2)
+
+    def forward(self, inputs):
+        return self.l(inputs['x'])
+
+    def review(self, inputs, outputs):
+        return {'loss': torch.mean(outputs ** 2)}
+
+
+class Writer(pt.trainer.InteractiveWriter):
+    tags = {}
+
+    def __init__(self, storage_dir):
+        super().__init__()
+
+    def add_scalar(self, tag, scalar_value, global_step, walltime=None):
+        self.tags.setdefault(tag, []).append(scalar_value)
+
+
+def train(storage_dir, prefetch_depth, delay):
+    torch.manual_seed(0)
+    trainer = pt.Trainer(
+        Model(),
+        storage_dir=storage_dir,
+        optimizer=pt.optimizer.SGD(lr=0.1),
+        summary_trigger=(1, 'epoch'),
+        checkpoint_trigger=(1, 'epoch'),
+        stop_trigger=(2, 'epoch'),
+        prefetch_depth=prefetch_depth,
+    )
+    trainer.writer_cls = Writer
+    trainer.register_validation_hook(Dataset(2))
+    Writer.tags = {}
+    trainer.train(Dataset(delay=delay), progress_bar=False, device='cpu')
+    return trainer.model.state_dict(), Writer.tags
+
+
+def test_trainer_prefetch():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        expected, expected_scalars = train(
+            tmp_dir / 'sync', prefetch_depth=0, delay=0.)
+        state, scalars = train(
+            tmp_dir / 'prefetch', prefetch_depth=2, delay=0.01)
+        for key, value in expected.items():
+            np.testing.assert_allclose(
+                value.numpy(), state[key].numpy(), rtol=1e-6)
+        np.testing.assert_allclose(
+            scalars['validation/loss'],
+            expected_scalars['validation/loss'],
+        )
+        assert 'training_timings/time_rel_data_loading' in scalars, \
+            scalars.keys()
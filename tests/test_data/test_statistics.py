@@ -0,0 +1,168 @@
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import lazy_dataset
+import numpy as np
+import pytest
+
+import padertorch as pt
+from padertorch.contrib.je.data import transforms
+from padertorch.contrib.je.data.transforms import (
+    LabelEncoder, Normalizer, initialize_statistics
+)
+
+
+class Dataset:
+    """Indexable, but not picklable (like a lazy dataset with lambdas)."""
+    indexable = True
+
+    def __init__(self, size=23, offset=0.):
+        rng = np.random.RandomState(0)
+        self.arrays = [
+            offset + rng.randn(2, rng.randint(5, 20), 4) * (1 + np.arange(4))
+            for _ in range(size)
+        ]
+        self.labels = [['a', 'b', 'c'][i % 3] for i in range(size)]
+        self.not_picklable = lambda x: x
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def __getitem__(self, index):
+        return {'x': self.arrays[index], 'label': self.labels[index]}
+
+
+def reference_moments(dataset, center_axis, scale_axis):
+    x = np.concatenate(dataset.arrays, axis=1)
+    mean = np.mean(x, axis=center_axis, keepdims=True)
+    scale = np.sqrt(np.mean(
+        np.mean(x ** 2, axis=scale_axis, keepdims=True) - mean ** 2,
+        axis=scale_axis, keepdims=True
+    ))
+    return mean, scale
+
+
+def get_reducers():
+    return {
+        'moments': pt.data.MomentsReducer(
+            'x', center_axis=(1,), scale_axis=(1, 2)),
+        'labels': pt.data.LabelReducer('label'),
+    }
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_reduce_dataset(num_workers):
+    dataset = Dataset()
+    results = pt.data.reduce_dataset(
+        dataset, get_reducers(), num_workers=num_workers, chunk_size=4)
+    mean, scale = reference_moments(dataset, (1,), (1, 2))
+    np.testing.assert_allclose(results['moments'][0], mean)
+    np.testing.assert_allclose(results['moments'][1], scale)
+    assert results['labels'] == ['a', 'b', 'c']
+
+
+def test_numerically_stable():
+    dataset = Dataset(offset=1e8)
+    results = pt.data.reduce_dataset(dataset, get_reducers(), chunk_size=4)
+    x = np.concatenate([a - 1e8 for a in dataset.arrays], axis=1)
+    expected = np.sqrt(np.mean(
+        np.var(x, axis=1, keepdims=True), axis=(1, 2), keepdims=True))
+    np.testing.assert_allclose(results['moments'][1], expected, rtol=1e-6)
+
+
+def test_iterable_dataset():
+    dataset = Dataset()
+    results = pt.data.reduce_dataset(
+        [dataset[i] for i in range(len(dataset))].__iter__(),
+        {'labels': pt.data.LabelReducer('label')},
+    )
+    assert results['labels'] == ['a', 'b', 'c']
+
+
+def test_resume_from_checkpoint():
+    dataset = Dataset()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        checkpoint_file = Path(tmpdir) / 'statistics.pkl'
+        calls = []
+        reduce_chunk = pt.data.statistics._reduce_chunk
+
+        def interrupted(dataset, reducers, indices):
+            calls.append(indices)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            return reduce_chunk(dataset, reducers, indices)
+
+        with mock.patch.object(
+                pt.data.statistics, '_reduce_chunk', interrupted):
+            with pytest.raises(KeyboardInterrupt):
+                pt.data.reduce_dataset(
+                    dataset, get_reducers(), chunk_size=4,
+                    checkpoint_file=checkpoint_file,
+                )
+        with checkpoint_file.open('rb') as fid:
+            assert len(pickle.load(fid)['done']) == 2
+
+        calls.clear()
+        with mock.patch.object(
+                pt.data.statistics, '_reduce_chunk',
+                lambda *args: calls.append(args[-1]) or reduce_chunk(*args)):
+            results = pt.data.reduce_dataset(
+                dataset, get_reducers(), chunk_size=4,
+                checkpoint_file=checkpoint_file,
+            )
+        assert len(calls) == 4
+        assert not checkpoint_file.exists()
+        mean, scale = reference_moments(dataset, (1,), (1, 2))
+        np.testing.assert_allclose(results['moments'][0], mean)
+        np.testing.assert_allclose(results['moments'][1], scale)
+
+
+def test_initialize_transforms_in_one_pass():
+    dataset = Dataset()
+    with tempfile.TemporaryDirectory() as storage_dir:
+        normalizer = Normalizer(
+            'x', center_axis=(1,), scale_axis=(1, 2), storage_dir=storage_dir)
+        label_encoder = LabelEncoder('label', storage_dir=storage_dir)
+        with mock.patch.object(
+                transforms, 'reduce_dataset', wraps=transforms.reduce_dataset,
+        ) as reduce:
+            initialize_statistics(
+                dataset, [normalizer, label_encoder], num_workers=2,
+                chunk_size=5,
+            )
+        assert reduce.call_count == 1
+        mean, scale = reference_moments(dataset, (1,), (1, 2))
+        np.testing.assert_allclose(normalizer.moments[0], mean)
+        np.testing.assert_allclose(normalizer.moments[1], scale)
+        assert label_encoder.label_mapping == {'a': 0, 'b': 1, 'c': 2}
+        assert (Path(storage_dir) / 'x_moments.json').exists()
+        assert (Path(storage_dir) / 'label.json').exists()
+
+        # The json files are restored without a dataset.
+        normalizer = Normalizer(
+            'x', center_axis=(1,), scale_axis=(1, 2), storage_dir=storage_dir)
+        normalizer.initialize_moments()
+        np.testing.assert_allclose(normalizer.moments[1], scale)
+        label_encoder = LabelEncoder('label', storage_dir=storage_dir)
+        label_encoder.initialize_labels()
+        assert label_encoder.label_mapping == {'a': 0, 'b': 1, 'c': 2}
+
+
+def test_initialize_moments_not_indexable():
+    dataset = Dataset()
+    expected = reference_moments(dataset, (1,), (1, 2))
+    dataset = lazy_dataset.new([dataset[i] for i in range(len(dataset))])
+    for not_indexable in [
+        dataset.prefetch(num_workers=2, buffer_size=4),
+        dataset.filter(lambda example: True),
+    ]:
+        normalizer = Normalizer('x', center_axis=(1,), scale_axis=(1, 2))
+        # The prefetch of lazy_dataset requires single threaded numerics.
+        with mock.patch.dict(
+                os.environ, {'OMP_NUM_THREADS': '1', 'MKL_NUM_THREADS': '1'}):
+            normalizer.initialize_moments(not_indexable, num_workers=2)
+        np.testing.assert_allclose(normalizer.moments[0], expected[0])
+        np.testing.assert_allclose(normalizer.moments[1], expected[1])
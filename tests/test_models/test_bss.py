@@ -80,6 +80,21 @@ class TestDeepClusteringModel(unittest.TestCase):
             atol=1e-6
         )
 
+    def test_packed_input(self):
+        inputs = pt.data.example_to_device(self.inputs)
+        embedding = self.model(inputs)
+
+        packed = dict(
+            self.inputs,
+            Y_abs=pt.data.utils.pack_arrays(self.inputs['Y_abs'][::-1]),
+        )
+        packed = pt.data.example_to_device(packed)
+        embedding_packed = self.model(packed)[::-1]
+
+        for e, e_packed in zip(embedding, embedding_packed):
+            np.testing.assert_allclose(
+                e.detach().numpy(), e_packed.detach().numpy(), atol=1e-6)
+
 
 class TestPermutationInvariantTrainingModel(unittest.TestCase):
     # TODO: Test forward deterministic if not train
@@ -203,3 +218,24 @@ class TestPermutationInvariantTrainingModel(unittest.TestCase):
             mask2.detach().numpy(),
             atol=1e-6
         )
+
+    def test_packed_input(self):
+        self.model.eval()
+        inputs = pt.data.example_to_device(self.inputs)
+        mask = self.model(inputs)
+        review = self.model.review(inputs, mask)
+
+        packed = dict(
+            self.inputs, Y_abs=pt.data.utils.pack_arrays(self.inputs['Y_abs']))
+        packed = pt.data.example_to_device(packed)
+        mask_packed = self.model(packed)
+        review_packed = self.model.review(packed, mask_packed)
+
+        for m, m_packed in zip(mask, mask_packed):
+            np.testing.assert_allclose(
+                m.detach().numpy(), m_packed.detach().numpy(), atol=1e-6)
+        np.testing.assert_allclose(
+            review['losses']['pit_mse_loss'].detach().numpy(),
+            review_packed['losses']['pit_mse_loss'].detach().numpy(),
+            rtol=1e-6,
+        )
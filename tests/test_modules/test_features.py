@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+import torch
+from paderbox.transform.module_fbank import MelTransform as PbMelTransform
+from paderbox.transform.module_stft import stft as pb_stft
+
+from padertorch.modules.features import (
+    STFT, AudioFeatures, MelTransform, mel_filterbank
+)
+
+
+@pytest.mark.parametrize('fading', [None, 'full', 'half'])
+@pytest.mark.parametrize('pad', [True, False])
+@pytest.mark.parametrize('window', ['blackman', 'hann'])
+def test_stft_matches_paderbox(fading, pad, window):
+    x = np.random.RandomState(0).randn(2, 1999)
+    kwargs = dict(
+        size=512, shift=160, window_length=400, window=window,
+        fading=fading, pad=pad,
+    )
+    expected = pb_stft(x, **kwargs)
+    stft, frame_lengths = STFT(**kwargs)(torch.from_numpy(x).float())
+    assert frame_lengths is None
+    assert stft.shape == expected.shape
+    np.testing.assert_allclose(stft.numpy(), expected, atol=1e-3)
+
+
+@pytest.mark.parametrize('fading', [None, 'full', 'half'])
+@pytest.mark.parametrize('pad', [True, False])
+def test_padded_batch_equals_single_examples(fading, pad):
+    rng = np.random.RandomState(1)
+    lengths = [3000, 2500, 1001]
+    signals = [rng.randn(2, n).astype(np.float32) for n in lengths]
+    batch = np.zeros((3, 2, max(lengths)), np.float32)
+    for i, s in enumerate(signals):
+        # Garbage in the padding must not change the result.
+        batch[i] = 10.
+        batch[i, :, :lengths[i]] = s
+
+    stft = STFT(size=512, shift=160, window_length=400, fading=fading, pad=pad)
+    x, frame_lengths = stft(torch.from_numpy(batch), lengths)
+    assert isinstance(frame_lengths, list)
+    for i, s in enumerate(signals):
+        expected = pb_stft(
+            s, size=512, shift=160, window_length=400, fading=fading, pad=pad)
+        assert frame_lengths[i] == expected.shape[-2]
+        np.testing.assert_allclose(
+            x[i, :, :frame_lengths[i]].numpy(), expected, atol=1e-3)
+        assert torch.all(x[i, :, frame_lengths[i]:] == 0)
+
+    _, frame_lengths = stft(torch.from_numpy(batch), torch.tensor(lengths))
+    assert torch.is_tensor(frame_lengths)
+
+
+def test_audio_features():
+    rng = np.random.RandomState(2)
+    audio = rng.randn(2, 4000).astype(np.float32)
+    extractor = AudioFeatures(
+        sample_rate=16000, stft_size=512, stft_shift=160, window_length=400,
+        n_mels=40,
+    )
+    features, frame_lengths = extractor(torch.from_numpy(audio), [4000, 2000])
+    assert features.shape == (2, 27, 40)
+    assert frame_lengths == [27, 14]
+
+    spec = np.abs(pb_stft(
+        audio[1, :2000], size=512, shift=160, window_length=400)) ** 2
+    expected = np.log(spec @ mel_filterbank(16000, 512, 40) + 1e-18)
+    np.testing.assert_allclose(
+        features[1, :14].numpy(), expected, rtol=1e-3, atol=1e-3)
+
+
+def test_mel_transform_trainable():
+    mel = MelTransform(16000, 512, 40, trainable=True)
+    assert [name for name, _ in mel.named_parameters()] == ['fbanks']
+    mel = MelTransform(16000, 512, 40)
+    assert list(mel.parameters()) == []
+    assert 'fbanks' in mel.state_dict()
+
+
+@pytest.mark.parametrize('sample_rate,fft_length,n_mels,fmin,fmax', [
+    (16000, 512, 40, 50, None),
+    (16000, 1024, 80, 0, 8000),
+    (8000, 256, 23, 100, 3800),
+    (44100, 2048, 128, 20, None),
+])
+def test_mel_filterbank_matches_paderbox(
+        sample_rate, fft_length, n_mels, fmin, fmax):
+    expected = PbMelTransform(
+        sample_rate, fft_length, n_mels, lowest_frequency=fmin,
+        highest_frequency=fmax,
+    ).fbanks
+    np.testing.assert_allclose(
+        mel_filterbank(sample_rate, fft_length, n_mels, fmin, fmax),
+        expected, rtol=1e-6, atol=1e-7,
+    )
@@ -0,0 +1,27 @@
+import unittest
+
+import numpy as np
+import torch
+
+import padertorch as pt
+from padertorch.modules.normalization import Normalization
+
+
+class TestNormalization(unittest.TestCase):
+    def setUp(self):
+        self.sequence = [torch.randn(l, 5) for l in [4, 9, 6]]
+        self.packed = pt.ops.pack_sequence(
+            self.sequence, enforce_sorted=False)
+
+    def test_packed_equal_to_single_sequence(self):
+        for order in ['l1', 'l2', 'mean']:
+            with self.subTest(order=order):
+                normalization = Normalization(5, order=order)
+                actual = pt.ops.unpack_sequence(
+                    normalization(self.packed))
+                for a, sequence in zip(actual, self.sequence):
+                    reference = normalization(sequence.clone())
+                    np.testing.assert_allclose(
+                        a.detach().numpy(), reference.detach().numpy(),
+                        rtol=1e-5, atol=1e-6,
+                    )
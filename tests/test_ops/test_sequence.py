@@ -63,3 +63,134 @@ class TestPackModule(unittest.TestCase):
         actual = pts.ops.pack_padded_sequence(self.padded, self.lengths)
         assert isinstance(actual, type(self.packed))
         np.testing.assert_equal(actual.data.numpy(), self.packed.data.numpy())
+
+
+class TestPackIndices(unittest.TestCase):
+    def setUp(self):
+        self.lengths = [3, 7, 1, 5]
+        self.sequence = [torch.rand(l, 4) for l in self.lengths]
+
+    def assert_packed_equal(self, actual, reference):
+        for a, r in zip(actual, reference):
+            if r is None:
+                assert a is None, a
+            else:
+                np.testing.assert_equal(a.numpy(), r.numpy())
+
+    def test_pack_sequence(self):
+        sequence = sorted(self.sequence, key=len, reverse=True)
+        self.assert_packed_equal(
+            pts.ops.pack_sequence(sequence),
+            torch.nn.utils.rnn.pack_sequence(sequence),
+        )
+
+    def test_pack_sequence_unsorted(self):
+        self.assert_packed_equal(
+            pts.ops.pack_sequence(self.sequence, enforce_sorted=False),
+            torch.nn.utils.rnn.pack_sequence(
+                self.sequence, enforce_sorted=False),
+        )
+
+    def test_pack_sequence_enforce_sorted(self):
+        with self.assertRaises(AssertionError):
+            pts.ops.pack_sequence(self.sequence)
+
+    def test_pack_arrays(self):
+        packed = pts.data.utils.pack_arrays(
+            [s.numpy() for s in self.sequence])
+        packed = pts.ops.as_packed_sequence(
+            pts.data.example_to_device(packed))
+        self.assert_packed_equal(
+            packed,
+            torch.nn.utils.rnn.pack_sequence(
+                self.sequence, enforce_sorted=False),
+        )
+        for actual, reference in zip(
+                pts.ops.as_sequence_list(packed), self.sequence):
+            np.testing.assert_equal(actual.numpy(), reference.numpy())
+
+    def test_pack_arrays_include_channel(self):
+        entries = [torch.rand(2, l, 4) for l in self.lengths]
+        packed = pts.data.utils.pack_arrays(
+            [e.numpy() for e in entries], include_channel=True)
+        packed = pts.data.example_to_device(packed)
+        self.assert_packed_equal(
+            pts.ops.as_packed_sequence(packed),
+            pts.ops.pack_sequence_include_channel(
+                entries, enforce_sorted=False),
+        )
+        for actual, reference in zip(
+                pts.ops.as_sequence_list(packed), entries):
+            np.testing.assert_equal(actual.numpy(), reference.numpy())
+
+    def test_packed_sequence_ids(self):
+        packed = pts.ops.pack_sequence(self.sequence, enforce_sorted=False)
+        ids = pts.ops.packed_sequence_ids(packed)
+        np.testing.assert_equal(
+            np.bincount(ids.numpy()), self.lengths)
+        for i, sequence in enumerate(self.sequence):
+            np.testing.assert_equal(
+                packed.data[ids == i].numpy(), sequence.numpy())
+
+
+class TestSequenceReduction(unittest.TestCase):
+    def setUp(self):
+        self.lengths = [3, 7, 1, 5]
+        self.sequence = [torch.randn(l, 4, 2) for l in self.lengths]
+        self.packed = pts.ops.pack_sequence(
+            self.sequence, enforce_sorted=False)
+
+    def check(self, function, axis, **kwargs):
+        actual = pts.ops.sequence_reduction(
+            function, self.packed, axis=axis, **kwargs)
+        # The axes of a single sequence
+        sequence_axis = [a - 1 if a > 0 else a for a in axis]
+        for a, sequence in zip(actual, self.sequence):
+            reference = function(sequence, dim=sequence_axis, **kwargs)
+            np.testing.assert_allclose(
+                a.numpy(), reference.numpy(), rtol=1e-5, atol=1e-6)
+
+    def test_reductions(self):
+        for function in [
+            torch.sum, torch.mean, torch.amax, torch.amin, torch.logsumexp,
+            torch.var,
+        ]:
+            for axis in [(0,), (0, 2), (0, 2, 3)]:
+                with self.subTest(function=function, axis=axis):
+                    if function is torch.var and axis == (0,):
+                        # A sequence with a single frame
+                        continue
+                    self.check(function, axis)
+
+    def test_keepdims(self):
+        actual = pts.ops.sequence_reduction(
+            torch.mean, self.packed, axis=(0, 3), keepdims=True)
+        assert isinstance(actual, PackedSequence), type(actual)
+        actual = pts.ops.unpack_sequence(actual)
+        for a, sequence in zip(actual, self.sequence):
+            np.testing.assert_allclose(
+                a.numpy(),
+                torch.mean(sequence, dim=(0, 2), keepdim=True).numpy(),
+                rtol=1e-5,
+            )
+
+    def test_time_and_batch(self):
+        actual = pts.ops.sequence_reduction(
+            torch.sum, self.packed, axis=(0, 1))
+        np.testing.assert_allclose(
+            actual.numpy(),
+            torch.cat(self.sequence).sum(dim=0).numpy(),
+            rtol=1e-5, atol=1e-6,
+        )
+
+    def test_expand_packed(self):
+        mean = pts.ops.sequence_reduction(
+            torch.mean, self.packed, axis=0, keepdims=True)
+        centered = self.packed._replace(
+            data=self.packed.data - pts.ops.expand_packed(mean, self.packed))
+        for c, sequence in zip(
+                pts.ops.unpack_sequence(centered), self.sequence):
+            np.testing.assert_allclose(
+                c.numpy(), (sequence - sequence.mean(dim=0)).numpy(),
+                atol=1e-6,
+            )
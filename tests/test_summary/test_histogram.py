@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import torch
+from tensorboardX.summary import make_histogram
+
+import padertorch as pt
+
+
+@pytest.mark.parametrize('num_updates', [1, 3, 10])
+def test_tensorflow_bins_equal_to_tensorboardx(num_updates):
+    rng = np.random.RandomState(0)
+    values = [rng.randn(rng.randint(1, 100)) * 10 for _ in range(num_updates)]
+
+    sketch = pt.summary.HistogramSketch()
+    for v in values:
+        sketch.update(torch.tensor(v))
+
+    values = np.concatenate(values)
+    # Same bins as tensorboardX.SummaryWriter.default_bins
+    expect = make_histogram(values, pt.summary.histogram._tensorflow_bins())
+
+    bucket_limits, bucket_counts = sketch.bucket_limits_and_counts()
+    np.testing.assert_allclose(bucket_limits, expect.bucket_limit)
+    np.testing.assert_equal(bucket_counts, expect.bucket)
+    assert sketch.num == expect.num
+    np.testing.assert_allclose(sketch.min, expect.min)
+    np.testing.assert_allclose(sketch.max, expect.max)
+    np.testing.assert_allclose(sketch.sum, expect.sum)
+    np.testing.assert_allclose(sketch.sum_squares, expect.sum_squares)
+
+
+def test_adaptive_bins():
+    rng = np.random.RandomState(0)
+    sketch = pt.summary.HistogramSketch(bins=64)
+    values = []
+    for scale in [1, 10, 100]:
+        v = rng.uniform(-scale, scale, size=100)
+        values.append(v)
+        sketch.update(v)
+    values = np.concatenate(values)
+
+    assert sketch.counts.shape == (64,)
+    assert sketch.counts.sum() == values.size
+    assert sketch.edges[0] <= values.min()
+    assert sketch.edges[-1] >= values.max()
+    counts, _ = np.histogram(values, bins=sketch.edges)
+    np.testing.assert_equal(sketch.counts, counts)
+
+
+def test_fixed_range():
+    sketch = pt.summary.HistogramSketch(bins=2, range=(0, 1))
+    sketch.update([-1., 0.25, 0.75, 1., 2.])
+    np.testing.assert_equal(sketch.counts, [2, 3])
+    assert (sketch.min, sketch.max) == (-1., 2.)
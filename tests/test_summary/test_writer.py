@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+import padertorch as pt
+
+
+class SlowWriter:
+    def __init__(self):
+        self.calls = []
+        self.closed = False
+        self.release = threading.Event()
+
+    def add_scalar(self, tag, scalar_value, global_step):
+        self.release.wait()
+        self.calls.append((tag, scalar_value, global_step))
+
+    def add_image(self, tag, img_tensor, global_step):
+        raise ValueError('Broken image')
+
+    def close(self):
+        self.closed = True
+
+
+def test_order_and_backpressure():
+    writer = SlowWriter()
+    async_writer = pt.summary.AsyncSummaryWriter(writer, max_queue_size=2)
+
+    def produce():
+        for i in range(5):
+            async_writer.add_scalar('loss', i, i)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    producer.join(timeout=0.2)
+    # The worker blocks in the first call, the queue is full
+    assert producer.is_alive()
+    writer.release.set()
+    producer.join()
+    async_writer.close()
+
+    assert writer.calls == [('loss', i, i) for i in range(5)], writer.calls
+    assert writer.closed
+
+
+def test_exception_propagation():
+    writer = SlowWriter()
+    writer.release.set()
+    async_writer = pt.summary.AsyncSummaryWriter(writer)
+    async_writer.add_image('image', None, 0)
+    with pytest.raises(RuntimeError) as excinfo:
+        async_writer.close()
+    assert isinstance(excinfo.value.__cause__, ValueError)
+    assert writer.closed
+
+    with pytest.raises(AttributeError):
+        # Missing methods raise in the caller thread
+        pt.summary.AsyncSummaryWriter(writer).add_figure
+
+
+def test_interactive_writer():
+    writer = pt.trainer.InteractiveWriter()
+    async_writer = pt.summary.AsyncSummaryWriter(writer)
+    for i in range(3):
+        async_writer.add_scalar('training/loss', i, i)
+    async_writer.flush()
+    assert [s['value'] for s in writer.scalars['training/loss']] == [0, 1, 2]
+    async_writer.close()
@@ -0,0 +1,100 @@
+"""
+Benchmark of the scalar accumulation of `pt.train.hooks.SummaryHook` for
+one summary interval (`update_summary` in each step and
+`materialize_scalars` at the end).
+
+    python tests/test_train/benchmark_summary_hook.py [--device 0] [--steps 1000]
+
+The SummaryHook keeps a running sum and a count per scalar tensor on the
+device. The references are
+ - `.item()` in each step, i.e. a device synchronisation in each step, and
+ - a list of the detached tensors of each step, that is moved with one
+   transfer to the host at the end, i.e. the memory grows with the
+   interval.
+
+On the CPU, `.item()` has no sync and is the fastest, the comparison that
+matters is on a GPU.
+"""
+import argparse
+import timeit
+from collections import defaultdict
+
+import torch
+
+import padertorch as pt
+
+
+def get_reviews(steps, num_scalars, device):
+    return [
+        {
+            'loss': torch.rand((), device=device),
+            'scalars': {
+                f'scalar_{i}': torch.rand((), device=device)
+                for i in range(num_scalars)
+            },
+        }
+        for _ in range(steps)
+    ]
+
+
+def item_summary(reviews):
+    # The previous implementation: One device sync per scalar and step
+    scalars = defaultdict(list)
+    for review in reviews:
+        scalars['loss'].append(review['loss'].item())
+        for key, value in review['scalars'].items():
+            scalars[key].append(value.item())
+    return scalars
+
+
+def list_summary(reviews):
+    scalars = defaultdict(list)
+    for review in reviews:
+        scalars['loss'].append(review['loss'].detach())
+        for key, value in review['scalars'].items():
+            scalars[key].append(value.detach())
+    return {
+        key: torch.stack(values).cpu().tolist()
+        for key, values in scalars.items()
+    }
+
+
+def hook_summary(reviews):
+    hook = pt.train.hooks.SummaryHook((1, 'iteration'))
+    for review in reviews:
+        hook.update_summary(review)
+    return hook.materialize_scalars()
+
+
+def benchmark(name, fn, reviews, device, number):
+    def run():
+        fn(reviews)
+        if torch.device(device).type == 'cuda':
+            torch.cuda.synchronize(device)
+
+    run()  # warm up
+    seconds = min(timeit.repeat(run, number=number, repeat=5)) / number
+    print(f'{name:>20}: {seconds * 1e6 / len(reviews):8.2f} us/step')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--device', default=0 if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--steps', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--num_scalars', type=int, default=8)
+    parser.add_argument('--number', type=int, default=5)
+    args = parser.parse_args()
+    device = int(args.device) if str(args.device).isdigit() else args.device
+
+    for steps in args.steps:
+        print(f'{steps} steps (summary_trigger), 1 loss + '
+              f'{args.num_scalars} scalars, device {device}')
+        reviews = get_reviews(steps, args.num_scalars, device)
+        benchmark('item', item_summary, reviews, device, args.number)
+        benchmark('list', list_summary, reviews, device, args.number)
+        benchmark('SummaryHook', hook_summary, reviews, device, args.number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import os
+import signal
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import paderbox as pb
+import pytest
+import torch
+
+import padertorch as pt
+
+
+class Model(pt.Model):
+
+    def __init__(self):
+        super().__init__()
+        self.l = torch.nn.Linear(3, 2)
+
+    def forward(self, inputs):
+        return self.l(inputs['x'])
+
+    def review(self, inputs, outputs):
+        return {'loss': torch.mean((outputs - inputs['y']) ** 2)}
+
+
+def get_dataset(size=8):
+    rng = np.random.RandomState(0)
+    return [
+        {
+            'x': rng.randn(3).astype(np.float32),
+            'y': rng.randn(2).astype(np.float32),
+        }
+        for _ in range(size)
+    ]
+
+
+class Writer(pt.trainer.InteractiveWriter):
+    validation_losses = []
+
+    def __init__(self, storage_dir):
+        super().__init__()
+
+    def add_scalar(self, tag, scalar_value, global_step, walltime=None):
+        if tag == 'validation/loss':
+            self.validation_losses.append((global_step, scalar_value))
+
+
+def train(storage_dir, async_validation):
+    torch.manual_seed(0)
+    trainer = pt.Trainer(
+        Model(),
+        storage_dir=storage_dir,
+        optimizer=pt.optimizer.SGD(lr=0.1),
+        summary_trigger=(2, 'iteration'),
+        checkpoint_trigger=(2, 'iteration'),
+        stop_trigger=(8, 'iteration'),
+    )
+    trainer.writer_cls = Writer
+    trainer.register_validation_hook(
+        get_dataset(4), max_checkpoints=None,
+        async_validation=async_validation,
+    )
+    Writer.validation_losses = []
+    trainer.train(get_dataset(), progress_bar=False, device='cpu')
+    return Writer.validation_losses
+
+
+def test_async_validation():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        sync_losses = train(tmp_dir / 'sync', async_validation=False)
+        async_losses = train(tmp_dir / 'async', async_validation=True)
+
+        # The validation summary is written at the iteration of the snapshot.
+        assert [i for i, _ in sync_losses] == [0, 2, 4, 6, 8], sync_losses
+        assert [i for i, _ in async_losses] == [0, 2, 4, 6, 8], async_losses
+        np.testing.assert_allclose(
+            [loss for _, loss in sync_losses],
+            [loss for _, loss in async_losses],
+            rtol=1e-6,
+        )
+
+        sync_state = pb.io.load_json(
+            tmp_dir / 'sync' / 'checkpoints' / 'validation_state.json')
+        async_state = pb.io.load_json(
+            tmp_dir / 'async' / 'checkpoints' / 'validation_state.json')
+        assert [name for name, _ in sync_state['ckpt_ranking']] == \
+            [name for name, _ in async_state['ckpt_ranking']], \
+            (sync_state, async_state)
+        assert (tmp_dir / 'async' / 'checkpoints' / 'ckpt_best_loss.pth') \
+            .resolve().name == sync_state['ckpt_ranking'][0][0]
+
+
+def test_async_validation_early_stopping():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        torch.manual_seed(0)
+        trainer = pt.Trainer(
+            Model(),
+            storage_dir=Path(tmp_dir),
+            # A large learning rate, so that the validation loss degrades.
+            optimizer=pt.optimizer.SGD(lr=10.),
+            summary_trigger=(1, 'iteration'),
+            checkpoint_trigger=(1, 'iteration'),
+            stop_trigger=(100, 'iteration'),
+        )
+        trainer.writer_cls = Writer
+        trainer.register_hook(pt.train.hooks.ValidationHook(
+            (1, 'iteration'), get_dataset(4), max_checkpoints=None,
+            early_stopping_patience=0, asynchronous=True,
+        ))
+        trainer.train(get_dataset(), progress_bar=False, device='cpu')
+        assert trainer.iteration < 100, trainer.iteration
+
+
+class KilledModel(Model):
+    def review(self, inputs, outputs):
+        if not self.training:
+            # The validation kills the background process.
+            os.kill(os.getpid(), signal.SIGKILL)
+        return super().review(inputs, outputs)
+
+
+def test_async_validation_killed_worker():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        trainer = pt.Trainer(
+            KilledModel(),
+            storage_dir=Path(tmp_dir),
+            optimizer=pt.optimizer.SGD(lr=0.1),
+            summary_trigger=(1, 'iteration'),
+            checkpoint_trigger=(1, 'iteration'),
+            stop_trigger=(8, 'iteration'),
+        )
+        trainer.writer_cls = Writer
+        trainer.register_hook(pt.train.hooks.ValidationHook(
+            (1, 'iteration'), get_dataset(4), max_checkpoints=None,
+            asynchronous=True,
+        ))
+        with pytest.raises(RuntimeError, match='died unexpectedly'):
+            trainer.train(get_dataset(), progress_bar=False, device='cpu')
@@ -0,0 +1,208 @@
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+
+import padertorch as pt
+
+
+class Model(pt.Model):
+
+    def __init__(self):
+        super().__init__()
+        self.l = torch.nn.Linear(3, 2)
+
+    def forward(self, inputs):
+        return self.l(inputs['x'])
+
+    def review(self, inputs, outputs):
+        return {'loss': torch.mean((outputs - inputs['y']) ** 2)}
+
+
+def get_dataset(size=8):
+    rng = np.random.RandomState(0)
+    return [
+        {
+            'x': rng.randn(3).astype(np.float32),
+            'y': rng.randn(2).astype(np.float32),
+        }
+        for _ in range(size)
+    ]
+
+
+def train(storage_dir, async_checkpoint):
+    torch.manual_seed(0)
+    trainer = pt.Trainer(
+        Model(),
+        storage_dir=storage_dir,
+        optimizer=pt.optimizer.Adam(),
+        summary_trigger=(2, 'iteration'),
+        checkpoint_trigger=(2, 'iteration'),
+        stop_trigger=(6, 'iteration'),
+        async_checkpoint=async_checkpoint,
+    )
+    trainer.register_validation_hook(get_dataset(2), max_checkpoints=None)
+    trainer.train(get_dataset(), progress_bar=False, device='cpu')
+    return trainer
+
+
+def test_async_checkpoint():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        train(tmp_dir / 'sync', async_checkpoint=False)
+        trainer = train(tmp_dir / 'async', async_checkpoint=True)
+
+        sync_files = sorted(
+            p.name for p in (tmp_dir / 'sync' / 'checkpoints').iterdir())
+        async_files = sorted(
+            p.name for p in (tmp_dir / 'async' / 'checkpoints').iterdir())
+        assert sync_files == async_files, (sync_files, async_files)
+        assert not any(f.endswith('.tmp') for f in async_files), async_files
+
+        latest = tmp_dir / 'async' / 'checkpoints' / 'ckpt_latest.pth'
+        assert latest.resolve().name == 'ckpt_6.pth', latest.resolve()
+
+        for name in sync_files:
+            if not name.endswith('.pth'):
+                continue
+            sync = torch.load(str(tmp_dir / 'sync' / 'checkpoints' / name))
+            async_ = torch.load(str(tmp_dir / 'async' / 'checkpoints' / name))
+            assert sync['iteration'] == async_['iteration'], name
+            for key, value in sync['model'].items():
+                np.testing.assert_equal(
+                    value.numpy(), async_['model'][key].numpy()
+                )
+
+        # The writer is flushed and stopped at the end of train.
+        assert trainer.checkpoint_store._writer._executor is None
+
+
+class MultiModel(pt.Model):
+
+    def __init__(self):
+        super().__init__()
+        self.a = Model()
+        self.b = Model()
+
+    def forward(self, inputs):
+        return self.a(inputs) + self.b(inputs)
+
+    def review(self, inputs, outputs):
+        return {'loss': torch.mean((outputs - inputs['y']) ** 2)}
+
+
+def test_tensor_checkpoint():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        for async_checkpoint in [False, True]:
+            storage_dir = tmp_dir / str(async_checkpoint)
+            torch.manual_seed(0)
+            trainer = pt.Trainer(
+                MultiModel(),
+                storage_dir=storage_dir,
+                optimizer=pt.optimizer.Adam(),
+                checkpoint_trigger=(2, 'iteration'),
+                stop_trigger=(4, 'iteration'),
+                async_checkpoint=async_checkpoint,
+                tensor_checkpoint=True,
+            )
+            trainer.register_validation_hook(get_dataset(2))
+            trainer.train(get_dataset(), progress_bar=False, device='cpu')
+
+            ckpt_dir = storage_dir / 'checkpoints'
+            # Only the best and the latest checkpoint are kept, the tensor
+            # checkpoints are removed with the pickled checkpoints.
+            pth = sorted(p.stem for p in ckpt_dir.glob('ckpt_[0-9]*.pth'))
+            tensors = sorted(p.stem for p in ckpt_dir.glob('*.tensors'))
+            assert pth == tensors, (pth, tensors)
+
+            ckpt = torch.load(str(ckpt_dir / 'ckpt_latest.pth'))
+            state_dict = pt.train.checkpoint.load_tensor_checkpoint(
+                pt.train.checkpoint.tensor_checkpoint_path(
+                    ckpt_dir / 'ckpt_latest.pth'),
+                'model.b',
+            )
+            assert set(state_dict.keys()) == {'l.weight', 'l.bias'}, state_dict
+            for key, value in state_dict.items():
+                np.testing.assert_equal(
+                    value.numpy(), ckpt['model'][f'b.{key}'].numpy())
+
+
+
+def test_back_off_from_memory(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        torch.manual_seed(0)
+        trainer = pt.Trainer(
+            Model(),
+            storage_dir=Path(tmp_dir),
+            # A large learning rate, so that the validation loss degrades.
+            optimizer=pt.optimizer.SGD(lr=10.),
+            summary_trigger=(1, 'iteration'),
+            checkpoint_trigger=(1, 'iteration'),
+            stop_trigger=(6, 'iteration'),
+            checkpoint_memory_bytes=10_000,
+        )
+        trainer.writer_cls = lambda storage_dir: pt.trainer.InteractiveWriter()
+        hook = pt.train.hooks.BackOffValidationHook(
+            (1, 'iteration'), get_dataset(4), max_checkpoints=2,
+            n_back_off=1, back_off_patience=0,
+        )
+        trainer.register_hook(hook)
+
+        loaded = []
+        load_state_dict = trainer.load_state_dict
+
+        def track_load_state_dict(state_dict):
+            loaded.append({
+                k: v.clone() for k, v in state_dict['model'].items()})
+            load_state_dict(state_dict)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('The back off reads the disk')
+
+        monkeypatch.setattr(trainer, 'load_state_dict', track_load_state_dict)
+        monkeypatch.setattr(torch, 'load', fail)
+        trainer.train(get_dataset(), progress_bar=False, device='cpu')
+        monkeypatch.undo()
+
+        assert hook.remaining_back_offs == 0, hook.remaining_back_offs
+        assert len(loaded) == 1, loaded
+        ckpt_dir = Path(tmp_dir) / 'checkpoints'
+        best = torch.load(str(ckpt_dir / 'ckpt_0.pth'))
+        for key, value in best['model'].items():
+            np.testing.assert_equal(value.numpy(), loaded[0][key].numpy())
+
+        store = trainer.checkpoint_store
+        assert store.memory_bytes <= 10_000, store.memory_bytes
+        assert ckpt_dir / 'ckpt_0.pth' in store.cached_checkpoints, \
+            store.cached_checkpoints
+        assert sorted(name for name, _ in hook.ckpt_ranking)[0] == \
+            'ckpt_0.pth', hook.ckpt_ranking
+
+
+def test_checkpoint_writer_order():
+    import threading
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ckpt_dir = Path(tmp_dir)
+        writer = pt.train.checkpoint.CheckpointWriter()
+        # Block the writer thread, that all submissions are pending.
+        release = threading.Event()
+        writer._submit(ckpt_dir / 'block', release.wait)
+        writer.submit({'iteration': 1}, ckpt_dir / 'ckpt_1.pth', verbose=False)
+        writer.submit({'iteration': 2}, ckpt_dir / 'ckpt_2.pth', verbose=False)
+        writer.submit({'iteration': 3}, ckpt_dir / 'ckpt_1.pth', verbose=False)
+        # Does not block, the symlink is moved after the pending writes.
+        writer.submit_symlink(
+            ckpt_dir / 'ckpt_latest.pth', ckpt_dir / 'ckpt_1.pth')
+        assert not (ckpt_dir / 'ckpt_1.pth').exists()
+        release.set()
+
+        # The second submission of ckpt_1.pth is after ckpt_2.pth.
+        writer.wait(ckpt_dir / 'ckpt_1.pth')
+        assert (ckpt_dir / 'ckpt_2.pth').exists()
+        assert torch.load(str(ckpt_dir / 'ckpt_1.pth'))['iteration'] == 3
+        writer.close()
+        latest = ckpt_dir / 'ckpt_latest.pth'
+        assert latest.resolve().name == 'ckpt_1.pth', latest.resolve()
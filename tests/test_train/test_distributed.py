@@ -0,0 +1,110 @@
+import socket
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+
+import padertorch as pt
+from padertorch.train.distributed import DistributedTrainer, launch
+
+
+class Model(pt.Model):
+
+    def __init__(self):
+        super().__init__()
+        self.l = torch.nn.Linear(3, 2)
+
+    def forward(self, inputs):
+        return self.l(inputs['x'])
+
+    def review(self, inputs, outputs):
+        return {
+            'loss': torch.mean((outputs - inputs['y']) ** 2),
+            'scalars': {'index': inputs['index']},
+        }
+
+
+def get_dataset(size=9):
+    rng = np.random.RandomState(0)
+    return [
+        {
+            'x': rng.randn(3).astype(np.float32),
+            'y': rng.randn(2).astype(np.float32),
+            'index': index,
+        }
+        for index in range(size)
+    ]
+
+
+def train(storage_dir, virtual_minibatch_size, prefetch_depth):
+    torch.manual_seed(pt.train.distributed.get_rank())
+    trainer = DistributedTrainer(
+        Model(),
+        storage_dir=storage_dir,
+        optimizer=pt.optimizer.SGD(),
+        summary_trigger=(1, 'epoch'),
+        checkpoint_trigger=(1, 'epoch'),
+        stop_trigger=(2, 'epoch'),
+        virtual_minibatch_size=virtual_minibatch_size,
+        prefetch_depth=prefetch_depth,
+    )
+    trainer.writer_cls = _Writer
+    trainer.register_validation_hook(get_dataset(2))
+    trainer.train(get_dataset(), progress_bar=False, device='cpu')
+
+    rank = pt.train.distributed.get_rank()
+    torch.save(
+        trainer.model.state_dict(),
+        str(Path(storage_dir) / f'model_rank_{rank}.pth'),
+    )
+
+
+class _Writer(pt.trainer.InteractiveWriter):
+    def __init__(self, storage_dir):
+        super().__init__()
+        self.storage_dir = Path(storage_dir)
+
+    def add_scalar(self, tag, scalar_value, global_step, walltime=None):
+        if tag == 'training/index':
+            with open(self.storage_dir / 'index.txt', 'a') as fd:
+                fd.write(f'{global_step} {scalar_value}\n')
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_distributed_trainer():
+    for virtual_minibatch_size, prefetch_depth in [(1, 0), (2, 0), (1, 2)]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            launch(
+                train, 2, tmp_dir, virtual_minibatch_size, prefetch_depth,
+                master_port=_free_port(), timeout=120,
+            )
+            tmp_dir = Path(tmp_dir)
+
+            # The replicas are identical
+            rank_0 = torch.load(str(tmp_dir / 'model_rank_0.pth'))
+            rank_1 = torch.load(str(tmp_dir / 'model_rank_1.pth'))
+            for key, value in rank_0.items():
+                np.testing.assert_allclose(
+                    value.numpy(), rank_1[key].numpy(), rtol=1e-6)
+
+            # Only rank 0 writes checkpoints, the replicas of the other
+            # ranks are compatible with the Trainer.
+            checkpoints = sorted(
+                p.name for p in (tmp_dir / 'checkpoints').iterdir())
+            assert 'ckpt_8.pth' in checkpoints, checkpoints
+            ckpt = torch.load(str(tmp_dir / 'checkpoints' / 'ckpt_8.pth'))
+            for key, value in rank_0.items():
+                np.testing.assert_allclose(
+                    value.numpy(), ckpt['model'][key].numpy())
+
+            # Each rank got 4 of the 9 examples per epoch and the summary
+            # contains the scalars of both ranks: rank 0 0, 2, 4, 6 and
+            # rank 1 1, 3, 5, 7.
+            index = (tmp_dir / 'index.txt').read_text().splitlines()
+            assert index == ['4 3.5', '8 3.5'], index
@@ -178,3 +178,64 @@ def test_summary_hook():
         ]
 
         assert events == expect, pretty([events, expect])
+
+
+def test_summary_hook_lazy_artifacts():
+    calls = []
+
+    def image_fn(value):
+        calls.append(value)
+        return torch.full((1, 2, 2), value)
+
+    hook = pt.train.hooks.SummaryHook((1, 'iteration'))
+    for i in range(5):
+        hook.update_summary({
+            'loss': torch.tensor(1.),
+            'images': {
+                'image': pt.summary.LazyArtifact(image_fn, float(i)),
+            },
+            'histograms': {
+                'histogram': lambda: torch.ones(3),
+            },
+        })
+    assert calls == [], calls
+
+    hook.evaluate_lazy_artifacts()
+    # Only the snapshot from the last step is evaluated
+    assert calls == [4.], calls
+    assert torch.equal(hook.summary['images']['image'],
+                       torch.full((1, 2, 2), 4.))
+    histogram = hook.summary['histograms']['histogram']
+    assert (histogram.num, histogram.sum) == (3, 3.), histogram
+
+
+def test_summary_hook_running_sums():
+    hook = pt.train.hooks.SummaryHook((1, 'iteration'))
+    for i in range(4):
+        hook.update_summary({
+            'loss': torch.tensor(float(i)),
+            'losses': {'kld': torch.tensor(2 * i)},
+            'scalars': {
+                'labels': torch.tensor([i, i]),
+                'mixed': torch.tensor(1.) if i else 5.,
+            },
+        })
+    # One sum and one count per scalar tensor key
+    assert set(hook._scalar_sums.keys()) == {'loss', 'kld', 'mixed'}
+    assert hook._scalar_sums['loss'][1] == 4
+    scalars = hook.materialize_scalars()['scalars']
+    assert scalars['loss'] == [1.5], scalars
+    assert scalars['kld'] == [3.], scalars
+    assert scalars['labels'] == [0, 0, 1, 1, 2, 2, 3, 3], scalars
+    # The mean of the running sum keeps its weight.
+    assert sum(scalars['mixed']) / len(scalars['mixed']) == 2., scalars
+    assert hook._scalar_sums == {}
+
+
+def test_validation_hook_cache():
+    hook = pt.train.hooks.ValidationHook(
+        (1, 'epoch'), [{'x': 1}], cache={'max_memory_bytes': 1000})
+    assert isinstance(hook.iterator, pt.data.CachedIterable), hook.iterator
+    assert hook.iterator.max_memory_bytes == 1000, hook.iterator
+    hook = pt.train.hooks.ValidationHook((1, 'epoch'), [{'x': 1}])
+    assert hook.iterator == [{'x': 1}], hook.iterator
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import torch
+
+import padertorch as pt
+
+
+class Model(pt.Model):
+    """Simulates an allocator failure for batches larger than max_batch."""
+    def __init__(self, max_batch=None):
+        super().__init__()
+        self.l = torch.nn.Linear(3, 2)
+        self.max_batch = max_batch
+
+    def forward(self, inputs):
+        x = inputs['x']
+        if self.max_batch is not None and len(x) > self.max_batch:
+            raise RuntimeError('CUDA out of memory. Tried to allocate 2 GiB')
+        return self.l(x)
+
+    def review(self, inputs, outputs):
+        return {
+            'loss': torch.mean((outputs - inputs['y']) ** 2),
+            'scalars': {'batch_size': torch.tensor(len(inputs['x']))},
+        }
+
+
+def get_example(batch_size=5):
+    rng = np.random.RandomState(0)
+    return {
+        'x': torch.tensor(rng.randn(batch_size, 3).astype(np.float32)),
+        'y': torch.tensor(rng.randn(batch_size, 2).astype(np.float32)),
+        'example_id': 'a',
+    }
+
+
+def get_trainer(model, max_oom_splits):
+    torch.manual_seed(0)
+    model.l.reset_parameters()
+    trainer = pt.Trainer(
+        model, storage_dir='/tmp/unused', optimizer=pt.optimizer.SGD(),
+        max_oom_splits=max_oom_splits,
+    )
+    trainer.to('cpu')
+    return trainer
+
+
+@pytest.mark.parametrize('max_batch,expected_splits', [
+    (5, 0), (3, 1), (2, 2), (1, 4)
+])
+def test_oom_split_gradient(max_batch, expected_splits):
+    reference = get_trainer(Model(), max_oom_splits=0)
+    _, reference_review = reference.train_step(get_example(), optimize=False)
+
+    trainer = get_trainer(Model(max_batch), max_oom_splits=3)
+    _, review = trainer.train_step(get_example(), optimize=False)
+
+    assert review['scalars']['oom_splits'] == expected_splits, review
+    np.testing.assert_allclose(
+        review['loss'].item(), reference_review['loss'].item(), rtol=1e-6)
+    for p_ref, p in zip(reference.model.parameters(),
+                        trainer.model.parameters()):
+        np.testing.assert_allclose(
+            p.grad.numpy(), p_ref.grad.numpy(), rtol=1e-5, atol=1e-7)
+    # The scalars of the parts are concatenated
+    assert review['scalars']['batch_size'].sum() == 5, review
+
+
+def test_oom_split_keeps_accumulated_gradients():
+    reference = get_trainer(Model(), max_oom_splits=0)
+    reference.train_step(get_example(2), optimize=False)
+    reference.train_step(get_example(), optimize=False)
+
+    trainer = get_trainer(Model(max_batch=2), max_oom_splits=3)
+    trainer.train_step(get_example(2), optimize=False)
+    trainer.train_step(get_example(), optimize=False)
+
+    for p_ref, p in zip(reference.model.parameters(),
+                        trainer.model.parameters()):
+        np.testing.assert_allclose(
+            p.grad.numpy(), p_ref.grad.numpy(), rtol=1e-5, atol=1e-7)
+
+
+def test_oom_split_not_possible():
+    trainer = get_trainer(Model(max_batch=0), max_oom_splits=10)
+    with pytest.raises(RuntimeError, match='could not be split'):
+        trainer.train_step(get_example(), optimize=False)
+
+    trainer = get_trainer(Model(max_batch=1), max_oom_splits=1)
+    with pytest.raises(RuntimeError, match='out of memory'):
+        trainer.train_step(get_example(), optimize=False)
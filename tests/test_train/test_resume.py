@@ -0,0 +1,92 @@
+import tempfile
+from pathlib import Path
+
+import lazy_dataset
+import numpy as np
+import torch
+
+import padertorch as pt
+
+
+class Model(pt.Model):
+
+    def __init__(self):
+        super().__init__()
+        self.l = torch.nn.Linear(3, 2)
+        self.seen = []
+
+    def forward(self, inputs):
+        self.seen.append(int(inputs['index']))
+        return self.l(inputs['x'])
+
+    def review(self, inputs, outputs):
+        return {'loss': torch.mean((outputs - inputs['y']) ** 2)}
+
+
+def get_dataset(size=5):
+    rng = np.random.RandomState(0)
+    return lazy_dataset.new([
+        {
+            'x': rng.randn(3).astype(np.float32),
+            'y': rng.randn(2).astype(np.float32),
+            'index': index,
+        }
+        for index in range(size)
+    ])
+
+
+class Reshuffle:
+    """Draws a new permutation from the global random state per epoch."""
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __iter__(self):
+        for index in np.random.permutation(len(self.dataset)):
+            yield self.dataset[int(index)]
+
+
+def train(storage_dir, dataset, stop_iteration, resume=False):
+    trainer = pt.Trainer(
+        Model(),
+        storage_dir=storage_dir,
+        optimizer=pt.optimizer.SGD(),
+        summary_trigger=(1, 'epoch'),
+        checkpoint_trigger=(1, 'epoch'),
+        stop_trigger=(stop_iteration, 'iteration'),
+    )
+    trainer.train(dataset, progress_bar=False, device='cpu', resume=resume)
+    return trainer
+
+
+def test_resume_in_the_middle_of_an_epoch():
+    for reshuffle in [False, True]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dataset = get_dataset()
+            if reshuffle:
+                dataset = Reshuffle(dataset)
+
+            np.random.seed(0)
+            expected = train(Path(tmp_dir) / 'a', dataset, 12).model.seen
+
+            np.random.seed(0)
+            first = train(Path(tmp_dir) / 'b', dataset, 7).model.seen
+            ckpt = torch.load(
+                str(Path(tmp_dir) / 'b' / 'checkpoints' / 'ckpt_7.pth'))
+            assert (ckpt['epoch'], ckpt['iteration_in_epoch']) == (1, 2), ckpt
+
+            # A new process has a different random state.
+            np.random.seed(1)
+            second = train(
+                Path(tmp_dir) / 'b', dataset, 12, resume=True).model.seen
+
+            assert len(expected) == 12, expected
+            assert first + second == expected, (first, second, expected)
+
+            if reshuffle:
+                assert sorted(expected[5:10]) == list(range(5)), expected
+                assert expected[:5] != expected[5:10], expected
+            else:
+                assert expected == [0, 1, 2, 3, 4] * 2 + [0, 1], expected